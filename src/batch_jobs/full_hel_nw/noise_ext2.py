@@ -4,7 +4,6 @@ import geopandas as gpd
 import osmnx as ox
 import networkx as nx
 from fiona.crs import from_epsg
-from multiprocessing import current_process, Pool
 import time
 import utils.geometry as geom_utils
 import utils.files as files
@@ -14,7 +13,6 @@ import utils.utils as utils
 
 # READ NOISES
 noise_polys = files.get_noise_polygons()
-noise_polys_sind = noise_polys.sindex
 
 # READ NETWORK
 graph = files.get_network_full_noise(directed=False)
@@ -24,33 +22,14 @@ edge_dicts = nw.get_all_edge_dicts(graph, attrs=['geometry', 'length'])
 edge_count = len(edge_dicts)
 print('Edges in the graph:', edge_count)
 
-# FUNCTION FOR EXTRACTING NOISES TO EDGES QUICKLY
-def get_edge_noises_df(edge_dicts):
-    edge_gdf_sub = gpd.GeoDataFrame(edge_dicts, crs=from_epsg(3879))[['geometry', 'length', 'uvkey']]
-    # build spatial indexes
-    edges_sind = edge_gdf_sub.sindex
-    # add noise split lines as list
-    edge_gdf_sub['split_lines'] = [geom_utils.get_split_lines_list(line_geom, noise_polys) for line_geom in edge_gdf_sub['geometry']]
-    # explode new rows from split lines column
-    split_lines = geom_utils.explode_lines_to_split_lines(edge_gdf_sub, 'uvkey')
-    # join noises to split lines
-    split_line_noises = exps.get_noise_attrs_to_split_lines(split_lines, noise_polys)
-    # aggregate noises back to edges
-    edge_noises = exps.aggregate_line_noises(split_line_noises, 'uvkey')
-    return edge_noises
-
-# WITH POOL
-edge_set = edge_dicts #[:9000]
-edge_chunks = utils.get_list_chunks(edge_set, 3000)
-
-pool = Pool(processes=3)
+# EXTRACT NOISES TO ALL EDGES AT ONCE
+edge_gdf = gpd.GeoDataFrame(edge_dicts, crs=from_epsg(3879))[['geometry', 'length', 'uvkey']]
 start_time = time.time()
-edge_noise_dfs = pool.map(get_edge_noises_df, edge_chunks)
+edge_noises = exps.get_line_noises_df(edge_gdf, 'uvkey', noise_polys)
 print('Noises extracted.')
 
 # UPDATE NOISES TO GRAPH
-for edge_noises in edge_noise_dfs:
-    nw.update_edge_noises_to_graph(edge_noises, graph)
+nw.update_edge_noises_to_graph(edge_noises, graph)
 print('Noises updated.')
 
 # EXPORT GRAPH
@@ -64,6 +43,6 @@ print('Graph with noises exported.')
 
 # PRINT TIMES
 time_elapsed = time.time() - start_time
-edge_time = round(time_elapsed/len(edge_set), 5)
+edge_time = round(time_elapsed/edge_count, 5)
 print('\n--- %s minutes ---' % (round(time_elapsed/60, 2)))
 print('--- %s seconds per edge ---' % (edge_time))
@@ -3,7 +3,6 @@ import pandas as pd
 import geopandas as gpd
 import osmnx as ox
 import networkx as nx
-from multiprocessing import current_process, Pool
 import time
 import utils.geometry as geom_utils
 import utils.files as files
@@ -22,25 +21,11 @@ edge_count = len(edge_dicts)
 print('Edges in the graph:', edge_count)
 edge_dicts[:2]
 
-# EXTRACT NOISES TO EDGES QUICKLY
-def get_edge_noises_df(edge_dicts):
-    edge_gdf_sub = nw.get_edge_gdf(edge_dicts, ['geometry', 'length', 'uvkey'])
-    # add noise split lines as list
-    edge_gdf_sub['split_lines'] = [geom_utils.get_split_lines_list(line_geom, noise_polys) for line_geom in edge_gdf_sub['geometry']]
-    # explode new rows from split lines column
-    split_lines = geom_utils.explode_lines_to_split_lines(edge_gdf_sub, 'uvkey')
-    # join noises to split lines
-    split_line_noises = exps.get_noise_attrs_to_split_lines(split_lines, noise_polys)
-    # aggregate noises back to edges
-    edge_noises = exps.aggregate_line_noises(split_line_noises, 'uvkey')
-    return edge_noises
-
-# edge_set = edge_dicts[:1000]
-edge_chunks = utils.get_list_chunks(edge_dicts, 300)
-pool = Pool(processes=15)
+# EXTRACT NOISES TO ALL EDGES AT ONCE
+edge_gdf = nw.get_edge_gdf(graph_proj, attrs=['geometry', 'length'])
 start_time = time.time()
 
-edge_noise_dfs = pool.map(get_edge_noises_df, edge_chunks)
+edge_noises = exps.get_line_noises_df(edge_gdf, 'uvkey', noise_polys)
 
 time_elapsed = round(time.time() - start_time, 1)
 edge_time = round(time_elapsed/len(edge_dicts), 3)
@@ -48,7 +33,6 @@ print('\n--- %s seconds ---' % (round(time_elapsed, 1)))
 print('--- %s seconds per edge ---' % (edge_time))
 
 #%% UPDATE NOISES TO GRAPH
-for edge_noises in edge_noise_dfs:
-    nw.update_edge_noises_to_graph(edge_noises, graph_proj)
+nw.update_edge_noises_to_graph(edge_noises, graph_proj)
 
 ox.save_graphml(graph_proj, filename='kumpula_u_g_n.graphml', folder='graphs', gephi=False)
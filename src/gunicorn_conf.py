@@ -0,0 +1,29 @@
+import os
+import multiprocessing
+
+# Production serving of the quiet path app: gunicorn -c gunicorn_conf.py quiet_paths_app:app
+# The graph, noise costs & snapping index are loaded once in the master process (when_ready) before the workers are
+# forked, so the workers share them (memory mapped snapshot & copy-on-write arrays that routing does not modify)
+# instead of each loading a copy of the graph.
+# Graceful reload: kill -HUP <master pid> restarts the workers with the graph of the master. To load a new graph
+# snapshot (or code), start a new master with kill -USR2 <master pid>: the old workers keep serving while the new
+# master loads the graph, stop the old master with kill -QUIT <old master pid> after the new workers report ready
+# (GET /ready).
+
+bind = os.environ.get('QP_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('QP_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('QP_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+# routing a long OD pair with all noise tolerances may take a few seconds
+timeout = int(os.environ.get('QP_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+errorlog = '-'
+
+def when_ready(server):
+    # called in the master after preloading the app and before forking the workers
+    import quiet_paths_app
+    quiet_paths_app.init_routing()
+    server.log.info('Graph loaded (ready: %s), serving with %s workers of %s threads', quiet_paths_app.is_ready(), workers, threads)
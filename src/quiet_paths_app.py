@@ -2,9 +2,11 @@
 from flask import Flask
 from flask_cors import CORS
 from flask import jsonify
-import geopandas as gpd
-from fiona.crs import from_epsg
+from flask import request
+from flask import Response
 import time
+import threading
+import traceback
 import utils.files as files
 import utils.routing as rt
 import utils.geometry as geom_utils
@@ -12,27 +14,68 @@ import utils.networks as nw
 import utils.exposures as exps
 import utils.quiet_paths as qp
 import utils.utils as utils
+import utils.csr_graph as csr
+import utils.snapping as snapping
+import utils.path_cache as path_cache
 
 app = Flask(__name__)
 CORS(app)
 
 # INITIALIZE GRAPH
-start_time = time.time()
+# graph, noise costs & snapping index are loaded by init_routing: if served with gunicorn, once in the master before
+# forking the workers (when_ready in gunicorn_conf.py) so that the workers share them. The development server loads
+# them in a background thread (start_init) and answers during the loading: routing requests get 503 until all parts
+# are ready (reported by /ready).
+init_state = { 'graph': False, 'noise_costs': False, 'snap_index': False }
+init_error = None
+init_thread = None
+init_lock = threading.Lock()
 nts = qp.get_noise_tolerances()
-graph = files.get_network_full_noise()
-# graph = files.get_network_kumpula_noise()
-db_costs = qp.get_db_costs(version=3)
-print('Graph of', graph.size(), 'edges read.')
-edge_gdf = nw.get_edge_gdf(graph, attrs=['geometry', 'length', 'noises'])
-node_gdf = nw.get_node_gdf(graph)
-print('Network features extracted.')
-nw.set_graph_noise_costs(graph, edge_gdf, db_costs=db_costs, nts=nts)
-edge_gdf = edge_gdf[['uvkey', 'geometry', 'noises']]
-print('Noise costs set.')
-edges_sind = edge_gdf.sindex
-nodes_sind = node_gdf.sindex
-print('Spatial index built.')
-utils.print_duration(start_time, 'Network initialized.')
+costs_version = 3
+db_costs = qp.get_db_costs(version=costs_version)
+csr_graph = None
+snap_index = None
+snapshot_version = None
+max_batch_ods = 200
+# cache of path responses keyed by snapped origin & destination (invalidated if the graph snapshot changes)
+path_cache_d = path_cache.get_path_cache(max_entries=5000, max_bytes=200*1024**2, ttl=6*3600)
+
+def init_routing():
+    global csr_graph, snap_index, snapshot_version, init_error
+    start_time = time.time()
+    try:
+        graph_arrays = files.get_network_full_noise_snapshot()
+        # graph_arrays = files.get_network_kumpula_noise_snapshot()
+        snapshot_version = files.get_snapshot_version(graph_arrays)
+        csr_graph = csr.get_csr_graph(graph_arrays)
+        init_state['graph'] = True
+        print('Graph of', csr_graph['edge_count'], 'edges read.')
+        csr.set_noise_costs(csr_graph, db_costs=db_costs, version=costs_version)
+        init_state['noise_costs'] = True
+        print('Routing graph & base noise costs set.')
+        snap_index = snapping.get_snap_index(csr_graph)
+        init_state['snap_index'] = True
+        print('Snapping index built.')
+        utils.print_duration(start_time, 'Network initialized.')
+    except Exception as e:
+        # the app stays unready (503) instead of failing to start, the error is reported by /ready
+        init_error = repr(e)
+        traceback.print_exc()
+
+def start_init():
+    # starts loading the graph in a background thread (once per process, threads do not survive forks)
+    global init_thread
+    with init_lock:
+        if (init_thread is None):
+            init_thread = threading.Thread(target=init_routing, name='init_routing', daemon=True)
+            init_thread.start()
+    return init_thread
+
+def is_ready():
+    return all(init_state.values())
+
+def get_not_ready_response():
+    return jsonify({'error': 'Routing graph is not ready yet' if init_error is None else 'Routing graph could not be loaded'}), 503
 
 @app.route('/')
 def hello_world():
@@ -40,16 +83,24 @@ def hello_world():
 
 @app.route('/quietpaths/<from_lat>,<from_lon>/<to_lat>,<to_lon>')
 def get_short_quiet_paths(from_lat, from_lon, to_lat, to_lon):
+    if (not is_ready()):
+        return get_not_ready_response()
     start_time = time.time()
     from_latLon = {'lat': float(from_lat), 'lon': float(from_lon)}
     to_latLon = {'lat': float(to_lat), 'lon': float(to_lon)}
     print('from:', from_latLon)
     print('to:', to_latLon)
-    from_xy = geom_utils.get_xy_from_lat_lon(from_latLon)
-    to_xy = geom_utils.get_xy_from_lat_lon(to_latLon)
+    from_xy, to_xy = geom_utils.get_xys_from_lat_lons([from_latLon, to_latLon])
+    # return cached paths if the origin & destination snap to the same places as in an earlier request
+    from_snap, to_snap = zip(snapping.get_nearest_edges(snap_index, [from_xy, to_xy]), snapping.get_nearest_nodes(snap_index, [from_xy, to_xy]))
+    cache_key = (rt.get_snap_key(snap_index, from_snap), rt.get_snap_key(snap_index, to_snap), costs_version, tuple(nts))
+    cached_paths = path_cache.get_cached_value(path_cache_d, cache_key, version=snapshot_version)
+    if (cached_paths is not None):
+        utils.print_duration(start_time, 'Returned cached paths.')
+        return Response(cached_paths, mimetype='application/json')
     # find/create origin and destination nodes
-    orig_node = rt.get_nearest_node(graph, from_xy, edge_gdf, node_gdf, nts=nts, db_costs=db_costs)
-    dest_node = rt.get_nearest_node(graph, to_xy, edge_gdf, node_gdf, nts=nts, db_costs=db_costs, orig_node=orig_node)
+    orig_node = rt.get_nearest_node(snap_index, from_xy, nts=nts, db_costs=db_costs, snapped=from_snap)
+    dest_node = rt.get_nearest_node(snap_index, to_xy, nts=nts, db_costs=db_costs, orig_node=orig_node, snapped=to_snap)
     if (orig_node is None):
         print('could not find origin node at', from_latLon)
         return jsonify({'error': 'Origin not found'})
@@ -57,46 +108,56 @@ def get_short_quiet_paths(from_lat, from_lon, to_lat, to_lon):
         print('could not find destination node at', to_latLon)
         return jsonify({'error': 'Destination not found'})
     utils.print_duration(start_time, 'Origin & destination nodes set.')
-    # get shortest path
+    # get shortest path & quiet paths (of all noise tolerances)
     start_time = time.time()
-    path_list = []
-    shortest_path = rt.get_shortest_path(graph, orig_node['node'], dest_node['node'], weight='length')
-    if (shortest_path is None):
+    overlay = csr.get_link_edge_overlay(csr_graph, [orig_node, dest_node])
+    path_list = rt.get_short_quiet_path_list(csr_graph, orig_node['node'], dest_node['node'], nts=nts, overlay=overlay)
+    if (path_list is None):
         return jsonify({'error': 'Could not find paths'})
-    path_geom_noises = nw.aggregate_path_geoms_attrs(graph, shortest_path, weight='length', noises=True)
-    path_list.append({**path_geom_noises, **{'id': 'short_p','type': 'short', 'nt': 0}})
-    # get quiet paths to list
-    for nt in nts:
-        noise_cost_attr = 'nc_'+str(nt)
-        shortest_path = rt.get_shortest_path(graph, orig_node['node'], dest_node['node'], weight=noise_cost_attr)
-        path_geom_noises = nw.aggregate_path_geoms_attrs(graph, shortest_path, weight=noise_cost_attr, noises=True)
-        path_list.append({**path_geom_noises, **{'id': 'q_'+str(nt), 'type': 'quiet', 'nt': nt}})
     utils.print_duration(start_time, 'Routing done.')
     start_time = time.time()
-    # remove linking edges of the origin / destination nodes
-    nw.remove_new_node_and_link_edges(graph, orig_node)
-    nw.remove_new_node_and_link_edges(graph, dest_node)
-    # collect quiet paths to gdf
-    paths_gdf = gpd.GeoDataFrame(path_list, crs=from_epsg(3879))
-    paths_gdf = paths_gdf.drop_duplicates(subset=['type', 'total_length']).sort_values(by=['type', 'total_length'], ascending=[False, True])
-    # add exposures to noise levels higher than specified threshods (dBs)
-    paths_gdf['th_noises'] = [exps.get_th_exposures(noises, [55, 60, 65, 70]) for noises in paths_gdf['noises']]
-    # add percentages of cumulative distances of different noise levels
-    paths_gdf['noise_pcts'] = paths_gdf.apply(lambda row: exps.get_noise_pcts(row['noises'], row['total_length']), axis=1)
-    # calculate mean noise level
-    paths_gdf['mdB'] = paths_gdf.apply(lambda row: exps.get_mean_noise_level(row['noises'], row['total_length']), axis=1)
-    # calculate noise exposure index (same as noise cost but without noise tolerance coefficient)
-    paths_gdf['nei'] = [round(exps.get_noise_cost(noises=noises, db_costs=db_costs), 1) for noises in paths_gdf['noises']]
-    paths_gdf['nei_norm'] = paths_gdf.apply(lambda row: exps.get_nei_norm(row.nei, row.total_length, db_costs), axis=1)
-    # gdf to dicts
-    path_dicts = qp.get_geojson_from_q_path_gdf(paths_gdf)
-    # group paths with nearly identical geometries
-    unique_paths = qp.remove_duplicate_geom_paths(path_dicts, tolerance=30, logging=False)
-    # calculate exposure differences to shortest path
-    path_comps = rt.get_short_quiet_paths_comparison_for_dicts(unique_paths)
+    # collect paths to gdf, calculate exposures & compare quiet paths to shortest path
+    path_comps = rt.get_short_quiet_path_features(path_list, db_costs=db_costs)
     # return paths as GeoJSON (FeatureCollection)
     utils.print_duration(start_time, 'Processed paths.')
-    return jsonify(path_comps)
+    response = jsonify(path_comps)
+    if (None not in cache_key[:2]):
+        path_cache.set_cached_value(path_cache_d, cache_key, response.get_data(), version=snapshot_version)
+    return response
+
+@app.route('/quietpaths', methods=['POST'])
+def get_short_quiet_paths_for_ods():
+    # body: { "ods": [{ "from": { "lat": .., "lon": .. }, "to": { "lat": .., "lon": .. } }, ...] }
+    if (not is_ready()):
+        return get_not_ready_response()
+    start_time = time.time()
+    body = request.get_json(silent=True)
+    if (body is None or not isinstance(body.get('ods'), list)):
+        return jsonify({'error': 'Request body must contain list of OD pairs (ods)'}), 400
+    if (len(body['ods']) > max_batch_ods):
+        return jsonify({'error': 'Too many OD pairs (max '+ str(max_batch_ods) +')'}), 400
+    try:
+        od_latLons = [({'lat': float(od['from']['lat']), 'lon': float(od['from']['lon'])}, {'lat': float(od['to']['lat']), 'lon': float(od['to']['lon'])}) for od in body['ods']]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid OD pair(s)'}), 400
+    od_paths = rt.get_short_quiet_paths_for_ods(csr_graph, od_latLons, snap_index, nts=nts, db_costs=db_costs, remove_geom_prop=True)
+    utils.print_duration(start_time, 'Routed '+ str(len(od_latLons)) +' OD pairs.')
+    # return paths of each OD pair as GeoJSON (FeatureCollection) in the order of the OD pairs
+    return jsonify({ 'results': [paths['paths'] if paths is not None else {'error': 'Could not find paths'} for paths in od_paths] })
+
+@app.route('/ready')
+def get_readiness():
+    # healthy only when the graph, noise costs and snapping index are all ready for routing
+    ready = is_ready()
+    status = { 'ready': ready, **init_state, 'edge_count': csr_graph['edge_count'] if init_state['graph'] else None, 'snapshot_version': snapshot_version if ready else None, 'error': init_error }
+    return jsonify(status), 200 if ready else 503
+
+@app.route('/cache')
+def get_cache_stats():
+    return jsonify(path_cache.get_cache_stats(path_cache_d))
 
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0')
+    # development server (single process), in production serve with: gunicorn -c gunicorn_conf.py quiet_paths_app:app
+    # routing does not modify the shared graph, so requests can be served in threads
+    start_init()
+    app.run(debug=False, host='0.0.0.0', threaded=True)
@@ -0,0 +1,24 @@
+#%% IMPORT MODULES FOR SERVING CACHED DIGITRANSIT RESPONSES
+import utils.DT_API as DT_routing
+import utils.DT_cache as DT_cache
+import utils.DT_replay as DT_replay
+
+#%% open query cache (written by DT clients with cache, e.g. in commutes_stops.py)
+dt_cache = DT_cache.get_query_cache('outputs/DT_cache/dt_queries.sqlite')
+print('DT cache:', DT_cache.get_cache_stats(dt_cache))
+
+#%% serve cached responses at http://127.0.0.1:8088/graphql
+# offline: cache misses are returned as errors (null plans in batch queries)
+fallback_client = None
+# online: cache misses are queried from Digitransit API and added to the cache
+# fallback_client = DT_routing.get_client(max_concurrency=4, max_rate=10, cache=dt_cache)
+server = DT_replay.get_replay_server(dt_cache, host='127.0.0.1', port=8088, fallback_client=fallback_client)
+print('Serving DT replay at: http://127.0.0.1:8088/graphql (stop with Ctrl+C / interrupt)')
+# point clients to the replay server with:
+# dt_client = DT_routing.get_client(endpoint='http://127.0.0.1:8088/graphql')
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    server.shutdown()
+server.server_close()
+print('DT cache:', DT_cache.get_cache_stats(dt_cache))
@@ -5,26 +5,24 @@ import time
 from fiona.crs import from_epsg
 from shapely.geometry import Point  
 from multiprocessing import current_process, Pool
+from concurrent.futures import ThreadPoolExecutor
 import utils.DT_API as DT_routing
+import utils.DT_cache as DT_cache
 import utils.DT_utils as DT_utils
 import utils.geometry as geom_utils
 import utils.times as times
 import utils.files as files
 import utils.utils as utils
 import utils.commutes as commutes_utils
-import utils.networks as nw
-import ast
-
-#%% read graph
-graph = files.get_network_full_noise()
-print('Graph of', graph.size(), 'edges read.')
-edge_gdf = nw.get_edge_gdf(graph, attrs=['geometry', 'length', 'noises'])
-node_gdf = nw.get_node_gdf(graph)
-print('Network features extracted.')
-edge_gdf = edge_gdf[['uvkey', 'geometry', 'noises']]
-edges_sind = edge_gdf.sindex
-nodes_sind = node_gdf.sindex
-print('Spatial index built.')
+import utils.csr_graph as csr
+import utils.snapping as snapping
+import utils.pipeline as pipeline
+
+#%% read graph (memory-mapped graph snapshot, only needed for snapping origins & destinations)
+csr_graph = csr.get_csr_graph(files.get_network_full_noise_snapshot(version=3))
+print('Graph of', csr_graph['edge_count'], 'edges read.')
+snap_index = snapping.get_snap_index(csr_graph)
+print('Snapping index built.')
 
 #%% read YKR work commute data
 commutes = pd.read_csv('data_ykr/T06_tma_e_TOL2008_2016_hel.csv')
@@ -35,8 +33,8 @@ commutes = pd.read_csv('data_ykr/T06_tma_e_TOL2008_2016_hel.csv')
 # commutes.to_csv('data_ykr/T06_tma_e_TOL2008_2016_hel.csv')
 commutes['geom_home'] = commutes.apply(lambda row: Point(row['ax'], row['ay']), axis=1)
 commutes['geom_work'] = commutes.apply(lambda row: Point(row['tx'], row['ty']), axis=1)
-commutes['home_latLon'] = [geom_utils.get_lat_lon_from_geom(geom_utils.project_to_wgs(geom, epsg=3067)) for geom in commutes['geom_home']]
-commutes['work_latLon'] = [geom_utils.get_lat_lon_from_geom(geom_utils.project_to_wgs(geom, epsg=3067)) for geom in commutes['geom_work']]
+commutes['home_latLon'] = geom_utils.get_lat_lons_from_points(commutes['geom_home'], epsg=3067)
+commutes['work_latLon'] = geom_utils.get_lat_lons_from_points(commutes['geom_work'], epsg=3067)
 commutes = commutes[['txyind','axyind', 'geom_home', 'geom_work', 'home_latLon', 'work_latLon', 'yht']]
 commutes.head()
 
@@ -98,92 +96,74 @@ home_groups = commutes.groupby('axyind')
 walk_speed = '1.16666'
 datetime = times.get_next_weekday_datetime(8, 30, skipdays=4)
 print('Datetime for routing:', datetime)
+# shared DT client: connection pool, rate limit (requests / s) & cap for concurrent requests of all origins
+# responses are cached on disk, so reruns & reprocessing only query cache misses from the API
+dt_cache = DT_cache.get_query_cache('outputs/DT_cache/dt_queries.sqlite')
+dt_client = DT_routing.get_client(max_concurrency=6, max_rate=10, batch_size=10, cache=dt_cache)
+# replay cached responses only (offline)
+# dt_client = DT_routing.get_client(cache=dt_cache, replay=True)
 # Datetime for routing: 2019-05-27 08:30:00 !!!!
 
-#%% function that returns home_walks
+#%% function that returns home_walks (and status: ok, no_destinations or error)
 def get_home_walk_gdf(axyind):
     start_time = time.time()
     work_rows = home_groups.get_group(axyind)
-    home_walks_g = commutes_utils.get_home_work_walks(axyind=axyind, work_rows=work_rows, districts=districts_gdf, datetime=datetime, walk_speed=walk_speed, subset=False, logging=True, graph=graph, edge_gdf=edge_gdf, node_gdf=node_gdf)
+    home_walks_g = commutes_utils.get_home_work_walks(axyind=axyind, work_rows=work_rows, districts=districts_gdf, datetime=datetime, walk_speed=walk_speed, subset=False, logging=True, snap_index=snap_index, dt_client=dt_client)
     if (not isinstance(home_walks_g, pd.DataFrame)):
-        if (home_walks_g == None):
+        if (home_walks_g == 'no_destinations'):
             print('No work destinations found for:', axyind, 'skipping...')
-            return None
+            return None, 'no_destinations'
+        print('Could not get walks for:', axyind)
+        return None, 'error'
     error = commutes_utils.validate_home_stops(home_walks_g)
     if (error != None):
         print(error)
     # add column that tells if the stop geometry is outside of the extent of Helsinki
     home_walks_g['outside_hel'] = [outside_hel_extent(geom) for geom in home_walks_g['DT_dest_Point']]
-    home_walks_g_to_file = home_walks_g.drop(columns=['DT_geom', 'DT_dest_Point'])
-    home_walks_g_to_file.to_csv('outputs/YKR_commutes_output/home_stops/axyind_'+str(axyind)+'.csv')
     utils.print_duration(start_time, str(len(home_walks_g)) +' home stops got for: '+str(axyind)+'.\n')
-    return home_walks_g
+    return home_walks_g, 'ok'
+
+# function that returns home stops of a chunk of origins (for the pipeline)
+def get_home_stops_chunk(axyinds):
+    # origins of the chunk are processed concurrently (DT requests of the origins are limited by dt_client)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        home_walks = list(executor.map(get_home_walk_gdf, axyinds))
+    home_stops = [walks.drop(columns=['DT_geom', 'DT_dest_Point']) for walks, status in home_walks if status == 'ok']
+    # only failed routing is an error (origins without work destinations are not reprocessed)
+    errors = [axyind for axyind, (walks, status) in zip(axyinds, home_walks) if status == 'error']
+    no_dests = [axyind for axyind, (walks, status) in zip(axyinds, home_walks) if status == 'no_destinations']
+    if (len(no_dests) > 0):
+        print('Origins without work destinations:', no_dests)
+    return pd.concat(home_stops, ignore_index=True) if len(home_stops) > 0 else None, errors
 
 #%% process origins
-# collect axyinds to process
+# origins are processed in chunks listed in the manifest of the pipeline, results of each chunk are written as
+# a Parquet partition (latLons as struct columns) and done chunks are skipped when the pipeline is run again
+home_stops_dir = 'outputs/YKR_commutes_output/home_stops_parts'
 axyinds = commutes['axyind'].unique()
 # axyinds = [3803756679125, 3873756677375, 3866256677375, 3863756676625, 3876256675875, 3838756674875]
 # axyinds_toskip = [4026256685375, 9999999999999, 3841256675125]
 axyinds_toskip = [9999999999999]
-axyinds_processed = commutes_utils.get_processed_home_walks()
-print('Previously processed', len(axyinds_processed), 'axyinds')
-axyinds = [axy for axy in axyinds if axy not in axyinds_processed]
 axyinds = [axy for axy in axyinds if axy not in axyinds_toskip]
-reprocessed = []
-print('Unprocessed:', len(axyinds))
-#%% get axyinds to reprocess
-axyinds = commutes_utils.get_axyinds_to_reprocess(grid, reprocessed)
-axyinds = [axyind for axyind in axyinds if axyind not in reprocessed]
-print('Processed:', len(reprocessed), 'axyinds')
-print('Unprocessed:', len(axyinds), 'axyinds')
-#%% take subset of axyinds to process
-#%% 
-axyinds = axyinds[:10]
-print('Start processing:', len(axyinds), 'axyinds')
-
-#%% one by one
-start_time = time.time()
-all_home_walks_dfs = []
-for idx, axyind in enumerate(axyinds):
-    utils.print_progress(idx, len(axyinds), False)
-    print('\nStart processing:', axyind)
-    all_home_walks_dfs.append(get_home_walk_gdf(axyind))
-    reprocessed.append(axyind)
-# print time stats
-time_elapsed = round(time.time() - start_time)
-avg_origin_time = round(time_elapsed/len(axyinds))
-print('--- %s min --- %s' % (round(time_elapsed/60,1), 'processed: '+ str(len(axyinds)) +' origins'))
-print('Average origin processing time:', avg_origin_time, 's')
-
-#%% export to GDF for debugging
-# all_home_walks_df = pd.concat(all_home_walks_dfs, ignore_index=True)
-# all_home_walks_gdf = gpd.GeoDataFrame(all_home_walks_df, geometry='DT_geom', crs=from_epsg(4326))
-# all_home_walks_gdf.drop(columns=['DT_dest_Point']).to_file('outputs/YKR_commutes_output/test.gpkg', layer='dt_paths', driver='GPKG')
-# all_home_walks_gdf = gpd.GeoDataFrame(all_home_walks_df, geometry='DT_dest_Point', crs=from_epsg(4326))
-# all_home_walks_gdf.drop(columns=['DT_geom']).to_file('outputs/YKR_commutes_output/test.gpkg', layer='dt_stops', driver='GPKG')
-
-#%%
-# this should be exactly 100:
-# print('sum prob', all_home_walks_gdf['prob'].sum())
-# all_home_walks_gdf.plot()
-# all_home_walks_gdf.head(50)
-
-#% Read home stops from csv & export to geopackage for visualization
-#%% find unprocessed axyinds for path calculation loop
-# read commutes stops
-home_stops_path = 'outputs/YKR_commutes_output/home_stops'
-axyinds = commutes_utils.get_xyind_filenames(path=home_stops_path)
-to_process = axyinds #[:5]
-print(len(to_process))
+print('Origins:', len(axyinds))
 
-#%%
-all_home_stops = []
-for home_stops_file in to_process:
-    home_stops = pd.read_csv(home_stops_path+'/'+home_stops_file)
-    home_stops['dest_latLon'] = [ast.literal_eval(d) for d in home_stops['dest_latLon']]
-    all_home_stops.append(home_stops)
+#%% get axyinds to reprocess (their chunks are processed again in the next run)
+# origins that failed are moved to new chunks and processed again in the next run, reset origins only to redo them
+# home_stops = pipeline.read_partitions(home_stops_dir)
+# axyinds_to_reprocess = commutes_utils.get_axyinds_to_reprocess(grid, [], home_stops=home_stops)
+# pipeline.reset_work_ids(home_stops_dir, axyinds_to_reprocess)
 
-all_home_stops_df = gpd.GeoDataFrame(pd.concat(all_home_stops, ignore_index=True), crs=from_epsg(4326))
+#%% run (or resume) the pipeline
+start_time = time.time()
+manifest = pipeline.run_pipeline(home_stops_dir, axyinds, get_home_stops_chunk, chunk_size=20)
+print('Failed origins:', pipeline.get_failed_work_ids(manifest))
+utils.print_duration(start_time, 'Processed origins.')
+
+#%% Read home stops & export to geopackage for visualization
+all_home_stops = pipeline.read_partitions(home_stops_dir)
+# this should be exactly 100 for each origin:
+# print('sum prob', all_home_stops.groupby('from_axyind')['prob'].sum())
+all_home_stops_df = gpd.GeoDataFrame(all_home_stops, crs=from_epsg(4326))
 all_home_stops_df['geometry'] = [geom_utils.get_point_from_lat_lon(latLon) for latLon in all_home_stops_df['dest_latLon']]
 
 #%%
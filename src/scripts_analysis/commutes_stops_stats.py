@@ -20,8 +20,8 @@ import utils.networks as nw
 commutes = pd.read_csv('data_ykr/T06_tma_e_TOL2008_2016_hel.csv')
 commutes['geom_home'] = commutes.apply(lambda row: Point(row['ax'], row['ay']), axis=1)
 commutes['geom_work'] = commutes.apply(lambda row: Point(row['tx'], row['ty']), axis=1)
-commutes['home_latLon'] = [geom_utils.get_lat_lon_from_geom(geom_utils.project_to_wgs(geom, epsg=3067)) for geom in commutes['geom_home']]
-commutes['work_latLon'] = [geom_utils.get_lat_lon_from_geom(geom_utils.project_to_wgs(geom, epsg=3067)) for geom in commutes['geom_work']]
+commutes['home_latLon'] = geom_utils.get_lat_lons_from_points(commutes['geom_home'], epsg=3067)
+commutes['work_latLon'] = geom_utils.get_lat_lons_from_points(commutes['geom_work'], epsg=3067)
 commutes = commutes[['axyind','txyind', 'geom_home', 'geom_work', 'home_latLon', 'work_latLon', 'yht']]
 commutes.head()
 
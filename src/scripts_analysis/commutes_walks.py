@@ -1,7 +1,6 @@
 #%%
 import pandas as pd
 import geopandas as gpd
-import ast
 import time
 from fiona.crs import from_epsg
 from multiprocessing import current_process, Pool
@@ -13,52 +12,51 @@ import utils.networks as nw
 import utils.utils as utils
 import utils.routing as rt
 import utils.quiet_paths as qp
+import utils.csr_graph as csr
+import utils.snapping as snapping
+import utils.pipeline as pipeline
 
 # walks_out_file = 'test_run_1'
 walks_out_file = 'run_6_set_1'
 print('starting:', walks_out_file)
 
 #%% initialize graph
-start_time = time.time()
+# routing graph is loaded from memory-mapped graph snapshot in each worker (see init_routing_worker), so the arrays
+# are shared by the processes through the page cache instead of being copied to each worker
 nts = qp.get_noise_tolerances()
 db_costs = qp.get_db_costs(version=3)
-graph = files.get_network_full_noise(version=3)
-print('Graph of', graph.size(), 'edges read.')
-edge_gdf = nw.get_edge_gdf(graph, attrs=['geometry', 'length', 'noises'])
-node_gdf = nw.get_node_gdf(graph)
-print('Network features extracted.')
-nw.set_graph_noise_costs(graph, edge_gdf, db_costs=db_costs, nts=nts)
-edge_gdf = edge_gdf[['uvkey', 'geometry', 'noises']]
-print('Noise costs set.')
-edges_sind = edge_gdf.sindex
-nodes_sind = node_gdf.sindex
-print('Spatial index built.')
-utils.print_duration(start_time, 'Network initialized.')
-
-#%% find unprocessed axyinds for path calculation loop
-# read commutes stops
-home_stops_path = 'outputs/YKR_commutes_output/home_stops'
-axyinds = commutes_utils.get_xyind_filenames(path=home_stops_path)
-to_process = axyinds #[:5]
+csr_graph = None
+snap_index = None
+
+def init_routing_worker():
+    global csr_graph, snap_index
+    start_time = time.time()
+    csr_graph = csr.get_csr_graph(files.get_network_full_noise_snapshot(version=3))
+    csr.set_noise_costs(csr_graph, db_costs=db_costs, version=3)
+    snap_index = snapping.get_snap_index(csr_graph)
+    utils.print_duration(start_time, 'Network initialized for '+ current_process().name +'.')
+
+#%% read home stops (partitions of the commutes_stops pipeline, latLons as struct columns)
+home_stops_dir = 'outputs/YKR_commutes_output/home_stops_parts'
+home_stops_groups = pipeline.read_partitions(home_stops_dir).groupby('from_axyind')
+to_process = list(home_stops_groups.groups.keys()) #[:5]
 # errors = [3931256683625, 3803756680125, 3806256676125, 3906256684875, 3938756682375] # errors on 20.8.19
-# to_process = ['axyind_'+str(axyind)+'.csv' for axyind in errors]
+# to_process = errors
 
 print('Start processing', len(to_process), 'axyinds')
 
 #%% functions for calculating origin-stop paths
-def get_origin_stop_paths(from_latLon=None, to_latLon=None):
-    return rt.get_short_quiet_paths(graph, from_latLon, to_latLon, edge_gdf, node_gdf, nts=nts, db_costs=db_costs, remove_geom_prop=False, logging=False)
+def get_origin_stops_paths(od_latLons):
+    return rt.get_short_quiet_paths_for_ods(csr_graph, od_latLons, snap_index, nts=nts, db_costs=db_costs, remove_geom_prop=False, logging=False)
 
 # function for calculating short & quiet paths
-def get_origin_stops_paths_df(home_stops_file):
-    from_axyind = commutes_utils.get_xyind_from_filename(home_stops_file)
+def get_origin_stops_paths_df(from_axyind):
     try:
-        home_stops = pd.read_csv(home_stops_path+'/'+home_stops_file)
-        home_stops['DT_origin_latLon'] = [ast.literal_eval(d) for d in home_stops['DT_origin_latLon']]
-        home_stops['dest_latLon'] = [ast.literal_eval(d) for d in home_stops['dest_latLon']]
+        home_stops = home_stops_groups.get_group(from_axyind)
+        # route all origin-stop pairs of the origin in one batch
+        od_paths = get_origin_stops_paths(list(zip(home_stops['DT_origin_latLon'], home_stops['dest_latLon'])))
         home_paths = []
-        for idx, row in home_stops.iterrows():
-            paths = get_origin_stop_paths(from_latLon=row['DT_origin_latLon'], to_latLon=row['dest_latLon'])
+        for (idx, row), paths in zip(home_stops.iterrows(), od_paths):
             if (paths is None):
                 print('routing error with:', row['from_axyind'], 'prob:', row['prob'])
                 continue
@@ -83,18 +81,30 @@ def get_origin_stops_paths_df(home_stops_file):
         print(str(e))
         return from_axyind
 
+# function for calculating paths of a chunk of origins (for the pipeline)
+def get_origins_paths_chunk(axyinds):
+    home_paths = [get_origin_stops_paths_df(axyind) for axyind in axyinds]
+    errors = [axyind for axyind, paths in zip(axyinds, home_paths) if not isinstance(paths, pd.DataFrame)]
+    home_paths_dfs = [paths for paths in home_paths if isinstance(paths, pd.DataFrame)]
+    if (len(home_paths_dfs) == 0):
+        return None, errors
+    return gpd.GeoDataFrame(pd.concat(home_paths_dfs, ignore_index=True), crs=from_epsg(3879)), errors
+
 #%% process origins with pool
-# select subset of axyinds to process
+# paths of each chunk of origins are written as a (GeoParquet) partition as soon as the chunk is done, so an interrupted
+# run is resumed by running this again (done chunks are skipped), at most max_pending chunks are held in memory at a time
+# noise exposures are written as columns by dB (e.g. n_45, th_60) instead of dictionaries
+noise_dict_columns = { 'noises': 'n', 'noise_pcts': 'n_pct', 'noises_diff': 'n_diff', 'th_noises': 'th', 'th_noises_diff': 'th_diff' }
+home_paths_dir = 'outputs/YKR_commutes_output/home_paths_parts/'+ walks_out_file
 start_time = time.time()
-pool = Pool(processes=4)
-home_paths = pool.map(get_origin_stops_paths_df, to_process)
-# home_paths = [get_origin_stops_paths_df(axyind) for axyind in to_process]
-errors = [path for path in home_paths if type(path) is int]
-home_paths_dfs = [path for path in home_paths if type(path) is not int]
+pool = Pool(processes=4, initializer=init_routing_worker)
+manifest = pipeline.run_pipeline(home_paths_dir, to_process, get_origins_paths_chunk, chunk_size=10, pool=pool, max_pending=8, flat_dict_columns=noise_dict_columns)
+pool.close()
+# init_routing_worker()
+# manifest = pipeline.run_pipeline(home_paths_dir, to_process, get_origins_paths_chunk, chunk_size=10, flat_dict_columns=noise_dict_columns)
+errors = pipeline.get_failed_work_ids(manifest)
 print('ERRORS:', errors)
 print('errors count:', len(errors))
-print('path df count:', len(home_paths_dfs))
-all_home_paths_df = gpd.GeoDataFrame(pd.concat(home_paths_dfs, ignore_index=True), crs=from_epsg(3879))
 utils.print_duration(start_time, 'Got paths.')
 axyind_time = round((time.time() - start_time)/len(to_process), 2)
 print('axyind_time (s):', axyind_time)
@@ -102,7 +112,8 @@ print('axyind_time (s):', axyind_time)
 #%% check paths GDF
 # all_home_paths_df.head(3)
 
-#%% export paths GDF
+#%% export paths GDF (to GeoPackage for visualization)
+all_home_paths_df = pipeline.read_partitions(home_paths_dir, geo=True)
 all_home_paths_df.to_file('outputs/YKR_commutes_output/home_paths.gpkg', layer=walks_out_file, driver='GPKG')
 print('exported paths to file:', walks_out_file)
 
@@ -11,6 +11,8 @@ import utils.geometry as geom_utils
 import utils.files as files
 import utils.plots as plots
 import utils.exposures as exps
+import utils.pipeline as pipeline
+import utils.weighted_stats as wstats
 
 walks_in_file = 'run_6_set_1'
 problem_axyinds = [3933756673875]
@@ -29,11 +31,12 @@ grid['xyind'] = [int(xyind) for xyind in grid['xyind']]
 grid = grid[['xyind', 'grid_geom', 'grid_centr']]
 grid.head()
 
-#%% read all paths
-paths =  gpd.read_file('outputs/YKR_commutes_output/home_paths.gpkg', layer=walks_in_file)
-paths['noises'] = [ast.literal_eval(noises) for noises in paths['noises']]
-paths['th_noises'] = [ast.literal_eval(th_noises) for th_noises in paths['th_noises']]
-paths['th_noises_diff'] = [ast.literal_eval(th_noises) for th_noises in paths['th_noises_diff']]
+#%% read all paths (partitions of the commutes_walks pipeline, noise exposures are read as columns by dB, e.g. n_45 & th_60)
+paths = pipeline.read_partitions('outputs/YKR_commutes_output/home_paths_parts/'+ walks_in_file, geo=True)
+# paths =  gpd.read_file('outputs/YKR_commutes_output/home_paths.gpkg', layer=walks_in_file)
+# paths['noises'] = [ast.literal_eval(noises) for noises in paths['noises']]
+# paths['th_noises'] = [ast.literal_eval(th_noises) for th_noises in paths['th_noises']]
+# paths['th_noises_diff'] = [ast.literal_eval(th_noises) for th_noises in paths['th_noises_diff']]
 #%% count of all paths
 print('read', len(paths.index), 'paths')
 print('axyind count:', len(paths['from_axyind'].unique()))
@@ -121,49 +124,31 @@ print('s_paths count:', len(s_paths))
 #### STATFI GRID LEVEL NOISE STATISTICS ####
 ############################################
 
-#%% #### group paths to PT by origin (axyind)
-axy_groups = s_paths_pt.groupby('from_axyind')
+#%% #### paths to PT by origin (axyind)
 print('paths to PT count:', len(s_paths_pt))
 print('paths with null length count:', len(s_paths_pt.query('DT_len_diff == -9999')))
 
-#%% calculate stats per origin (paths from axyind)
-errors = []
-stats = []
-for key, group in axy_groups:
-    in_paths = group.query("b_inside_hel == 'yes'")
-    filt_paths = pstats.filter_out_problem_paths(in_paths)
-    if (len(in_paths) > 0):
-        paths_incl_ratio = round(len(filt_paths)/(len(group))*100, 1)
-    else:
-        paths_incl_ratio = 0
-    if (len(filt_paths) != 0):
-        d = { 'axyind': key }
-        d['probsum'] = round(filt_paths['prob'].sum(),2)
-        d['paths_incl_ratio'] = paths_incl_ratio
-        # calculate stats of path lengths
-        len_stats = pstats.calc_basic_stats(filt_paths, 'length', weight='prob', valuemap=(-9999, 0), col_prefix='len')
-        # calculate stats of path noise exposures
-        db55l_stats = pstats.calc_basic_stats(filt_paths, '55dBl', weight='prob', valuemap=(-9999, 0), col_prefix='dB55l')
-        db60l_stats = pstats.calc_basic_stats(filt_paths, '60dBl', weight='prob', valuemap=(-9999, 0), col_prefix='dB60l')
-        db65l_stats = pstats.calc_basic_stats(filt_paths, '65dBl', weight='prob', valuemap=(-9999, 0), col_prefix='dB65l')
-        db70l_stats = pstats.calc_basic_stats(filt_paths, '70dBl', weight='prob', valuemap=(-9999, 0), col_prefix='dB70l')
-        db55r_stats = pstats.calc_basic_stats(filt_paths, '55dBr', weight='prob', valueignore=-9999, col_prefix='dB55r')
-        db60r_stats = pstats.calc_basic_stats(filt_paths, '60dBr', weight='prob', valueignore=-9999, col_prefix='dB60r')
-        db65r_stats = pstats.calc_basic_stats(filt_paths, '65dBr', weight='prob', valueignore=-9999, col_prefix='dB65r')
-        db70r_stats = pstats.calc_basic_stats(filt_paths, '70dBr', weight='prob', valueignore=-9999, col_prefix='dB70r')
-        nei_stats = pstats.calc_basic_stats(filt_paths, 'nei', weight='prob', valuemap=(-9999, 0), col_prefix='nei')
-        nei_norm_stats = pstats.calc_basic_stats(filt_paths, 'nei_norm', weight='prob', valueignore=-9999, col_prefix='nei_n')
-        mdB_stats = pstats.calc_basic_stats(filt_paths, 'mdB', weight='prob', valueignore=-9999, col_prefix='mdB')
-        d = { **d, **len_stats, **db55l_stats, **db60l_stats, **db65l_stats, **db70l_stats, **db55r_stats, 
-            **db60r_stats, **db65r_stats, **db70r_stats, **nei_stats, **nei_norm_stats, **mdB_stats }
-        stats.append(d)
-    else:
-        errors.append(key)
-print('stats got for:', len(stats), 'axyinds')
+#%% calculate stats per origin (paths from axyind) for all origins at once
+filt_paths = pstats.filter_out_problem_paths(s_paths_pt.query("b_inside_hel == 'yes'")).copy()
+# lengths & exposures of null paths (-9999) are counted as 0 and other null values are left out of the stats
+valuemap_cols = ['length', '55dBl', '60dBl', '65dBl', '70dBl', 'nei']
+valueignore_cols = ['55dBr', '60dBr', '65dBr', '70dBr', 'nei_norm', 'mdB']
+for col in valuemap_cols:
+    filt_paths[col] = filt_paths[col].replace(-9999, 0)
+for col in valueignore_cols:
+    filt_paths[col] = filt_paths[col].replace(-9999, np.nan)
+stats_df = wstats.get_grouped_weighted_stats(filt_paths, valuemap_cols + valueignore_cols, group_col='from_axyind', weight_col='prob',
+    col_prefixes=['len', 'dB55l', 'dB60l', 'dB65l', 'dB70l', 'nei', 'dB55r', 'dB60r', 'dB65r', 'dB70r', 'nei_n', 'mdB'])
+stats_df = stats_df.drop(columns=['n']).rename(columns={ 'from_axyind': 'axyind' })
+stats_df.insert(1, 'probsum', filt_paths.groupby('from_axyind')['prob'].sum().round(2).values)
+group_counts = s_paths_pt.groupby('from_axyind').size()
+filt_counts = filt_paths.groupby('from_axyind').size()
+stats_df.insert(2, 'paths_incl_ratio', (filt_counts / group_counts[filt_counts.index] * 100).round(1).values)
+errors = [axyind for axyind in group_counts.index if axyind not in filt_counts.index]
+print('stats got for:', len(stats_df), 'axyinds')
 print('all paths filtered out for:', len(errors), 'axyinds')
 
-#%% combine stats to DF
-stats_df = pd.DataFrame(stats, columns=stats[0].keys())
+#%% check stats
 stats_df.head()
 
 #%% merge grid geoometry to axyind stats
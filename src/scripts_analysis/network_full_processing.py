@@ -151,40 +151,21 @@ print('Exported graph to file:', graph_filename)
 
 #%% 9.1 Prepare for extraction of noise distances
 noise_polys = files.get_noise_polygons()
-noise_polys_sind = noise_polys.sindex
-edge_dicts = nw.get_all_edge_dicts(graph, attrs=['geometry', 'length'], by_nodes=False)
-
-# define function for spatial join between edge geometries and noise polygons
-def get_edge_noises_df(edge_dicts):
-    edge_gdf_sub = gpd.GeoDataFrame(edge_dicts, crs=from_epsg(3879))[['geometry', 'length', 'uvkey']]
-    # build spatial indexes
-    edges_sind = edge_gdf_sub.sindex
-    # add noise split lines as list
-    edge_gdf_sub['split_lines'] = [geom_utils.get_split_lines_list(line_geom, noise_polys) for line_geom in edge_gdf_sub['geometry']]
-    # explode new rows from split lines column
-    split_lines = geom_utils.explode_lines_to_split_lines(edge_gdf_sub, 'uvkey')
-    # join noises to split lines
-    split_line_noises = exps.get_noise_attrs_to_split_lines(split_lines, noise_polys)
-    # aggregate noises back to edges
-    edge_noises = exps.aggregate_line_noises(split_line_noises, 'uvkey')
-    return edge_noises
+edge_gdf = nw.get_edge_gdf(graph, attrs=['geometry', 'length'], by_nodes=False)
 
 #%% 9.2 Extract noise data by edge geometries
 print('Extract contaminated distances to noises...')
-# divide list of all edge dicts to chunks of 3000 edges
-edge_chunks = utils.get_list_chunks(edge_dicts, 3000)
-pool = Pool(processes=4)
 start_time = time.time()
-edge_noise_dfs = pool.map(get_edge_noises_df, edge_chunks)
+# all edges are intersected with the noise polygons in one bulk spatial join
+edge_noises = exps.get_line_noises_df(edge_gdf, 'uvkey', noise_polys)
 time_elapsed = time.time() - start_time
-edge_time = round(time_elapsed/len(edge_dicts), 5)
+edge_time = round(time_elapsed/len(edge_gdf.index), 5)
 print('\n--- %s minutes ---' % (round(time_elapsed/60, 2)))
 print('--- %s seconds per edge ---' % (edge_time))
 print('Noises extracted by edge geometries.')
 
 #%% 9.3 Update edge noises to graph
-for edge_noises in edge_noise_dfs:
-    nw.update_edge_noises_to_graph(edge_noises, graph)
+nw.update_edge_noises_to_graph(edge_noises, graph)
 print('Noises updated to graph.')
 
 #%% 10. Export graph with edge noises
@@ -227,4 +208,13 @@ if (len(odd_edge_gdf_noise_costs) > 0):
 else:
     print('Edge noise costs ok.')
 
+#%% 13. Export graph snapshot (typed arrays) for quick loading in the quiet path app
+start_time = time.time()
+snapshot_dirname = graph_name +'_u_g_n2_f_s_snapshot'
+snapshot_path = files.export_graph_snapshot(graph, snapshot_dirname, folder=out_dir)
+utils.print_duration(start_time, 'Exported graph snapshot to: '+ snapshot_path, round_n=1)
+# check that the snapshot loads back to an identical graph
+graph_snap = nw.get_graph_from_arrays(files.load_graph_snapshot(snapshot_dirname, folder=out_dir))
+print('Snapshot nodes & edges match:', (graph_snap.number_of_nodes(), graph_snap.number_of_edges()) == (graph.number_of_nodes(), graph.number_of_edges()))
+
 #%%
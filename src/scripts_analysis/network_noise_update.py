@@ -0,0 +1,39 @@
+#%%
+import time
+import utils.files as files
+import utils.networks as nw
+import utils.exposures as exps
+import utils.utils as utils
+
+#%% 1. Set graph snapshot and noise data to update
+graph_name = 'hel-v3'
+# graph_name = 'kumpula-v3'
+out_dir = 'graphs'
+snapshot_dirname = graph_name +'_u_g_n2_f_s_snapshot'
+old_noise_layer = '2017_alue_01_tieliikenne_L_Aeq_paiva'
+new_noise_layer = '2017_alue_01_tieliikenne_L_Aeq_paiva'
+new_noise_filepath = 'data/data_update.gpkg'
+
+#%% 2. Find changed noise polygons
+old_noise_polys = files.get_noise_polygons(layer=old_noise_layer)
+new_noise_polys = files.get_noise_polygons(filepath=new_noise_filepath, layer=new_noise_layer)
+changed_noise_polys = exps.get_changed_noise_polygons(old_noise_polys, new_noise_polys)
+print('Changed noise polygons:', len(changed_noise_polys.index))
+
+#%% 3.1 Re-noise only the edges intersecting the changed noise polygons
+start_time = time.time()
+graph_arrays = files.load_graph_snapshot(snapshot_dirname, folder=out_dir)
+edge_noises, renoise_ids = nw.get_updated_edge_noises(graph_arrays, new_noise_polys, changed_noise_polys=changed_noise_polys)
+utils.print_duration(start_time, 'Re-noised '+ str(len(renoise_ids)) +' of '+ str(len(edge_noises)) +' edges.', round_n=1)
+
+#%% 3.2 Write updated noises as a patch to the graph snapshot
+noise_patch = files.export_graph_snapshot_noise_patch(snapshot_dirname, renoise_ids, edge_noises[renoise_ids], folder=out_dir)
+print('Snapshot noise patch:', noise_patch)
+
+#%% 4. Alternatively, re-noise only new & changed edges of an updated network (e.g. after OSM edits)
+# noises of unchanged edges are copied from the old snapshot (new topology requires a new snapshot instead of a patch)
+# graph = files.load_graphml(graph_name +'_u_g_f_s.graphml', folder=out_dir, directed=False, noises=False)
+# graph_arrays = nw.get_graph_arrays(graph, noises=False)
+# old_graph_arrays = files.load_graph_snapshot(snapshot_dirname, folder=out_dir)
+# graph_arrays['edge_noises'], renoise_ids = nw.get_updated_edge_noises(graph_arrays, new_noise_polys, changed_noise_polys=changed_noise_polys, old_graph_arrays=old_graph_arrays)
+# files.export_graph_arrays_snapshot(graph_arrays, graph_name +'_u_g_n2_f_s_snapshot_new', folder=out_dir)
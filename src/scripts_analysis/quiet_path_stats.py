@@ -11,15 +11,17 @@ import utils.geometry as geom_utils
 import utils.files as files
 import utils.plots as plots
 import utils.exposures as exps
+import utils.pipeline as pipeline
 
 walks_in_file = 'run_6_set_1'
 problem_axyinds = [3933756673875]
 
-#%% read all paths
-paths =  gpd.read_file('outputs/YKR_commutes_output/home_paths.gpkg', layer=walks_in_file)
-paths['noises'] = [ast.literal_eval(noises) for noises in paths['noises']]
-paths['th_noises'] = [ast.literal_eval(th_noises) for th_noises in paths['th_noises']]
-paths['th_noises_diff'] = [ast.literal_eval(th_noises) for th_noises in paths['th_noises_diff']]
+#%% read all paths (partitions of the commutes_walks pipeline, noise exposures are read as columns by dB, e.g. n_45 & th_60)
+paths = pipeline.read_partitions('outputs/YKR_commutes_output/home_paths_parts/'+ walks_in_file, geo=True)
+# paths =  gpd.read_file('outputs/YKR_commutes_output/home_paths.gpkg', layer=walks_in_file)
+# paths['noises'] = [ast.literal_eval(noises) for noises in paths['noises']]
+# paths['th_noises'] = [ast.literal_eval(th_noises) for th_noises in paths['th_noises']]
+# paths['th_noises_diff'] = [ast.literal_eval(th_noises) for th_noises in paths['th_noises_diff']]
 #%% count of all paths
 print('read', len(paths.index), 'paths')
 print('axyind count:', len(paths['from_axyind'].unique()))
@@ -41,8 +43,7 @@ p = pstats.filter_out_paths_outside_hel(p)
 #%%
 print(paths.columns)
 qp_cols = ['od_id', 'path_id', 'len_diff', 'len_diff_r', 'length', 'nei',
-       'nei_diff', 'nei_diff_r', 'nei_norm', 'noises', 'noises_diff', 'th_noises', 
-       'th_noises_diff', 'util', 'mdB', '60dBl', '65dBl', '70dBl', '60dBr', '65dBr', '70dBr']
+       'nei_diff', 'nei_diff_r', 'nei_norm', 'util', 'mdB', '60dBl', '65dBl', '70dBl', '60dBr', '65dBr', '70dBr']
 
 #%% rename columns
 p['path_id'] = p['id']
@@ -62,37 +63,12 @@ p = p[qp_cols]
 p[['path_id', 'len_diff', 'len_diff_r', '60dBl', '60dBr']].head()
 
 #%% Calculate quiet path stats per od
-# group by od id (short and quiet paths of OD-pair are in the same group)
-all_od_stats = []
+# short and quiet paths of OD-pair share the od id
 print('OD count:', len(p['od_id'].unique()))
 # OD count: 30100
-grouped = p.groupby('od_id')
-for key, group in grouped:
-    # if (key != '3801256680625_HSL:1320224' and key != '3801256680875_HSL:1320111'):
-    #     continue
-    sps = group.query("path_id == 'short_p'").to_dict(orient='records')
-    sp = sps[0] if len(sps) > 0 else None
-    if (sp is None):
-        continue
-    qps = group.query("path_id != 'short_p'")[qp_cols]
-    # qps['len_sp'] = sp['length']
-    qps['mdB_diff'] = [mdB - sp['mdB'] for mdB in qps['mdB']]
-    # db len diffs
-    qps['60dB_diff'] = [round(dblen - sp['60dBl'], 1) for dblen in qps['60dBl']]
-    qps['65dB_diff'] = [round(dblen - sp['65dBl'], 1) for dblen in qps['65dBl']]
-    # db len diff ratios
-    qps['60dB_diff_r'] = [ round((dblendiff/sp['60dBl'])*100) if sp['60dBl'] != 0 else 0 for dblendiff in qps['60dB_diff']]
-    qps['65dB_diff_r'] = [ round((dblendiff/sp['65dBl'])*100) if sp['65dBl'] != 0 else 0 for dblendiff in qps['65dB_diff']]
-    # collect
-    sp_stats = {'od_id': key, 'length': sp['length'], 'mdB': sp['mdB'], 'nei': sp['nei'], 'nei_norm': sp['nei_norm'], 'util': sp['util'], '60dBl': sp['60dBl'], '65dBl': sp['65dBl'], '60dBr': sp['60dBr'], '65dBr': sp['65dBr'] }
-    qp_stats = pstats.get_best_quiet_paths_of_max_len_diffs(od_id=key, df=qps, sp=sp, max_len_diffs=[100, 200, 300])
-    qp_stats['count_qp'] = len(qps)
-    all_od_stats.append({ **sp_stats, **qp_stats })
-    # print('best_qp', od_stats)
-    # print(qps[['path_id', 'len_sp', 'length', 'len_diff']])
-
-#%% collect od stats
-od_stats_df = pd.DataFrame(all_od_stats, columns=all_od_stats[0].keys())
+od_stats_df = pstats.get_od_quiet_path_stats(p, max_len_diffs=[100, 200, 300])
+
+#%% check od stats
 print('od stats count:', len(od_stats_df))
 # od stats count: 30097
 od_stats_df.head()
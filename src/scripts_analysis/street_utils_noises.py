@@ -1,7 +1,7 @@
 #%%
 import pandas as pd
 import geopandas as gpd
-import ast
+import numpy as np
 import time
 from fiona.crs import from_epsg
 from multiprocessing import current_process, Pool
@@ -16,60 +16,39 @@ import utils.exposures as exps
 import utils.quiet_paths as qp
 import utils.plots as plots 
 import utils.path_stats as pstats
+import utils.csr_graph as csr
+import utils.snapping as snapping
+import utils.pipeline as pipeline
+import utils.edge_flows as flows
 
 edges_out_file = 'street_utils_run_2'
 problem_axyinds = [3933756673875] # routing will be skipped from these
 
-#%% initialize graph & extract edge_gdf
-start_time = time.time()
+#%% initialize routing graph
+# routing graph is loaded from memory-mapped graph snapshot in each worker (see init_routing_worker), so the arrays
+# are shared by the processes through the page cache instead of being copied to each worker
 nts = qp.get_noise_tolerances()
 db_costs = qp.get_db_costs()
-graph = files.get_network_full_noise(version=3)
-# graph = files.get_network_kumpula_noise(version=3)
-print('Graph of', graph.size(), 'edges read.')
-edge_gdf = nw.get_edge_gdf(graph, attrs=['geometry', 'length', 'noises'])
-node_gdf = nw.get_node_gdf(graph)
-print('Network features extracted.')
-edges_sind = edge_gdf.sindex
-nodes_sind = node_gdf.sindex
-print('Spatial index built.')
-utils.print_duration(start_time, 'Network initialized.')
-
-#%% Create dict of unique edges { (u,v): 0, (u,v): 0, ... }
-# function for creating identifier for edge's node pair
-def form_edge_uvu_id(uvkey):
-    uv = uvkey[:2]
-    return tuple(sorted(uv))
-# add edge_id for unique node pairs (group directions and parallel edges)
-edges_subset = edge_gdf.copy()
-edges_subset['edge_id'] = [form_edge_uvu_id(uvkey) for uvkey in edges_subset['uvkey']]
-print('all edges count', len(edges_subset))
-# sort edge gdf by edge length
-edges_subset = edges_subset.sort_values(by=['length'], ascending=True)
-edges_subset.head(3)
-# drop duplicate edges
-edges_subset = edges_subset.drop_duplicates(subset=['edge_id'], keep='first')
-print('unique uv pair edge count', len(edges_subset))
-# create edge dict
-edges_d = {}
-for edge in edges_subset.itertuples():
-    edges_d[getattr(edge, 'edge_id')] = 0
-print('edges in dict:', len(edges_d.keys()))
+csr_graph = None
+snap_index = None
+
+def init_routing_worker():
+    global csr_graph, snap_index
+    csr_graph = csr.get_csr_graph(files.get_network_full_noise_snapshot(version=3))
+    # csr_graph = csr.get_csr_graph(files.get_network_kumpula_noise_snapshot(version=3))
+    snap_index = snapping.get_snap_index(csr_graph)
 
 #%% define functions for calculating shortest paths
 def get_origin_stop_paths(from_latLon=None, to_latLon=None):
-    return rt.get_short_quiet_paths(graph, from_latLon, to_latLon, edge_gdf, node_gdf, nts=nts, db_costs=db_costs, remove_geom_prop=False, only_short=True, logging=False)
+    return rt.get_shortest_path_dict(csr_graph, from_latLon, to_latLon, snap_index, nts=nts, db_costs=db_costs)
 
 # function for calculating short path
-def get_origin_stops_paths(home_stops_file):
-    from_axyind = commutes_utils.get_xyind_from_filename(home_stops_file)
+def get_origin_stops_paths(from_axyind):
     if (from_axyind in problem_axyinds):
         print('skipping problematic axyind')
         return from_axyind
     try:
-        home_stops = pd.read_csv(home_stops_path+'/'+home_stops_file)
-        home_stops['DT_origin_latLon'] = [ast.literal_eval(d) for d in home_stops['DT_origin_latLon']]
-        home_stops['dest_latLon'] = [ast.literal_eval(d) for d in home_stops['dest_latLon']]
+        home_stops = home_stops_groups.get_group(from_axyind)
         paths = []
         for idx, row in home_stops.iterrows():
             if (row['to_pt_mode'] == 'WALK'):
@@ -78,80 +57,96 @@ def get_origin_stops_paths(home_stops_file):
             if (path is None):
                 print('routing error with:', row['from_axyind'], 'prob:', row['prob'])
                 continue
-            paths.append(tuple([path, row['utilization']]))
+            paths.append(tuple([path['edge_ids'], row['utilization']]))
         return paths
     except Exception as e:
         print('Error with:', from_axyind)
         print(str(e))
         return from_axyind
 
-#%% Read ODs of the first walks of the commutes
-home_stops_path = 'outputs/YKR_commutes_output/home_stops'
-axyinds = commutes_utils.get_xyind_filenames(path=home_stops_path)
-to_process = axyinds #[:10]
+# function for routing a chunk of origins and aggregating the paths to edge utilizations (in the worker)
+def get_origins_edge_utils_chunk(axyinds):
+    edge_utils = flows.get_edge_utils_array(csr_graph['edge_count'])
+    errors = []
+    paths_count = 0
+    for axyind in axyinds:
+        paths = get_origin_stops_paths(axyind)
+        if (type(paths) is not list):
+            errors.append(axyind)
+            continue
+        paths_count += len(paths)
+        flows.add_path_utils(edge_utils, [edge_ids for edge_ids, util in paths], [util for edge_ids, util in paths])
+    # only utilized edges are passed to the main process
+    return flows.get_sparse_edge_utils(edge_utils), errors, paths_count
+
+#%% Read ODs of the first walks of the commutes (partitions of the commutes_stops pipeline)
+home_stops_dir = 'outputs/YKR_commutes_output/home_stops_parts'
+home_stops_groups = pipeline.read_partitions(home_stops_dir).groupby('from_axyind')
+to_process = list(home_stops_groups.groups.keys()) #[:10]
 print('Start processing', len(to_process), 'axyinds')
 
-#%% routing analysis
-# get list of lists per paths & utils from each axyind
-pool = Pool(processes=4)
-all_path_lists = pool.map(get_origin_stops_paths, to_process) # faster than below
-# all_path_lists = [get_origin_stops_paths(axyind) for axyind in to_process]
+#%% read graph snapshot (memory-mapped, routing workers load their own routing graphs)
+graph_arrays = files.get_network_full_noise_snapshot(version=3)
+# graph_arrays = files.get_network_kumpula_noise_snapshot(version=3)
+print('Graph of', len(graph_arrays['edge_uv']), 'edges read.')
 
-#%% collect & filter out errors
-errors = [path for path in all_path_lists if type(path) is int]
+#%% routing analysis
+# paths are aggregated to edge utilizations (by edge index) in chunks of origins and the chunks are merged as soon as they
+# are ready, so neither the paths nor the results of all chunks are held in memory at once (at most max_pending chunks in process)
+chunk_size = 10
+axyind_chunks = [to_process[idx:idx + chunk_size] for idx in range(0, len(to_process), chunk_size)]
+edge_utils = flows.get_edge_utils_array(len(graph_arrays['edge_uv']))
+errors = []
+paths_count = 0
+pool = Pool(processes=4, initializer=init_routing_worker)
+# origins of chunks that fail in the worker are counted as errors (the other chunks keep going)
+def get_failed_chunk_utils(axyinds, error):
+    print('Error with chunk:', axyinds, repr(error))
+    return (np.array([], dtype=np.int64), np.array([])), list(axyinds), 0
+for chunk_edge_utils, chunk_errors, chunk_paths_count in pipeline.imap_bounded(pool, get_origins_edge_utils_chunk, axyind_chunks, max_pending=8, get_failure=get_failed_chunk_utils):
+    flows.add_sparse_edge_utils(edge_utils, chunk_edge_utils)
+    errors += chunk_errors
+    paths_count += chunk_paths_count
+pool.close()
+# init_routing_worker()
+# for chunk_edge_utils, chunk_errors, chunk_paths_count in pipeline.imap_bounded(None, get_origins_edge_utils_chunk, axyind_chunks): ...
+
+#%% print errors & counts
 print('errors count:', len(errors))
-all_path_lists = [path for path in all_path_lists if type(path) is not int]
-print('path list count:', len(all_path_lists))
-# explode all path lists to list of path-tuples (path, util)
-all_paths = [path for paths in all_path_lists for path in paths]
-print('all paths count:', len(all_paths))
-
-#%% define functions for aggregating path utlis to utilization of individual edges
-def explode_path_util_to_edge_utils(path_util):
-    # returns list of tuples: [(edge_id, util), ...]
-    util = path_util[1]
-    path = path_util[0]
-    edge_utils = []
-    for idx in range(0, len(path)-1):
-        edge = tuple(sorted([path[idx], path[idx+1]]))
-        edge_utils.append(tuple([edge, util]))
-    return edge_utils
-
-def add_edge_utils_to_dict(edge_utils):
-    for edge_util in edge_utils:
-        edge_id = edge_util[0]
-        util = edge_util[1]
-        try:
-            edges_d[edge_id] += util
-        except:
-            continue
-
-#%% aggregate edge utilizations
-for path_util in all_paths:
-    edge_utils = explode_path_util_to_edge_utils(path_util)
-    add_edge_utils_to_dict(edge_utils)
-
-#%% collect edge utilizations to dataframe
-edge_utils_df = pd.DataFrame(list(edges_d.items()), index=edges_d.keys(), columns=['edge_id', 'util'])
-edge_utils_df = edge_utils_df.sort_values('util', ascending=False)
-edge_utils_df.head()
-
-#%% merge edge utils to edge gdf
-print('edge utils rows:', len(edge_utils_df))
-print('edge gdf rows:', len(edges_subset))
-edge_utils_gdf = pd.merge(edges_subset, edge_utils_df, how='left', on='edge_id')
-print('merged rows:', len(edge_utils_gdf))
-# edge_utils_gdf.head()
+print('all paths count:', paths_count)
+print('utilized edges count:', np.count_nonzero(edge_utils))
+
+#%% calculate edge noise attributes
+# mdB, nei & nei_norm of edges are calculated once as arrays by edge index of the graph snapshot
+edge_noise_attrs = nw.get_edge_noise_attrs(graph_arrays, db_costs)
+
+#%% Collect unique edges with aggregated utilizations
+# edge_id for unique node pairs (group directions and parallel edges), of parallel edges the shortest one is kept
+# with the utilizations of all edges of the node pair
+edge_nodes = np.sort(np.asarray(graph_arrays['node_ids'])[np.asarray(graph_arrays['edge_uv'])], axis=1)
+edges_subset = pd.DataFrame({ 'edge_idx': np.arange(len(edge_nodes)), 'u': edge_nodes[:, 0], 'v': edge_nodes[:, 1], 'length': np.asarray(graph_arrays['edge_length']), 'util': edge_utils })
+print('all edges count', len(edges_subset))
+edges_subset['util'] = edges_subset.groupby(['u', 'v'])['util'].transform('sum')
+edges_subset = edges_subset.sort_values(by=['length'], ascending=True, kind='mergesort')
+edges_subset = edges_subset.drop_duplicates(subset=['u', 'v'], keep='first')
+print('unique uv pair edge count', len(edges_subset))
 
-#%% add noise indexes to edge utils gdf
-edge_utils_gdf['mdB'] = edge_utils_gdf.apply(lambda row: exps.get_mean_noise_level(row['noises'], row['length']), axis=1)
-edge_utils_gdf['nei'] = [round(exps.get_noise_cost(noises=noises, db_costs=db_costs), 1) for noises in edge_utils_gdf['noises']]
-edge_utils_gdf['nei_norm'] = edge_utils_gdf.apply(lambda row: exps.get_nei_norm(row.nei, row.total_length, db_costs), axis=1)
+#%% add noise indexes & geometries to edge utils gdf
+edge_idxs = edges_subset['edge_idx'].values
+edge_utils_gdf = gpd.GeoDataFrame({
+    'length': edges_subset['length'].values,
+    'util': edges_subset['util'].values,
+    'mdB': edge_noise_attrs['mdB'][edge_idxs],
+    'nei': edge_noise_attrs['nei'][edge_idxs],
+    'nei_norm': edge_noise_attrs['nei_norm'][edge_idxs],
+    'geometry': [nw.get_edge_geom_from_arrays(graph_arrays, edge_idx) for edge_idx in edge_idxs.tolist()]
+    }, crs=from_epsg(3879))
+edge_utils_gdf = edge_utils_gdf.sort_values('util', ascending=False)
+print('edge utils rows:', len(edge_utils_gdf))
 
 #%% export edges with noise & util attributes to file
-edge_utils_gdf_file = edge_utils_gdf.drop(columns=['uvkey', 'noises', 'edge_id'])
-# edge_utils_gdf_file = edge_utils_gdf_file.query('util > 0')
-edge_utils_gdf_file.to_file('outputs/YKR_commutes_output/edge_stats.gpkg', layer=edges_out_file, driver='GPKG')
+# edge_utils_gdf = edge_utils_gdf.query('util > 0')
+edge_utils_gdf.to_file('outputs/YKR_commutes_output/edge_stats.gpkg', layer=edges_out_file, driver='GPKG')
 print('exported file:', edges_out_file)
 
 #### READ & ANALYSE STREET STATS ####
@@ -159,7 +154,7 @@ print('exported file:', edges_out_file)
 
 #%% read edge stats
 edges =  gpd.read_file('outputs/YKR_commutes_output/edge_stats.gpkg', layer=edges_out_file)
-# edges = edge_utils_gdf_file.copy()
+# edges = edge_utils_gdf.copy()
 
 #%% plot util vs mdB
 edges_filt = edges.query('util < 2000 and util > 0')
@@ -186,32 +181,12 @@ for perc in percs:
     print(perc, len(perc_edges), 'of', len(edges), '-',perc_edges_ratio, '% -', db_stats[perc], 'dB,', round(util_stats[perc]), 'util')
 
 #%% extract percentile info to edges
-edges['perc_comb'] = 'p0'
-edges['perc_util'] = 'p0'
-edges['perc_mdB'] = 'p0'
-
-def get_street_comb_perc_value(row, perc):
-    if (row['util'] > util_stats[perc] and row['mdB'] > db_stats[perc]):
-        return perc
-    else:
-        return row['perc_comb']
-
-def get_street_var_perc_value(row, perc, var):
-    if (var == 'util'):
-        if (row['util'] > util_stats[perc]):
-            return perc
-        else:
-            return row['perc_util']
-    if (var == 'mdB'):
-        if (row['mdB'] > db_stats[perc]):
-            return perc
-        else:
-            return row['perc_mdB']
-
-for perc in percs:
-    edges['perc_comb'] = edges.apply(lambda row: get_street_comb_perc_value(row, perc), axis=1)
-    edges['perc_util'] = edges.apply(lambda row: get_street_var_perc_value(row, perc, 'util'), axis=1)
-    edges['perc_mdB'] = edges.apply(lambda row: get_street_var_perc_value(row, perc, 'mdB'), axis=1)
+# edges are classified by the highest percentile of util / mdB (or both) that they exceed
+util_perc_classes = pstats.get_perc_classes(edges['util'], [util_stats[perc] for perc in percs])
+mdB_perc_classes = pstats.get_perc_classes(edges['mdB'], [db_stats[perc] for perc in percs])
+edges['perc_comb'] = pstats.get_perc_class_names(np.minimum(util_perc_classes, mdB_perc_classes), percs)
+edges['perc_util'] = pstats.get_perc_class_names(util_perc_classes, percs)
+edges['perc_mdB'] = pstats.get_perc_class_names(mdB_perc_classes, percs)
 
 #%% export edges with percentile info to file
 edges.to_file('outputs/YKR_commutes_output/edge_stats.gpkg', layer=edges_out_file+'_percs', driver='GPKG')
@@ -13,30 +13,19 @@ import utils.exposures as exps
 import utils.quiet_paths as qp
 import utils.utils as utils
 import utils.tests as tests
+import utils.csr_graph as csr
+import utils.snapping as snapping
 
 #%% 
 def get_short_quiet_paths(graph, from_latLon, to_latLon, logging=False):
     from_xy = geom_utils.get_xy_from_lat_lon(from_latLon)
     to_xy = geom_utils.get_xy_from_lat_lon(to_latLon)
     # find origin and destination nodes from closest edges
-    orig_node = rt.get_nearest_node(graph, from_xy, edge_gdf, node_gdf, nts=nts, db_costs=db_costs, logging=logging)
-    dest_node = rt.get_nearest_node(graph, to_xy, edge_gdf, node_gdf, nts=nts, db_costs=db_costs, logging=logging, orig_node=orig_node)
-    # utils.print_duration(start_time, 'Origin & destination nodes set.')
-    # start_time = time.time()
-    # get shortest path
-    path_list = []
-    shortest_path = rt.get_shortest_path(graph, orig_node['node'], dest_node['node'], weight='length')
-    path_geom_noises = nw.aggregate_path_geoms_attrs(graph, shortest_path, weight='length', noises=True)
-    path_list.append({**path_geom_noises, **{'id': 'short_p','type': 'short', 'nt': 0}})
-    # get quiet paths to list
-    for nt in nts:
-        noise_cost_attr = 'nc_'+str(nt)
-        shortest_path = rt.get_shortest_path(graph, orig_node['node'], dest_node['node'], weight=noise_cost_attr)
-        path_geom_noises = nw.aggregate_path_geoms_attrs(graph, shortest_path, weight=noise_cost_attr, noises=True)
-        path_list.append({**path_geom_noises, **{'id': 'q_'+str(nt), 'type': 'quiet', 'nt': nt}})
-    # remove linking edges of the origin / destination nodes
-    nw.remove_new_node_and_link_edges(graph, orig_node)
-    nw.remove_new_node_and_link_edges(graph, dest_node)
+    orig_node = rt.get_nearest_node(snap_index, from_xy, nts=nts, db_costs=db_costs, logging=logging)
+    dest_node = rt.get_nearest_node(snap_index, to_xy, nts=nts, db_costs=db_costs, logging=logging, orig_node=orig_node)
+    # get shortest path & quiet paths (origin & destination linking edges are passed as overlay)
+    overlay = csr.get_link_edge_overlay(csr_graph, [orig_node, dest_node])
+    path_list = rt.get_short_quiet_path_list(csr_graph, orig_node['node'], dest_node['node'], nts=nts, overlay=overlay)
     # collect quiet paths to gdf
     paths_gdf = gpd.GeoDataFrame(path_list, crs=from_epsg(3879))
     paths_gdf = paths_gdf.drop_duplicates(subset=['type', 'total_length']).sort_values(by=['type', 'total_length'], ascending=[False, True])
@@ -56,15 +45,11 @@ db_costs = qp.get_db_costs()
 # graph = files.get_network_full_noise()
 graph = files.get_network_kumpula_noise()
 print('Graph of', graph.size(), 'edges read.')
-edge_gdf = nw.get_edge_gdf(graph, attrs=['geometry', 'length', 'noises'])
-node_gdf = nw.get_node_gdf(graph)
-print('Network features extracted.')
-nw.set_graph_noise_costs(graph, edge_gdf, db_costs=db_costs, nts=nts)
-edge_gdf = edge_gdf[['uvkey', 'geometry', 'noises']]
-print('Noise costs set.')
-edges_sind = edge_gdf.sindex
-nodes_sind = node_gdf.sindex
-print('Spatial index built.')
+csr_graph = csr.get_csr_graph(nw.get_graph_arrays(graph))
+csr.set_noise_costs(csr_graph, db_costs=db_costs)
+print('Routing graph & base noise costs set.')
+snap_index = snapping.get_snap_index(csr_graph)
+print('Snapping index built.')
 utils.print_duration(start_time, 'Network initialized.')
 
 def get_od_path_stats(graph, od_dict, logging=False):
@@ -160,5 +145,11 @@ class TestQuietPaths(unittest.TestCase):
         stats = get_od_path_stats(graph, od_dict[15])
         self.assertDictEqual(stats, compare_d)
 
+    def test_quiet_paths_for_ods(self):
+        ods = [(od_dict[idx]['orig_latLon'], od_dict[idx]['dest_latLon']) for idx in [3, 4, 3]]
+        od_paths = rt.get_short_quiet_paths_for_ods(csr_graph, ods, snap_index, nts=nts, db_costs=db_costs)
+        sp_lens = [[path['properties']['length'] for path in paths['paths'] if path['properties']['type'] == 'short'][0] for paths in od_paths]
+        self.assertListEqual([round(sp_len, 1) for sp_len in sp_lens], [936.5, 1136.5, 936.5])
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,13 +2,28 @@ import pytest
 import geopandas as gpd
 import osmnx as ox
 import time
-from shapely.geometry import LineString
+import numpy as np
+from shapely.geometry import LineString, Polygon
 import utils.geometry as geom_utils
 import utils.exposures as exps
 import utils.networks as nw
 import utils.files as files
 import utils.routing as rt
 import utils.tests as tests
+import utils.quiet_paths as qp
+import utils.csr_graph as csr
+import utils.snapping as snapping
+import utils.path_cache as path_cache
+import utils.DT_API as DT_routing
+import utils.DT_cache as DT_cache
+import utils.DT_replay as DT_replay
+import utils.weighted_stats as wstats
+import utils.pipeline as pipeline
+import utils.path_stats as pstats
+import utils.edge_flows as flows
+import pandas as pd
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 # read data
 walk = tests.get_update_test_walk_line()
@@ -49,6 +64,13 @@ def test_get_exposure_lines():
     max_noise = noise_lines['db_lo'].max()
     assert (mean_noise, min_noise, max_noise) == (59.5, 40.0, 75.0)
 
+def test_batch_projection():
+    latLons = [{'lat': 60.20467, 'lon': 24.96217}, {'lat': 60.16088, 'lon': 24.92796}]
+    xys = geom_utils.get_xys_from_lat_lons(latLons)
+    points = [geom_utils.project_to_etrs(geom_utils.get_point_from_lat_lon(latLon)) for latLon in latLons]
+    assert [(round(xy['x'], 3), round(xy['y'], 3)) for xy in xys] == [(round(point.x, 3), round(point.y, 3)) for point in points]
+    assert geom_utils.get_lat_lons_from_points(points) == [geom_utils.get_lat_lon_from_geom(geom_utils.project_to_wgs(point)) for point in points]
+
 def test_get_edge_dicts():
     graph_proj = files.get_network_kumpula()
     edge_dicts = nw.get_all_edge_dicts(graph_proj)
@@ -70,6 +92,26 @@ def test_add_exposures_to_edges():
     exp_len_sum = sum(edge_d['noises'].values())
     assert (edge_d['noises'], round(exp_len_sum,1)) == ({65: 107.025, 70: 20.027}, round(edge_d['length'],1))
 
+def test_bulk_edge_noises():
+    graph_proj = files.get_network_kumpula()
+    edge_gdf = nw.get_edge_gdf(graph_proj, attrs=['geometry', 'length', 'uvkey'], subset=50)
+    edge_noises = exps.get_line_noises_df(edge_gdf, 'uvkey', noise_polys)
+    assert edge_noises.loc[0, 'noises'] == {65: 107.025, 70: 20.027}
+    # bulk extraction gives the same contaminated distances as splitting edges one by one
+    for edge_geom, noises in zip(edge_gdf['geometry'], edge_noises['noises']):
+        split_noises = exps.get_noise_dict_for_geom(edge_geom, noise_polys)
+        split_noises = { db: db_len for db, db_len in split_noises.items() if db != 40 }
+        assert noises.keys() == split_noises.keys()
+        assert all(abs(noises[db] - split_noises[db]) < 0.01 for db in noises.keys())
+
+def test_line_noises_on_shared_boundary():
+    # a line along the shared boundary of two adjacent noise zones is counted only for the zone of higher dB
+    polys = gpd.GeoDataFrame({ 'db_lo': [55, 60] }, geometry=[Polygon([(0, 0), (100, 0), (100, 50), (0, 50)]), Polygon([(0, 50), (100, 50), (100, 100), (0, 100)])], crs=noise_polys.crs)
+    lines = [LineString([(10, 50), (90, 50)]), LineString([(10, 25), (10, 75)]), LineString([(10, 25), (10, 50), (90, 50)])]
+    noise_array = exps.get_line_noise_array(lines, polys)
+    assert exps.get_noise_dicts_from_array(noise_array) == [{ 60: 80.0 }, { 55: 25.0, 60: 25.0 }, { 55: 25.0, 60: 80.0 }]
+    assert np.all(noise_array.sum(axis=1) <= np.array([line.length for line in lines]) + 1e-6)
+
 def test_aggregate_exposures():
     exp_list = [{55: 21.5, 60: 12}, {55: 3.5, 60: 1.5}, {60: 2.5, 70: 200}]
     exposure = exps.aggregate_exposures(exp_list)
@@ -80,3 +122,246 @@ def test_mean_noise_level():
     noises = { 55: 25, 60: 16, 70: 200 }
     mean_noise_level = exps.get_mean_noise_level(noises, 300)
     assert mean_noise_level == 64.82
+
+def test_noise_matrix():
+    noises_list = [{ 55: 25, 60: 16, 70: 200 }, { 45: 20.5, 65: 100.25 }, {}]
+    lengths = [300, 150, 50]
+    noise_matrix = exps.get_noise_matrix(noises_list)
+    assert noise_matrix.shape == (3, len(exps.get_noise_dbs()))
+    assert exps.get_mean_noise_levels(noise_matrix, lengths).tolist() == [exps.get_mean_noise_level(noises, length) for noises, length in zip(noises_list, lengths)]
+    assert exps.get_noise_costs(noise_matrix, db_costs=qp.get_db_costs(version=3)).tolist() == [exps.get_noise_cost(noises, db_costs=qp.get_db_costs(version=3)) for noises in noises_list]
+    assert exps.get_th_exposure_matrix(noise_matrix, [55, 60, 65, 70])[0].tolist() == [241, 216, 200, 200]
+    assert exps.get_noise_pct_matrix(noise_matrix, lengths)[1].tolist() == [33.1, 0, 0, 0, 66.8, 0]
+    assert exps.get_noise_dict_from_vector(noise_matrix.sum(axis=0)) == { 45: 20.5, 55: 25, 60: 16, 65: 100.25, 70: 200 }
+
+def test_graph_snapshot(tmpdir):
+    graph = files.get_network_kumpula_noise()
+    files.export_graph_snapshot(graph, 'kumpula_snapshot', folder=str(tmpdir))
+    graph_snap = nw.get_graph_from_arrays(files.load_graph_snapshot('kumpula_snapshot', folder=str(tmpdir)))
+    edge_d = nw.get_all_edge_dicts(graph, by_nodes=False)[0]
+    edge_snap_d = graph_snap[edge_d['uvkey'][0]][edge_d['uvkey'][1]][0]
+    assert (graph_snap.number_of_nodes(), graph_snap.number_of_edges()) == (graph.number_of_nodes(), graph.number_of_edges())
+    assert (edge_snap_d['length'], edge_snap_d['noises'], edge_snap_d['geometry'].equals(edge_d['geometry'])) == (edge_d['length'], edge_d['noises'], True)
+
+def test_snapshot_noise_patch(tmpdir):
+    graph = files.get_network_kumpula_noise()
+    files.export_graph_snapshot(graph, 'kumpula_snapshot', folder=str(tmpdir))
+    graph_arrays = files.load_graph_snapshot('kumpula_snapshot', folder=str(tmpdir))
+    # raise noise levels of 70 dB zones to 75 dB and re-noise only the affected edges
+    new_noise_polys = noise_polys.copy()
+    new_noise_polys.loc[new_noise_polys['db_lo'] == 70, 'db_lo'] = 75
+    changed_noise_polys = exps.get_changed_noise_polygons(noise_polys, new_noise_polys)
+    edge_noises, renoise_ids = nw.get_updated_edge_noises(graph_arrays, new_noise_polys, changed_noise_polys=changed_noise_polys)
+    files.export_graph_snapshot_noise_patch('kumpula_snapshot', renoise_ids, edge_noises[renoise_ids], folder=str(tmpdir))
+    graph_arrays_patched = files.load_graph_snapshot('kumpula_snapshot', folder=str(tmpdir))
+    db_70_idx = graph_arrays['meta']['dbs'].index(70)
+    unchanged = np.ones(len(edge_noises), dtype=bool)
+    unchanged[renoise_ids] = False
+    assert 0 < len(renoise_ids) < len(edge_noises)
+    assert graph_arrays_patched['edge_noises'][:, db_70_idx].sum() == 0
+    assert np.array_equal(graph_arrays_patched['edge_noises'][unchanged], graph_arrays['edge_noises'][unchanged])
+
+def test_csr_graph_shortest_path():
+    graph = files.get_network_kumpula_noise()
+    csr_graph = csr.get_csr_graph(nw.get_graph_arrays(graph))
+    orig_node, dest_node = list(graph.nodes)[0], list(graph.nodes)[500]
+    nx_path = rt.get_shortest_path(graph, orig_node, dest_node, weight='length')
+    csr_path = rt.get_shortest_path(csr_graph, orig_node, dest_node, weight='length')
+    nx_path_len = nw.aggregate_path_geoms_attrs(graph, nx_path, weight='length')['total_length']
+    csr_path_len = nw.aggregate_path_geoms_attrs(csr_graph, csr_path)['total_length']
+    assert (csr_path['nodes'][0], csr_path['nodes'][-1], round(csr_path_len, 1)) == (orig_node, dest_node, round(nx_path_len, 1))
+
+def test_csr_path_assembly():
+    graph = files.get_network_kumpula_noise()
+    csr_graph = csr.get_csr_graph(nw.get_graph_arrays(graph))
+    orig_node, dest_node = list(graph.nodes)[0], list(graph.nodes)[500]
+    nx_path = rt.get_shortest_path(graph, orig_node, dest_node, weight='length')
+    csr_path = rt.get_shortest_path(csr_graph, orig_node, dest_node, weight='length')
+    nx_path_attrs = nw.aggregate_path_geoms_attrs(graph, nx_path, weight='length', noises=True)
+    csr_path_attrs = nw.aggregate_path_geoms_attrs(csr_graph, csr_path, noises=True)
+    assert csr_path_attrs['geometry'].coords[0] == nx_path_attrs['geometry'].coords[0]
+    assert csr_path_attrs['geometry'].coords[-1] == nx_path_attrs['geometry'].coords[-1]
+    assert round(csr_path_attrs['geometry'].length, 1) == round(nx_path_attrs['geometry'].length, 1)
+    assert round(sum(csr_path_attrs['noises'].values()), 1) == round(sum(nx_path_attrs['noises'].values()), 1)
+
+def test_remove_duplicate_edge_paths():
+    def get_path(path_id, path_type, edge_lengths, nei):
+        return { 'properties': { 'id': path_id, 'type': path_type, 'length': sum(edge_lengths.values()), 'nei': nei, 'edge_lengths': edge_lengths, 'geometry': None } }
+    paths = [
+        get_path('short_p', 'short', { 0: 400, 1: 300, 2: 300 }, 80),
+        get_path('q_1', 'quiet', { 0: 400, 1: 300, 3: 10, 4: 295 }, 70),
+        get_path('q_2', 'quiet', { 0: 400, 5: 450, 6: 300 }, 50)
+        ]
+    assert round(qp.get_edge_overlap_ratio(paths[0], paths[1]), 3) == 0.536
+    unique_paths = qp.remove_duplicate_edge_paths(paths, tolerance=30, min_overlap=0.5, logging=False)
+    assert [path['properties']['id'] for path in unique_paths] == ['short_p', 'q_2']
+    assert unique_paths[0]['properties']['nei'] == 70
+    assert 'edge_lengths' not in unique_paths[0]['properties'] and 'geometry' not in unique_paths[0]['properties']
+
+def test_remove_duplicate_edge_paths_parallel_geoms():
+    # paths along parallel sidewalk & road share no edges but are grouped by the buffered geometry as before
+    def get_path(path_id, path_type, edge_lengths, nei, coords):
+        return { 'properties': { 'id': path_id, 'type': path_type, 'length': sum(edge_lengths.values()), 'nei': nei, 'edge_lengths': edge_lengths, 'geometry': LineString(coords) } }
+    paths = [
+        get_path('short_p', 'short', { 0: 500, 1: 500 }, 80, [(0, 0), (1000, 0)]),
+        get_path('q_1', 'quiet', { 2: 505, 3: 505 }, 60, [(0, 12), (1000, 12)]),
+        get_path('q_2', 'quiet', { 4: 510, 5: 510 }, 40, [(0, 80), (1000, 80)])
+        ]
+    assert qp.get_edge_overlap_ratio(paths[0], paths[1]) == 0
+    assert [path['properties']['id'] for path in qp.get_overlapping_edge_paths(paths[0], paths, buffer_m=30)] == ['short_p', 'q_1']
+    unique_paths = qp.remove_duplicate_edge_paths(paths, tolerance=30, logging=False)
+    assert [path['properties']['id'] for path in unique_paths] == ['short_p', 'q_2']
+    assert unique_paths[0]['properties']['nei'] == 60
+
+def test_csr_graph_quiet_path():
+    graph = files.get_network_kumpula_noise()
+    db_costs = qp.get_db_costs(version=3)
+    edge_gdf = nw.get_edge_gdf(graph, attrs=['geometry', 'length', 'noises'])
+    nw.set_graph_noise_costs(graph, edge_gdf, db_costs=db_costs, nts=[2])
+    csr_graph = csr.get_csr_graph(nw.get_graph_arrays(graph))
+    csr.set_noise_costs(csr_graph, db_costs=db_costs, version=3)
+    orig_node, dest_node = list(graph.nodes)[0], list(graph.nodes)[500]
+    nx_path = rt.get_shortest_path(graph, orig_node, dest_node, weight='nc_2')
+    csr_path = rt.get_shortest_path(csr_graph, orig_node, dest_node, weight='nc_2')
+    nx_path_len = nw.aggregate_path_geoms_attrs(graph, nx_path, weight='nc_2')['total_length']
+    csr_path_len = nw.aggregate_path_geoms_attrs(csr_graph, csr_path)['total_length']
+    assert round(csr_path_len, 1) == round(nx_path_len, 1)
+
+def test_snap_index_nearest_edge():
+    graph = files.get_network_kumpula_noise()
+    snap_index = snapping.get_snap_index(csr.get_csr_graph(nw.get_graph_arrays(graph)))
+    xy = geom_utils.get_xy_from_lat_lon({'lat': 60.20467, 'lon': 24.96217})
+    nearest_edge = snapping.get_nearest_edge(snap_index, xy)
+    edge_d = snapping.get_edge_dict(snap_index, nearest_edge['edge_id'])
+    edge_dists = [edge['geometry'].distance(geom_utils.get_point_from_xy(xy)) for edge in nw.get_all_edge_dicts(graph, by_nodes=False)]
+    assert (round(nearest_edge['distance'], 2), round(edge_d['geometry'].distance(geom_utils.get_point_from_xy(xy)), 2)) == (round(min(edge_dists), 2), round(min(edge_dists), 2))
+
+def test_path_cache():
+    cache = path_cache.get_path_cache(max_entries=2, max_bytes=10, ttl=None, version='v1')
+    path_cache.set_cached_value(cache, 'a', b'1234', version='v1')
+    path_cache.set_cached_value(cache, 'b', b'1234', version='v1')
+    assert path_cache.get_cached_value(cache, 'a', version='v1') == b'1234'
+    # least recently used value is evicted (by max_bytes)
+    path_cache.set_cached_value(cache, 'c', b'1234', version='v1')
+    assert (path_cache.get_cached_value(cache, 'b', version='v1'), path_cache.get_cached_value(cache, 'c', version='v1')) == (None, b'1234')
+    # all values are dropped when the version (graph snapshot) changes
+    assert path_cache.get_cached_value(cache, 'a', version='v2') is None
+    stats = path_cache.get_cache_stats(cache)
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['entries']) == (2, 2, 1, 0)
+
+def test_dt_query_cache(tmpdir):
+    cache = DT_cache.get_query_cache(str(tmpdir.join('dt_queries.sqlite')))
+    ods = [({'lat': 60.2, 'lon': 24.9}, {'lat': 60.3, 'lon': 24.8}), ({'lat': 60.1, 'lon': 24.9}, {'lat': 60.3, 'lon': 24.8})]
+    queries = [DT_routing.build_full_route_query(latlon_from, latlon_to, '1.16666', 2500, 3, datetime(2019, 5, 27, 8, 30)) for latlon_from, latlon_to in ods]
+    DT_cache.set_cached_response(cache, queries[0], { 'data': { 'plan': { 'itineraries': [{ 'duration': 600 }] } } })
+    # plans of batch queries share the cache keys of full route queries
+    batch_queries = DT_routing.split_batch_route_query(DT_routing.build_batch_route_query(ods, '1.16666', 2500, 3, datetime(2019, 5, 27, 8, 30)))
+    assert [DT_cache.get_query_key(query) for query in batch_queries.values()] == [DT_cache.get_query_key(query) for query in queries]
+    assert DT_routing.split_batch_route_query(queries[0]) is None
+    # missing plans are replayed as null
+    status, response = DT_replay.get_replay_response(cache, DT_routing.build_batch_route_query(ods, '1.16666', 2500, 3, datetime(2019, 5, 27, 8, 30)))
+    assert status == 200 and response['data'] == { 'p0': { 'itineraries': [{ 'duration': 600 }] }, 'p1': None }
+    assert DT_replay.get_replay_response(cache, queries[1])[0] == 404
+
+def test_dt_failed_routing():
+    # failed requests give None for the OD pairs (not empty lists as OD pairs without itineraries)
+    client = DT_routing.get_client(max_retries=0, timeout=1, endpoint='http://127.0.0.1:9/')
+    ods = [({'lat': 60.2, 'lon': 24.9}, {'lat': 60.3, 'lon': 24.8}), ({'lat': 60.1, 'lon': 24.9}, {'lat': 60.3, 'lon': 24.8})]
+    assert DT_routing.get_route_itineraries_for_ods(ods, '1.16666', datetime(2019, 5, 27, 8, 30), itins_count=3, max_walk_distance=2500, client=client) == [None, None]
+
+def test_dt_replay_misses(tmpdir):
+    # plans missing from the cache are None in replay mode (not empty lists)
+    cache = DT_cache.get_query_cache(str(tmpdir.join('dt_queries.sqlite')))
+    ods = [({'lat': 60.2, 'lon': 24.9}, {'lat': 60.3, 'lon': 24.8}), ({'lat': 60.1, 'lon': 24.9}, {'lat': 60.3, 'lon': 24.8})]
+    DT_cache.set_cached_response(cache, DT_routing.build_full_route_query(ods[0][0], ods[0][1], '1.16666', 2500, 3, datetime(2019, 5, 27, 8, 30)), { 'data': { 'plan': { 'itineraries': [] } } })
+    client = DT_routing.get_client(cache=cache, replay=True)
+    assert DT_routing.get_route_itineraries_for_ods(ods, '1.16666', datetime(2019, 5, 27, 8, 30), itins_count=3, max_walk_distance=2500, client=client) == [[], None]
+
+def test_weighted_stats():
+    values, weights = np.array([3., 1., 4., 1., 5., 9., 2., 6.]), np.array([2., 1., 3., 1., 1., 2., 4., 1.])
+    # unweighted stats equal numpy stats
+    stats = wstats.get_weighted_stats(values, percs=[10, 90], minmax=True)
+    assert [round(stats[key], 6) for key in ['mean', 'median', 'std', 'p10', 'p90', 'min', 'max']] == [round(value, 6) for value in [np.mean(values), np.median(values), np.std(values), np.percentile(values, 10), np.percentile(values, 90), 1, 9]]
+    # weighted stats equal stats of values repeated by (integer) weights and do not depend on the scale of the weights
+    w_stats = wstats.get_weighted_stats(values, weights=weights * 0.1, percs=[25])
+    repeated = np.repeat(values, weights.astype(int))
+    assert (round(w_stats['mean'], 6), round(w_stats['std'], 6)) == (round(np.mean(repeated), 6), round(np.std(repeated), 6))
+    # quantiles are interpolated between cumulative weights of smaller values (e.g. 3 at 6/13 and 4 at 8/13)
+    assert (round(w_stats['median'], 6), round(w_stats['p25'], 6)) == (3.25, 2.3125)
+    # equal weights give the same stats as no weights and groups without weight get NaN stats
+    assert wstats.get_weighted_stats(values, weights=np.ones(len(values)), percs=[10, 90]) == wstats.get_weighted_stats(values, percs=[10, 90])
+    assert all(np.isnan(value) for value in wstats.get_weighted_stats(values, weights=np.zeros(len(values)), percs=[10]).values())
+    # stats of many groups (NaN values left out) at once equal stats by group
+    df = pd.DataFrame({ 'group': [1, 1, 1, 2, 2, 2, 2, 3], 'value': values, 'weight': weights })
+    df.loc[7, 'value'] = np.nan
+    grouped = wstats.get_grouped_weighted_stats(df, ['value'], group_col='group', weight_col='weight', col_prefixes=['val'])
+    assert list(grouped['val_median'][:2]) == [round(wstats.get_weighted_stats(values[:3], weights=weights[:3])['median'], 3), round(wstats.get_weighted_stats(values[3:7], weights=weights[3:7])['median'], 3)]
+    assert (list(grouped['n']), np.isnan(grouped['val_mean'][2])) == ([3, 4, 1], True)
+
+def test_flatten_noise_dict_columns():
+    paths = pd.DataFrame({ 'id': [1, 2], 'noises': [{ 45: 10.5, 50: 2.0 }, { 55: 3.0 }], 'noises_diff': [{ 45: -1.0 }, { 45: 0.0 }] })
+    flat = pipeline.flatten_dict_columns(paths, { 'noises': 'n', 'noises_diff': 'n_diff' })
+    assert list(flat.columns) == ['id', 'n_45', 'n_50', 'n_55', 'n_diff_45']
+    assert pipeline.get_dict_key_columns(flat, 'n') == ['n_45', 'n_50', 'n_55']
+    # dictionaries are reconstructed only from the columns of the prefix (missing keys are left out)
+    assert pipeline.get_dict_column(flat, 'n') == list(paths['noises'])
+    assert pipeline.get_dict_column(flat, 'n_diff') == list(paths['noises_diff'])
+
+def test_od_quiet_path_stats():
+    paths = pd.DataFrame([
+        { 'od_id': 1, 'path_id': 'short_p', 'length': 1000, 'len_diff': 0, 'nei_diff_r': 0 },
+        { 'od_id': 1, 'path_id': 'q_1', 'length': 1050, 'len_diff': 50, 'nei_diff_r': np.nan },
+        { 'od_id': 1, 'path_id': 'q_2', 'length': 1250, 'len_diff': 250, 'nei_diff_r': -30 },
+        { 'od_id': 2, 'path_id': 'short_p', 'length': 800, 'len_diff': 0, 'nei_diff_r': 0 }
+        ])
+    for col in ['mdB', 'nei', 'nei_norm', 'util', '60dBl', '65dBl', '60dBr', '65dBr', 'len_diff_r', 'nei_diff']:
+        paths[col] = 1.0
+    od_stats = pstats.get_od_quiet_path_stats(paths, max_len_diffs=[100, 300])
+    assert list(od_stats['count_qp100']) == [1, 0] and list(od_stats['count_qp300']) == [2, 0]
+    assert list(od_stats['len_diff_qp300']) == [250, -9999]
+    # NaN values of best quiet paths are not mapped to -9999 (only ODs without quiet path are)
+    assert np.isnan(od_stats['nei_diff_r_qp100'][0]) and od_stats['nei_diff_r_qp100'][1] == -9999
+
+def test_pipeline_requeue(tmpdir):
+    # failed work ids of a chunk are processed again in the next run (the other work ids of the chunk are not)
+    dirname, processed, failing = str(tmpdir.join('parts')), [], set([3])
+    def process_chunk(work_ids):
+        processed.extend(work_ids)
+        return pd.DataFrame({ 'id': [work_id for work_id in work_ids if work_id not in failing] }), [work_id for work_id in work_ids if work_id in failing]
+    manifest = pipeline.run_pipeline(dirname, [1, 2, 3, 4], process_chunk, chunk_size=2, logging=False)
+    assert [chunk['status'] for chunk in manifest['chunks']] == ['done', 'partial']
+    assert pipeline.get_failed_work_ids(manifest) == [3]
+    failing.clear()
+    manifest = pipeline.run_pipeline(dirname, [1, 2, 3, 4], process_chunk, chunk_size=2, logging=False)
+    assert processed == [1, 2, 3, 4, 3] and pipeline.get_failed_work_ids(manifest) == []
+    assert sorted(pipeline.read_partitions(dirname)['id']) == [1, 2, 3, 4]
+
+def test_pipeline_failed_chunk(tmpdir):
+    # a chunk that raises an error is marked failed without stopping the other chunks and processed again in the next run
+    dirname = str(tmpdir.join('parts'))
+    def process_chunk(work_ids):
+        if (5 in work_ids):
+            raise ValueError('failed')
+        return pd.DataFrame({ 'id': work_ids }), []
+    with ThreadPool(2) as pool:
+        manifest = pipeline.run_pipeline(dirname, list(range(8)), process_chunk, chunk_size=2, pool=pool, max_pending=2, logging=False)
+    assert [chunk['status'] for chunk in manifest['chunks']] == ['done', 'done', 'failed', 'done']
+    assert pipeline.get_failed_work_ids(manifest) == [4, 5]
+    manifest = pipeline.run_pipeline(dirname, list(range(8)), lambda work_ids: (pd.DataFrame({ 'id': work_ids }), []), logging=False)
+    assert pipeline.get_failed_work_ids(manifest) == [] and sorted(pipeline.read_partitions(dirname)['id']) == list(range(8))
+
+def test_perc_classes():
+    # values are classified by the highest percentile value they exceed (values equal to it are not higher)
+    perc_classes = pstats.get_perc_classes([1, 5, 6, 10, 12], [5, 10, 10])
+    assert list(perc_classes) == [0, 0, 1, 1, 3]
+    assert list(pstats.get_perc_class_names(np.minimum(perc_classes, [3, 3, 0, 2, 1]), ['p75', 'p80', 'p85'])) == ['p0', 'p0', 'p0', 'p75', 'p75']
+
+def test_edge_flows():
+    # utilizations of paths are added to their edges (overlay edges with index >= edge count are skipped)
+    chunk_utils = flows.add_path_utils(flows.get_edge_utils_array(5), [[0, 1, 2], [5, 2, 3, 6], [2]], [0.5, 2, 1])
+    assert list(chunk_utils) == [0.5, 0.5, 3.5, 2.0, 0.0]
+    # partial utilizations (e.g. of worker chunks) are merged to the utilizations of all edges
+    edge_utils = flows.get_edge_utils_array(5)
+    for chunk in [chunk_utils, flows.add_path_utils(flows.get_edge_utils_array(5), [[4, 0]], [1])]:
+        flows.add_sparse_edge_utils(edge_utils, flows.get_sparse_edge_utils(chunk))
+    assert (list(flows.get_sparse_edge_utils(chunk_utils)[0]), list(edge_utils)) == ([0, 1, 2, 3], [1.5, 0.5, 3.5, 2.0, 1.0])
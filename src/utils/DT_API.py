@@ -1,11 +1,18 @@
 import requests
 import json
+import time
+import random
+import re
 import polyline
+from threading import Lock, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import pandas as pd
 import geopandas as gpd
 from fiona.crs import from_epsg
 from shapely.geometry import Point, LineString
 import utils.geometry as geom_utils
+import utils.DT_cache as DT_cache
 
 def build_plan_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime):
     '''
@@ -27,71 +34,188 @@ def build_plan_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins
     )
     '''
 
-def build_full_route_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime):
-    '''
-    Function for combining query string for full route plan using Digitransit Routing API. 
-    Returns
-    -------
-    <string>
-        Digitransit Routing API compatible GraphQL query for querying full route plan.
-    '''
-    return f'''
-    {{
-    {build_plan_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime)}
-        {{
-            itineraries {{
+def get_plan_fields():
+    # fields of itineraries to query for a route plan
+    return '''
+        {
+            itineraries {
                 duration
-                legs {{
+                legs {
                     mode
                     duration
                     distance
-                    legGeometry {{
+                    legGeometry {
                         length
                         points
-                    }}
-                    to {{
-                        stop {{
+                    }
+                    to {
+                        stop {
                             gtfsId
                             desc
                             lat
                             lon
-                            parentStation {{
+                            parentStation {
                                 gtfsId
                                 name
                                 lat
                                 lon
-                            }}
-                            cluster {{
+                            }
+                            cluster {
                                 gtfsId
                                 name
                                 lat
                                 lon
-                            }}
-                        }}
-                    }}
-                }}
-            }}
-        }}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    '''
+
+def build_full_route_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime):
+    '''
+    Function for combining query string for full route plan using Digitransit Routing API. 
+    Returns
+    -------
+    <string>
+        Digitransit Routing API compatible GraphQL query for querying full route plan.
+    '''
+    return f'''
+    {{
+    {build_plan_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime)}
+    {get_plan_fields()}
     }}
     '''
 
-def run_query(query):
+def build_batch_route_query(od_latLons, walkSpeed, max_walk_distance, itins_count, datetime):
+    '''
+    Function for combining route plans of many OD pairs to one query (plans are aliased as p0, p1, ... in the order of od_latLons).
+    Returns
+    -------
+    <string>
+        Digitransit Routing API compatible GraphQL query for querying full route plans.
+    '''
+    plans = [f'p{idx}: {build_plan_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime)} {get_plan_fields()}' for idx, (latlon_from, latlon_to) in enumerate(od_latLons)]
+    return '{\n'+ '\n'.join(plans) +'\n}'
+
+def split_batch_route_query(query):
+    '''
+    Function for splitting a query of build_batch_route_query to full route plan queries of single OD pairs (in the format
+    of build_full_route_query, i.e. with the same cache key).
+    Returns
+    -------
+    <dictionary>
+        Full route plan queries by aliases (p0, p1, ...) or None if the query is not a batch query.
+    '''
+    plans = re.split(r'\n(?=p\d+: )', query.strip()[1:-1].strip('\n'))
+    if (not re.match(r'p\d+: ', plans[0])):
+        return None
+    return { plan.split(':', 1)[0]: '{\n'+ plan.split(':', 1)[1] +'\n}' for plan in plans }
+
+DT_API_endpoint = 'https://api.digitransit.fi/routing/v1/routers/hsl/index/graphql'
+# responses that are worth retrying (rate limited or temporarily unavailable)
+retry_status_codes = [429, 500, 502, 503, 504]
+
+def get_client(max_concurrency=4, max_rate=10, max_retries=4, backoff=0.5, batch_size=10, timeout=60, endpoint=DT_API_endpoint, cache=None, replay=False):
     '''
-    Function for running Digitransit Routing API query in the API. 
+    Function for creating a Digitransit API client: a session with a connection pool, a cap for concurrent requests,
+    a rate limit (requests per second) and settings for retrying failed requests with exponential backoff. The client
+    can be shared by threads (e.g. when routing many origins concurrently). If a query cache (see DT_cache.get_query_cache)
+    is given, only cache misses are queried from the API (or none in replay mode).
+    Returns
+    -------
+    <dictionary>
+        Session, limits and retry settings of the client.
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return {
+        'session': session,
+        'endpoint': endpoint,
+        'max_concurrency': max_concurrency,
+        'semaphore': BoundedSemaphore(max_concurrency),
+        'min_interval': 1 / max_rate if max_rate else 0,
+        'rate_lock': Lock(),
+        'next_request_time': 0.0,
+        'max_retries': max_retries,
+        'backoff': backoff,
+        'batch_size': batch_size,
+        'timeout': timeout,
+        'cache': cache,
+        'replay': replay
+        }
+
+default_client = {}
+default_client_lock = Lock()
+
+def get_default_client():
+    # shared client (and connection pool) for queries run without a client
+    with default_client_lock:
+        if ('client' not in default_client):
+            default_client['client'] = get_client()
+        return default_client['client']
+
+def wait_for_rate_limit(client):
+    # reserve the next free request slot and wait for it
+    with client['rate_lock']:
+        now = time.time()
+        wait = client['next_request_time'] - now
+        client['next_request_time'] = max(now, client['next_request_time']) + client['min_interval']
+    if (wait > 0):
+        time.sleep(wait)
+
+def get_retry_delay(client, attempt, retry_after=None):
+    # exponential backoff with jitter (Retry-After header of the response is respected if longer)
+    delay = client['backoff'] * 2**attempt + random.uniform(0, client['backoff'])
+    if (retry_after is not None and retry_after.isdigit()):
+        delay = max(delay, int(retry_after))
+    return delay
+
+def run_query(query, client=None, use_cache=True):
+    '''
+    Function for running Digitransit Routing API query in the API (or getting the response from the cache of the client).
+    Requests that fail due to connection errors, rate limiting or temporary server errors are retried with backoff.
     Returns
     -------
     <dictionary>
         Results of the query as a dictionary.
     '''
-    DT_API_endpoint = 'https://api.digitransit.fi/routing/v1/routers/hsl/index/graphql' 
-    headers = {'Content-Type': 'application/json'}
-    request = requests.post(DT_API_endpoint, json={'query': query}, headers=headers)
-    if request.status_code == 200:
-        return request.json()
-    else:
-        raise Exception('Query failed to run by returning code of {}. {}'.format(request.status_code, query))
+    client = client if client is not None else get_default_client()
+    cache = client['cache'] if use_cache else None
+    if (cache is not None):
+        response = DT_cache.get_cached_response(cache, query)
+        if (response is not None):
+            return response
+    if (client['replay'] == True):
+        raise Exception('Query not found in DT cache (replay mode). {}'.format(query))
+    for attempt in range(client['max_retries'] + 1):
+        wait_for_rate_limit(client)
+        retry_after = None
+        try:
+            with client['semaphore']:
+                request = client['session'].post(client['endpoint'], json={'query': query}, timeout=client['timeout'])
+        except requests.exceptions.RequestException as e:
+            error = Exception('Query failed to run by error: {}'.format(e))
+        else:
+            if request.status_code == 200:
+                response = request.json()
+                # responses with errors are not cached as the errors may be temporary
+                if (cache is not None and response.get('data') is not None and 'errors' not in response):
+                    DT_cache.set_cached_response(cache, query, response)
+                return response
+            error = Exception('Query failed to run by returning code of {}. {}'.format(request.status_code, query))
+            if (request.status_code not in retry_status_codes):
+                raise error
+            retry_after = request.headers.get('Retry-After')
+        if (attempt < client['max_retries']):
+            time.sleep(get_retry_delay(client, attempt, retry_after=retry_after))
+    raise error
 
-def get_route_itineraries(latlon_from, latlon_to, walkSpeed, datetime, itins_count=3, max_walk_distance=6000):
+def get_route_itineraries(latlon_from, latlon_to, walkSpeed, datetime, itins_count=3, max_walk_distance=6000, client=None):
     '''
     Function for building and running routing query in Digitransit API.
     Returns
@@ -101,10 +225,56 @@ def get_route_itineraries(latlon_from, latlon_to, walkSpeed, datetime, itins_cou
     '''
     query = build_full_route_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime)
     # print(query)
-    response = run_query(query)
+    response = run_query(query, client=client)
     itineraries = response['data']['plan']['itineraries']
     return itineraries
 
+def get_route_itineraries_for_ods(od_latLons, walkSpeed, datetime, itins_count=3, max_walk_distance=6000, client=None):
+    '''
+    Function for routing many OD pairs in Digitransit API. OD pairs are queried in batches (batch_size plans per query)
+    and the batches are run concurrently (at most max_concurrency requests of the client at a time).
+    Returns
+    -------
+    <list of lists>
+        Itineraries of the OD pairs in the order of od_latLons ([(latlon_from, latlon_to), ...]), None if routing failed
+        (empty list only if no itineraries were found).
+    '''
+    client = client if client is not None else get_default_client()
+    od_itins = [None] * len(od_latLons)
+    # plans are cached by the queries of single OD pairs, so only cache misses are batched
+    if (client['cache'] is not None):
+        for od_idx, (latlon_from, latlon_to) in enumerate(od_latLons):
+            response = DT_cache.get_cached_response(client['cache'], build_full_route_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime))
+            if (response is not None):
+                od_itins[od_idx] = response['data']['plan']['itineraries']
+    miss_idxs = [od_idx for od_idx, itins in enumerate(od_itins) if itins is None]
+    if (client['replay'] == True):
+        # cache misses are left as None (failed), as they are not known to have no itineraries
+        return od_itins
+    batches = [miss_idxs[idx:idx + client['batch_size']] for idx in range(0, len(miss_idxs), client['batch_size'])]
+    def get_batch_itineraries(batch):
+        query = build_batch_route_query([od_latLons[od_idx] for od_idx in batch], walkSpeed, max_walk_distance, itins_count, datetime)
+        try:
+            response = run_query(query, client=client, use_cache=False)
+        except Exception as e:
+            print('Error in DT routing request:', e)
+            return [None for od_idx in batch]
+        # plans that failed have no data (errors are listed separately in the response)
+        data = response.get('data') or {}
+        plans = [data.get('p'+ str(idx)) for idx in range(len(batch))]
+        if (client['cache'] is not None):
+            for od_idx, plan in zip(batch, plans):
+                if (plan is not None):
+                    latlon_from, latlon_to = od_latLons[od_idx]
+                    DT_cache.set_cached_response(client['cache'], build_full_route_query(latlon_from, latlon_to, walkSpeed, max_walk_distance, itins_count, datetime), { 'data': { 'plan': plan } })
+        return [plan['itineraries'] if plan is not None else None for plan in plans]
+    with ThreadPoolExecutor(max_workers=client['max_concurrency']) as executor:
+        batch_itins = list(executor.map(get_batch_itineraries, batches))
+    for batch, itins_list in zip(batches, batch_itins):
+        for od_idx, itins in zip(batch, itins_list):
+            od_itins[od_idx] = itins
+    return od_itins
+
 def reproject_dict_geoms(dictionary):
     dict_c = dict(dictionary)
     for key in dictionary:
@@ -0,0 +1,50 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+
+def get_query_key(query):
+    # content address of a query: whitespace is normalized so that queries differing only in formatting share a key
+    return hashlib.sha256(' '.join(query.split()).encode('utf-8')).hexdigest()
+
+def get_query_cache(filepath='outputs/DT_cache/dt_queries.sqlite'):
+    '''
+    Function for opening (or creating) a persistent SQLite cache of Digitransit API queries & responses. Responses are
+    stored by the hash of the (normalized) query. The cache can be shared by threads.
+    Returns
+    -------
+    <dictionary>
+        SQLite connection, lock and hit/miss counters of the cache.
+    '''
+    if (os.path.dirname(filepath) != ''):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    conn = sqlite3.connect(filepath, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, query TEXT, response TEXT, created REAL)')
+    conn.commit()
+    return { 'conn': conn, 'lock': Lock(), 'filepath': filepath, 'hits': 0, 'misses': 0 }
+
+def get_cached_response(cache, query):
+    with cache['lock']:
+        row = cache['conn'].execute('SELECT response FROM queries WHERE key = ?', (get_query_key(query),)).fetchone()
+        if (row is None):
+            cache['misses'] += 1
+            return None
+        cache['hits'] += 1
+        return json.loads(row[0])
+
+def set_cached_response(cache, query, response):
+    with cache['lock']:
+        cache['conn'].execute('INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?)', (get_query_key(query), query, json.dumps(response), time.time()))
+        cache['conn'].commit()
+
+def get_cache_stats(cache):
+    with cache['lock']:
+        count = cache['conn'].execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+        return { 'queries': count, 'hits': cache['hits'], 'misses': cache['misses'], 'filepath': cache['filepath'] }
+
+def close_cache(cache):
+    with cache['lock']:
+        cache['conn'].close()
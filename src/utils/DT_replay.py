@@ -0,0 +1,72 @@
+import json
+from threading import Thread
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import utils.DT_API as DT_routing
+import utils.DT_cache as DT_cache
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def get_replay_response(cache, query, fallback_client=None):
+    '''
+    Function for answering a Digitransit API query (full route plan or a batch of them) from the query cache. Plans missing
+    from the cache are queried with fallback_client (and cached) or returned as null (with an error) if there is none.
+    Returns
+    -------
+    <tuple>
+        HTTP status code and the response as a dictionary.
+    '''
+    batch_queries = DT_routing.split_batch_route_query(query)
+    queries = batch_queries if batch_queries is not None else { 'plan': query }
+    data = {}
+    errors = []
+    for alias, plan_query in queries.items():
+        response = DT_cache.get_cached_response(cache, plan_query)
+        if (response is None and fallback_client is not None):
+            try:
+                response = DT_routing.run_query(plan_query, client=fallback_client)
+            except Exception as e:
+                errors.append({ 'message': str(e), 'path': [alias] })
+        elif (response is None):
+            errors.append({ 'message': 'Query not found in DT cache', 'path': [alias] })
+        data[alias] = response['data']['plan'] if response is not None else None
+    if (batch_queries is None and data['plan'] is None):
+        return 404, { 'data': None, 'errors': errors }
+    return 200, { 'data': data, 'errors': errors } if len(errors) > 0 else { 'data': data }
+
+def get_replay_server(cache, host='127.0.0.1', port=8088, fallback_client=None):
+    '''
+    Function for creating a local stand-in for the Digitransit GraphQL API that serves responses from the query cache.
+    Clients are pointed to it with DT_API.get_client(endpoint='http://<host>:<port>/graphql'). With fallback_client
+    (a client with the same cache), cache misses are queried from Digitransit API, otherwise the server works offline.
+    Returns
+    -------
+    <ThreadingHTTPServer>
+        Server (not yet started, see serve_in_thread).
+    '''
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                status, response = get_replay_response(cache, body['query'], fallback_client=fallback_client)
+            except (ValueError, KeyError, TypeError):
+                status, response = 400, { 'errors': [{ 'message': 'Invalid request' }] }
+            content = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return ThreadingHTTPServer((host, port), ReplayHandler)
+
+def serve_in_thread(server):
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
@@ -57,19 +57,24 @@ def get_workplaces_distr_join(workplaces, districts):
 
     return workplaces_distr_join
 
-def get_axyinds_to_reprocess(grid, reprocessed):
-    stops_files = 'outputs/YKR_commutes_output/home_stops'
-    axyfiles = get_xyind_filenames(path=stops_files)
+def get_origin_latLons_from_csv_files(stops_files='outputs/YKR_commutes_output/home_stops'):
+    # DT origin latLons by axyind from home stops csv files (latLons are stringified dicts)
+    origin_latLons = {}
+    for axyfile in get_xyind_filenames(path=stops_files):
+        home_stops = pd.read_csv(stops_files+'/'+axyfile)
+        origin_latLons[get_xyind_from_filename(axyfile)] = [ast.literal_eval(key) for key in home_stops['DT_origin_latLon'].unique()]
+    return origin_latLons
+
+def get_axyinds_to_reprocess(grid, reprocessed, home_stops=None):
+    # home stops are read from the csv files if not given as DataFrame (e.g. from pipeline partitions with struct latLons)
+    if (home_stops is None):
+        origin_latLons = get_origin_latLons_from_csv_files()
+    else:
+        origin_latLons = { axyind: list({ (latLon['lat'], latLon['lon']): latLon for latLon in latLons }.values()) for axyind, latLons in home_stops.groupby('from_axyind')['DT_origin_latLon'] }
     axyinds_to_reprocess = []
-    for axyfile in axyfiles:
-        # if idx > 5:
-        #     continue
-        axyind = get_xyind_from_filename(axyfile)
+    for axyind, latLons in origin_latLons.items():
         grid_centr = list(grid.loc[grid['xyind'] == axyind]['grid_centr'])[0]
-        home_stops = pd.read_csv(stops_files+'/'+axyfile)
-        latLons = home_stops['DT_origin_latLon'].unique()
-        for key in latLons:
-            latLon = ast.literal_eval(key)
+        for latLon in latLons:
             latLon_point = geom_utils.get_point_from_lat_lon(latLon)
             point = geom_utils.project_to_etrs(latLon_point, epsg=3067)
             origin_grid_dist = point.distance(grid_centr)
@@ -222,7 +227,7 @@ def get_work_destinations_gdf(geom_home, districts, axyind=None, work_rows=None,
     home_work_stats[['axyind', 'total_dests_count', 'close_dests_count', 'distr_dests_count', 'total_works_count', 'dest_works_count', 'missing_works_count', 'outside_ratio', 'work_count_match']]
     return { 'destinations': destinations, 'home_work_stats': home_work_stats, 'total_dests_count': total_dests_count }
 
-def get_adjusted_routing_location(latLon, graph=None, edge_gdf=None, node_gdf=None):
+def get_adjusted_routing_location(latLon, snap_index=None):
     wgs_point = geom_utils.get_point_from_lat_lon(latLon)
     etrs_point = geom_utils.project_to_etrs(wgs_point)
     point_buffer = etrs_point.buffer(90)
@@ -230,8 +235,8 @@ def get_adjusted_routing_location(latLon, graph=None, edge_gdf=None, node_gdf=No
     new_point = Point(buffer_random_coords)
     point_xy = geom_utils.get_xy_from_geom(new_point)
     try:
-        node = rt.get_nearest_node(graph, point_xy, edge_gdf, node_gdf, logging=False)
-        node_geom = nw.get_node_geom(graph, node['node'])
+        node = rt.get_nearest_node(snap_index, point_xy, logging=False)
+        node_geom = Point(node['node_xy'])
         node_distance = round(node_geom.distance(etrs_point))
         node_geom_wgs = geom_utils.project_to_wgs(node_geom)
         node_latLon = geom_utils.get_lat_lon_from_geom(node_geom_wgs)
@@ -243,10 +248,10 @@ def get_adjusted_routing_location(latLon, graph=None, edge_gdf=None, node_gdf=No
     print('no adjusted origin/destination found')
     return latLon
 
-def get_valid_latLon_for_DT(latLon, distance=60, datetime=None, graph=None, edge_gdf=None, node_gdf=None):
+def get_valid_latLon_for_DT(latLon, distance=60, datetime=None, snap_index=None, dt_client=None):
     # try if initial latLon works
     try:
-        itins = DT_routing.get_route_itineraries(latLon, {'lat': 60.278320, 'lon': 24.853545}, '1.16666', datetime, itins_count=3, max_walk_distance=2500)
+        itins = DT_routing.get_route_itineraries(latLon, {'lat': 60.278320, 'lon': 24.853545}, '1.16666', datetime, itins_count=3, max_walk_distance=2500, client=dt_client)
         if (len(itins) > 0):
             print('initial latLon works wiht DT')
             return latLon
@@ -267,16 +272,15 @@ def get_valid_latLon_for_DT(latLon, distance=60, datetime=None, graph=None, edge
         point_xy = geom_utils.get_xy_from_geom(circle_point)
         try:
             # find nearest node in the network
-            node = rt.get_nearest_node(graph, point_xy, edge_gdf, node_gdf, logging=False)
-            node_geom = nw.get_node_geom(graph, node['node'])
+            node = rt.get_nearest_node(snap_index, point_xy, logging=False)
+            node_geom = Point(node['node_xy'])
             node_distance = round(node_geom.distance(etrs_point))
             node_geom_wgs = geom_utils.project_to_wgs(node_geom)
             node_latLon = geom_utils.get_lat_lon_from_geom(node_geom_wgs)
-            # try DT routing to node location
+            # try DT routing to node location (requests are rate limited by the DT client)
             if (node_distance < 90):
-                time.sleep(0.2)
                 try:
-                    itins = DT_routing.get_route_itineraries(node_latLon, {'lat': 60.278320, 'lon': 24.853545}, '1.16666', datetime, itins_count=3, max_walk_distance=2500)
+                    itins = DT_routing.get_route_itineraries(node_latLon, {'lat': 60.278320, 'lon': 24.853545}, '1.16666', datetime, itins_count=3, max_walk_distance=2500, client=dt_client)
                     if (len(itins) > 0):
                         print('found DT valid latLon at distance:', node_distance,'-', node_latLon)
                         return node_latLon
@@ -290,17 +294,18 @@ def get_valid_latLon_for_DT(latLon, distance=60, datetime=None, graph=None, edge
     print('no DT valid latLon found')
     return None
 
-def get_home_work_walks(axyind=None, work_rows=None, districts=None, datetime=None, walk_speed=None, subset=True, logging=True, graph=None, edge_gdf=None, node_gdf=None):
+def get_home_work_walks(axyind=None, work_rows=None, districts=None, datetime=None, walk_speed=None, subset=True, logging=True, snap_index=None, dt_client=None):
     stats_path='outputs/YKR_commutes_output/home_workplaces_stats/'
     geom_home = work_rows['geom_home'].iloc[0]
     home_latLon = work_rows['home_latLon'].iloc[0]
     # adjust origin if necessary to work with DT routing requests
-    valid_home_latLon = get_valid_latLon_for_DT(home_latLon, distance=45, datetime=datetime, graph=graph, edge_gdf=edge_gdf, node_gdf=node_gdf)
+    valid_home_latLon = get_valid_latLon_for_DT(home_latLon, distance=45, datetime=datetime, snap_index=snap_index, dt_client=dt_client)
     if (valid_home_latLon == None):
         return None
     destinations = get_work_destinations_gdf(geom_home, districts, axyind=axyind, work_rows=work_rows, logging=logging)
+    # origins without work destinations are not errors (None is returned only if routing fails)
     if (destinations == None):
-        return None
+        return 'no_destinations'
     work_destinations = destinations['destinations']
     home_work_stats = destinations['home_work_stats']
     # filter rows of work_destinations for testing
@@ -308,26 +313,26 @@ def get_home_work_walks(axyind=None, work_rows=None, districts=None, datetime=No
     # print('work_destinations', work_destinations)
     # filter out destination if it's the same as origin
     work_destinations = work_destinations[work_destinations.apply(lambda x: str(x['id_destination']) != str(axyind), axis=1)]
+    if (work_destinations.empty == True):
+        return 'no_destinations'
     total_origin_workers_flow = work_destinations['yht'].sum()
     if (logging == True):
         print('Routing to', len(work_destinations.index), 'destinations:')
-    # get routes to all workplaces of the route
+    # get routes to all workplaces of the route (batched & concurrent requests to Digitransit API)
+    dests_itins = DT_routing.get_route_itineraries_for_ods([(valid_home_latLon, to_latLon) for to_latLon in work_destinations['to_latLon']], walk_speed, datetime, itins_count=3, max_walk_distance=2500, client=dt_client)
     home_walks_all = []
-    for idx, destination in work_destinations.iterrows():
+    for (idx, destination), itins in zip(work_destinations.iterrows(), dests_itins):
         utils.print_progress(idx, destinations['total_dests_count'], percentages=False)
-        # execute routing request to Digitransit API
-        try:
-            itins = DT_routing.get_route_itineraries(valid_home_latLon, destination['to_latLon'], walk_speed, datetime, itins_count=3, max_walk_distance=2500)
-        except Exception:
-            print('Error in DT routing request between:', axyind, 'and', destination['id_destination'])
-            itins = []
+        # failed routing (request error or cache miss in replay) fails the origin, so that it is reported & reprocessed
+        if (itins is None):
+            print('DT routing failed between:', axyind, 'and', destination['id_destination'])
+            return None
         # if no itineraries got, try adjusting the origin & destination by snapping them to network
         if (len(itins) == 0):
             print('no itineraries got -> try adjusting destination')
-            adj_destination = get_valid_latLon_for_DT(destination['to_latLon'], datetime=datetime, graph=graph, edge_gdf=edge_gdf, node_gdf=node_gdf)
-            time.sleep(0.3)
+            adj_destination = get_valid_latLon_for_DT(destination['to_latLon'], datetime=datetime, snap_index=snap_index, dt_client=dt_client)
             try:
-                itins = DT_routing.get_route_itineraries(valid_home_latLon, adj_destination, walk_speed, datetime, itins_count=3, max_walk_distance=2500)
+                itins = DT_routing.get_route_itineraries(valid_home_latLon, adj_destination, walk_speed, datetime, itins_count=3, max_walk_distance=2500, client=dt_client)
                 print('found', len(itins), 'with adjusted origin & destination locations')
             except Exception:
                 print('error in DT routing with adjusted origin & destination')
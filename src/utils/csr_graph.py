@@ -0,0 +1,391 @@
+import numpy as np
+from heapq import heappush, heappop
+
+def get_csr_arrays(graph_arrays):
+    '''
+    Function for building the CSR adjacency arrays of the graph: for each node (index) the half edges starting from it
+    are at indptr[node]:indptr[node+1] in indices (to nodes), edge_ids (edge indexes) and half_edge_length.
+    The arrays can be saved to graph snapshot (see files.export_graph_snapshot) to be memory-mapped by all processes.
+    '''
+    node_count = len(graph_arrays['node_ids'])
+    edge_uv = np.asarray(graph_arrays['edge_uv'])
+    edge_count = len(edge_uv)
+    # every (undirected) edge can be traversed in both directions as two half edges
+    from_nodes = np.concatenate([edge_uv[:, 0], edge_uv[:, 1]])
+    to_nodes = np.concatenate([edge_uv[:, 1], edge_uv[:, 0]])
+    half_edge_ids = np.concatenate([np.arange(edge_count), np.arange(edge_count)])
+    order = np.argsort(from_nodes, kind='mergesort')
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(from_nodes, minlength=node_count), out=indptr[1:])
+    edge_ids = half_edge_ids[order].astype(np.int32)
+    return {
+        'csr_indptr': indptr,
+        'csr_indices': to_nodes[order].astype(np.int32),
+        'csr_edge_ids': edge_ids,
+        # lengths are also stored by half edges (in the order of the adjacency arrays) for fast slicing in routing
+        'csr_half_edge_length': np.asarray(graph_arrays['edge_length'], dtype=np.float64)[edge_ids],
+        'csr_geom_reversed': get_edge_geom_reversed(graph_arrays)
+        }
+
+def get_edge_geom_reversed(graph_arrays):
+    # orientation flags of edge geometries: True if the geometry starts from the v (instead of u) node of the edge
+    edge_uv = np.asarray(graph_arrays['edge_uv'])
+    node_xy = np.asarray(graph_arrays['node_xy'])
+    offsets = np.asarray(graph_arrays['geom_offsets'])
+    geom_coords = np.asarray(graph_arrays['geom_coords'])
+    u_xy = node_xy[edge_uv[:, 0]]
+    first_dists = ((geom_coords[offsets[:-1]] - u_xy)**2).sum(axis=1)
+    last_dists = ((geom_coords[offsets[1:] - 1] - u_xy)**2).sum(axis=1)
+    return first_dists > last_dists
+
+def get_csr_graph(graph_arrays):
+    '''
+    Function for building compact routing graph (CSR adjacency in numpy arrays) from graph snapshot arrays.
+    Nodes are referred by their indexes in the (sorted) node_ids array and edges by their indexes in the edge arrays.
+    If the snapshot contains the CSR arrays (see get_csr_arrays), they are used as such (e.g. memory-mapped).
+    Returns
+    -------
+    <dictionary>
+        CSR graph with adjacency, node & edge arrays and base noise costs of edges (one array per db_costs version).
+    '''
+    csr_arrays = graph_arrays if 'csr_indptr' in graph_arrays else get_csr_arrays(graph_arrays)
+    csr_graph = {
+        'node_count': len(graph_arrays['node_ids']),
+        'edge_count': len(graph_arrays['edge_uv']),
+        'dbs': graph_arrays['meta']['dbs'],
+        'node_ids': graph_arrays['node_ids'],
+        'node_xy': graph_arrays['node_xy'],
+        'indptr': csr_arrays['csr_indptr'],
+        'indices': csr_arrays['csr_indices'],
+        'edge_ids': csr_arrays['csr_edge_ids'],
+        'half_edge_length': csr_arrays['csr_half_edge_length'],
+        'edge_uv': graph_arrays['edge_uv'],
+        'edge_length': graph_arrays['edge_length'],
+        'geom_offsets': graph_arrays['geom_offsets'],
+        'geom_coords': graph_arrays['geom_coords'],
+        'geom_reversed': csr_arrays['csr_geom_reversed'] if 'csr_geom_reversed' in csr_arrays else get_edge_geom_reversed(graph_arrays),
+        'noise_costs': {},
+        'default_costs_version': None
+        }
+    if ('edge_noises' in graph_arrays):
+        csr_graph['edge_noises'] = graph_arrays['edge_noises']
+    return csr_graph
+
+def set_noise_costs(csr_graph, db_costs=None, version=None):
+    '''
+    Function for calculating base noise costs (noise cost with noise tolerance 1) of all edges for one set of db_costs
+    (see quiet_paths.get_db_costs). Noise tolerance specific costs (length + nt * noise cost) are calculated on the fly
+    in routing, so any noise tolerance can be used without setting new cost attributes.
+    '''
+    db_cost_array = np.array([db_costs.get(db, 0) for db in csr_graph['dbs']], dtype=np.float64)
+    edge_noise_costs = np.asarray(csr_graph['edge_noises']).dot(db_cost_array)
+    csr_graph['noise_costs'][version] = {
+        'db_costs': db_costs,
+        'edge_costs': edge_noise_costs,
+        'half_edge_costs': edge_noise_costs[csr_graph['edge_ids']]
+        }
+    if (csr_graph['default_costs_version'] is None):
+        csr_graph['default_costs_version'] = version
+
+def get_weight_nt(weight):
+    # noise tolerance of cost attribute name: 'length' -> 0, 'nc_<nt>' -> nt
+    if (weight == 'length'):
+        return 0
+    return float(weight[len('nc_'):])
+
+def get_noise_costs(csr_graph, costs_version=None):
+    if (costs_version is None):
+        costs_version = csr_graph['default_costs_version']
+    return csr_graph['noise_costs'][costs_version]
+
+def get_path_cost(csr_graph, path_edges, weight='length', overlay=None, costs_version=None):
+    nt = get_weight_nt(weight)
+    edge_noise_costs = get_noise_costs(csr_graph, costs_version)['edge_costs'] if nt > 0 else None
+    cost = 0.0
+    for edge_id in path_edges:
+        if (edge_id < csr_graph['edge_count']):
+            cost += float(csr_graph['edge_length'][edge_id]) + (nt * float(edge_noise_costs[edge_id]) if nt > 0 else 0)
+        else:
+            cost += get_overlay_edge_cost(csr_graph, edge_id, overlay, nt, costs_version)
+    return cost
+
+def get_node_index(csr_graph, node_id):
+    node_ids = csr_graph['node_ids']
+    idx = int(np.searchsorted(node_ids, node_id))
+    if (idx < len(node_ids) and node_ids[idx] == node_id):
+        return idx
+    return None
+
+def get_link_edge_overlay(csr_graph, nodes):
+    '''
+    Function for collecting the linking edges of new origin & destination nodes (see routing.get_nearest_node)
+    to an overlay of virtual nodes and edges that can be passed to the routing functions.
+    Returns
+    -------
+    <dictionary>
+        Virtual node indexes, node coordinates, edges and adjacency of the overlay.
+    '''
+    overlay = { 'node_idxs': {}, 'node_xy': {}, 'edges': [], 'edge_noise_costs': [], 'adjacency': {} }
+    for node_d in [node_d for node_d in nodes if node_d is not None and 'link_edges' in node_d]:
+        link_edges = node_d['link_edges']
+        new_node_idx = csr_graph['node_count'] + len(overlay['node_idxs'])
+        overlay['node_idxs'][link_edges['new_node']] = new_node_idx
+        overlay['node_xy'][new_node_idx] = link_edges['new_node_xy']
+        for end_node, link in [(link_edges['node_from'], link_edges['link1']), (link_edges['node_to'], link_edges['link2'])]:
+            end_node_idx = get_routing_node_index(csr_graph, end_node, overlay)
+            link_edge_id = csr_graph['edge_count'] + len(overlay['edges'])
+            overlay['edges'].append(link)
+            overlay['edge_noise_costs'].append({ version: get_link_noise_cost(link, costs['db_costs']) for version, costs in csr_graph['noise_costs'].items() })
+            overlay['adjacency'].setdefault(end_node_idx, []).append((new_node_idx, link_edge_id))
+            overlay['adjacency'].setdefault(new_node_idx, []).append((end_node_idx, link_edge_id))
+    return overlay
+
+def get_routing_node_index(csr_graph, node_id, overlay=None):
+    if (overlay is not None and node_id in overlay['node_idxs']):
+        return overlay['node_idxs'][node_id]
+    return get_node_index(csr_graph, node_id)
+
+def get_routing_node_id(csr_graph, node_idx, overlay=None):
+    if (node_idx < csr_graph['node_count']):
+        return int(csr_graph['node_ids'][node_idx])
+    for node_id, idx in overlay['node_idxs'].items():
+        if (idx == node_idx):
+            return node_id
+
+def get_routing_node_xy(csr_graph, node_idx, overlay=None):
+    if (node_idx < csr_graph['node_count']):
+        return tuple(csr_graph['node_xy'][node_idx])
+    return overlay['node_xy'][node_idx]
+
+def get_overlay_edge(csr_graph, edge_id, overlay):
+    return overlay['edges'][edge_id - csr_graph['edge_count']]
+
+def get_path_coords(csr_graph, node_idxs, edge_ids, overlay=None):
+    '''
+    Function for assembling the coordinates of a path from the coordinate buffer of the graph. Coordinate indexes of all
+    graph edges are gathered at once (in the direction of travel by the orientation flags of the edge geometries) and
+    coordinates of the linking edges of the overlay are inserted to their places.
+    Returns
+    -------
+    <numpy array>
+        Coordinates (n x 2) of the path.
+    '''
+    edge_ids = np.asarray(edge_ids, dtype=np.int64)
+    from_idxs = np.asarray(node_idxs[:len(edge_ids)], dtype=np.int64)
+    is_graph_edge = edge_ids < csr_graph['edge_count']
+    graph_edge_ids = edge_ids[is_graph_edge]
+    starts = csr_graph['geom_offsets'][graph_edge_ids]
+    ends = csr_graph['geom_offsets'][graph_edge_ids + 1]
+    counts = ends - starts
+    # edge is traversed against its geometry if the geometry starts from the node where the edge is left from
+    backward = (csr_graph['edge_uv'][graph_edge_ids, 0] == from_idxs[is_graph_edge]) == csr_graph['geom_reversed'][graph_edge_ids]
+    coord_ends = np.cumsum(counts)
+    steps = np.arange(coord_ends[-1] if len(coord_ends) > 0 else 0) - np.repeat(coord_ends - counts, counts)
+    coord_idxs = np.where(np.repeat(backward, counts), np.repeat(ends - 1, counts) - steps, np.repeat(starts, counts) + steps)
+    coords = np.asarray(csr_graph['geom_coords'])[coord_idxs]
+    if (is_graph_edge.all()):
+        return coords
+    # insert coordinates of linking edges (of origin & destination) between the coordinates of graph edges
+    coord_chunks = []
+    graph_edge_counts = np.cumsum(is_graph_edge)
+    prev_end = 0
+    for path_idx in np.nonzero(~is_graph_edge)[0].tolist():
+        coord_end = coord_ends[graph_edge_counts[path_idx] - 1] if graph_edge_counts[path_idx] > 0 else 0
+        coord_chunks.append(coords[prev_end:coord_end])
+        prev_end = coord_end
+        link_coords = np.asarray(get_overlay_edge(csr_graph, edge_ids[path_idx], overlay)['geometry'].coords)[:, :2]
+        from_xy = np.asarray(get_routing_node_xy(csr_graph, from_idxs[path_idx], overlay))
+        if (((link_coords[0] - from_xy)**2).sum() > ((link_coords[-1] - from_xy)**2).sum()):
+            link_coords = link_coords[::-1]
+        coord_chunks.append(link_coords)
+    coord_chunks.append(coords[prev_end:])
+    return np.vstack(coord_chunks)
+
+def get_path_edge_lengths(csr_graph, edge_ids, overlay=None):
+    # lengths of the edges of the path (in path order, linking edges included)
+    edge_ids = np.asarray(edge_ids, dtype=np.int64)
+    is_graph_edge = edge_ids < csr_graph['edge_count']
+    edge_lengths = np.zeros(len(edge_ids), dtype=np.float64)
+    edge_lengths[is_graph_edge] = np.asarray(csr_graph['edge_length'])[edge_ids[is_graph_edge]]
+    for idx in np.nonzero(~is_graph_edge)[0].tolist():
+        edge_lengths[idx] = get_overlay_edge(csr_graph, int(edge_ids[idx]), overlay)['length']
+    return edge_lengths
+
+def get_path_length(csr_graph, edge_ids, overlay=None):
+    return float(get_path_edge_lengths(csr_graph, edge_ids, overlay=overlay).sum())
+
+def get_path_noises(csr_graph, edge_ids, overlay=None):
+    # noise lengths of the path by dbs (summed rows of the edge noise matrix + noises of linking edges)
+    edge_ids = np.asarray(edge_ids, dtype=np.int64)
+    is_graph_edge = edge_ids < csr_graph['edge_count']
+    path_noises = np.asarray(csr_graph['edge_noises'])[edge_ids[is_graph_edge]].sum(axis=0)
+    db_idxs = { db: idx for idx, db in enumerate(csr_graph['dbs']) }
+    for edge_id in edge_ids[~is_graph_edge].tolist():
+        for db, db_len in get_overlay_edge(csr_graph, edge_id, overlay)['noises'].items():
+            path_noises[db_idxs[int(db)]] += db_len
+    return path_noises
+
+def get_link_noise_cost(link, db_costs):
+    return sum([db_len * db_costs.get(db, 0) for db, db_len in link['noises'].items()])
+
+def get_overlay_edge_cost(csr_graph, edge_id, overlay, nt, costs_version=None):
+    edge_idx = edge_id - csr_graph['edge_count']
+    if (nt == 0):
+        return overlay['edges'][edge_idx]['length']
+    if (costs_version is None):
+        costs_version = csr_graph['default_costs_version']
+    return overlay['edges'][edge_idx]['length'] + nt * overlay['edge_noise_costs'][edge_idx][costs_version]
+
+def get_least_cost_path_idxs(csr_graph, orig_idx, dest_idx, weight='length', overlay=None, costs_version=None):
+    '''
+    Function for finding the least cost path between two nodes (indexes) with Dijkstra's algorithm over the CSR arrays.
+    Edge costs are calculated on the fly as length + nt * noise cost, where nt is parsed from the weight (nc_<nt>).
+    Returns
+    -------
+    <tuple>
+        Node indexes and edge ids of the path and the total cost (or None if no path was found).
+    '''
+    return get_least_cost_path_idxs_to_many(csr_graph, orig_idx, [dest_idx], weight=weight, overlay=overlay, costs_version=costs_version)[0]
+
+def get_least_cost_path_idxs_to_many(csr_graph, orig_idx, dest_idxs, weight='length', overlay=None, costs_version=None):
+    '''
+    Function for finding the least cost paths from one node (index) to many nodes with one Dijkstra's search,
+    which is stopped when all destinations are settled.
+    Returns
+    -------
+    <list of tuples>
+        Node indexes, edge ids and the total cost of the paths (or None) in the order of dest_idxs.
+    '''
+    indptr = csr_graph['indptr']
+    indices = csr_graph['indices']
+    edge_ids = csr_graph['edge_ids']
+    half_edge_length = csr_graph['half_edge_length']
+    nt = get_weight_nt(weight)
+    half_edge_noise_costs = get_noise_costs(csr_graph, costs_version)['half_edge_costs'] if nt > 0 else None
+    node_count = csr_graph['node_count']
+    overlay_adjacency = overlay['adjacency'] if overlay is not None else {}
+    dests_left = set(dest_idxs)
+    dists = { orig_idx: 0.0 }
+    preds = { orig_idx: None }
+    settled = set()
+    heap = [(0.0, orig_idx)]
+    while heap and dests_left:
+        dist, node = heappop(heap)
+        if (node in settled):
+            continue
+        settled.add(node)
+        dests_left.discard(node)
+        if (not dests_left):
+            break
+        neighbors = []
+        if (node < node_count):
+            start = indptr[node]
+            end = indptr[node+1]
+            edge_weights = half_edge_length[start:end] + nt * half_edge_noise_costs[start:end] if nt > 0 else half_edge_length[start:end]
+            neighbors = list(zip(indices[start:end].tolist(), edge_ids[start:end].tolist(), edge_weights.tolist()))
+        if (node in overlay_adjacency):
+            neighbors += [(to_node, edge_id, get_overlay_edge_cost(csr_graph, edge_id, overlay, nt, costs_version)) for to_node, edge_id in overlay_adjacency[node]]
+        for to_node, edge_id, edge_weight in neighbors:
+            if (to_node in settled):
+                continue
+            to_dist = dist + edge_weight
+            if (to_node not in dists or to_dist < dists[to_node]):
+                dists[to_node] = to_dist
+                preds[to_node] = (node, edge_id)
+                heappush(heap, (to_dist, to_node))
+    return [get_path_from_preds(preds, dists, dest_idx) if dest_idx in settled else None for dest_idx in dest_idxs]
+
+def get_path_from_preds(preds, dists, dest_idx):
+    # collect path by backtracking from the destination
+    path_nodes = [dest_idx]
+    path_edges = []
+    while preds[path_nodes[-1]] is not None:
+        pred_node, edge_id = preds[path_nodes[-1]]
+        path_nodes.append(pred_node)
+        path_edges.append(edge_id)
+    return path_nodes[::-1], path_edges[::-1], dists[dest_idx]
+
+def get_shortest_path(csr_graph, orig_node, dest_node, weight='length', overlay=None, costs_version=None):
+    orig_idx = get_routing_node_index(csr_graph, orig_node, overlay)
+    dest_idx = get_routing_node_index(csr_graph, dest_node, overlay)
+    if (orig_idx is None or dest_idx is None or orig_idx == dest_idx):
+        return None
+    path = get_least_cost_path_idxs(csr_graph, orig_idx, dest_idx, weight=weight, overlay=overlay, costs_version=costs_version)
+    return get_path_dict(csr_graph, path, overlay)
+
+def get_path_dict(csr_graph, path, overlay=None):
+    if (path is None):
+        return None
+    path_nodes, path_edges, cost = path
+    return {
+        'nodes': [get_routing_node_id(csr_graph, node_idx, overlay) for node_idx in path_nodes],
+        'node_idxs': path_nodes,
+        'edge_ids': path_edges,
+        'cost': round(cost, 2)
+        }
+
+def get_least_cost_paths_for_nts(csr_graph, orig_node, dest_node, nts=[], overlay=None, costs_version=None):
+    '''
+    Function for finding the shortest path and the least cost (quiet) paths of all noise tolerances between two nodes.
+    As the noise costs (length + noise cost * nt) are linear in nt, a path that is the least cost path for two noise
+    tolerances is also the least cost path for all tolerances between them. Thus the tolerances are searched by bisection
+    and the searches are skipped for the tolerances between two tolerances that gave the same path.
+    Returns
+    -------
+    <list of dictionaries>
+        Paths (or None) in the order of [0 (length)] + nts.
+    '''
+    return get_least_cost_paths_for_nts_to_many(csr_graph, orig_node, [dest_node], nts=nts, overlay=overlay, costs_version=costs_version)[0]
+
+def get_least_cost_paths_for_nts_to_many(csr_graph, orig_node, dest_nodes, nts=[], overlay=None, costs_version=None):
+    '''
+    Function for finding the shortest paths and the least cost paths of all noise tolerances from one node to many nodes
+    (see get_least_cost_paths_for_nts). Every search is a one-to-many search to all destinations and the tolerances
+    between two searched tolerances are skipped when the paths to all destinations are the same at both ends.
+    Returns
+    -------
+    <list of lists of dictionaries>
+        Paths (or None) in the order of [0 (length)] + nts for all destinations (in the order of dest_nodes).
+    '''
+    orig_idx = get_routing_node_index(csr_graph, orig_node, overlay)
+    dest_idxs = [get_routing_node_index(csr_graph, dest_node, overlay) for dest_node in dest_nodes]
+    results = [[None] * (len(nts) + 1) for dest_node in dest_nodes]
+    # collect destinations that can be routed to (duplicate destinations are searched once)
+    routed_dest_idxs = list(set([dest_idx for dest_idx in dest_idxs if dest_idx is not None and dest_idx != orig_idx]))
+    if (orig_idx is None or not routed_dest_idxs):
+        return results
+    weights = ['length'] + ['nc_'+str(nt) for nt in nts]
+    # search the tolerances in ascending order of nt
+    nt_order = [0] + [idx + 1 for idx in sorted(range(len(nts)), key=lambda idx: nts[idx])]
+    # paths by order index and destination index
+    paths = {}
+    def get_paths(order_idx):
+        if (order_idx not in paths or any([dest_idx not in paths[order_idx] for dest_idx in routed_dest_idxs])):
+            search_dest_idxs = [dest_idx for dest_idx in routed_dest_idxs if dest_idx not in paths.get(order_idx, {})]
+            dest_paths = get_least_cost_path_idxs_to_many(csr_graph, orig_idx, search_dest_idxs, weight=weights[nt_order[order_idx]], overlay=overlay, costs_version=costs_version)
+            paths.setdefault(order_idx, {}).update(zip(search_dest_idxs, dest_paths))
+        return paths[order_idx]
+    # destinations that are not reachable from the origin with length are not reachable with any of the weights
+    routed_dest_idxs = [dest_idx for dest_idx in routed_dest_idxs if get_paths(0)[dest_idx] is not None]
+    if (not routed_dest_idxs):
+        return results
+    intervals = [(0, len(nt_order) - 1)]
+    while intervals:
+        lo, hi = intervals.pop()
+        lo_paths = get_paths(lo)
+        hi_paths = get_paths(hi)
+        same_dest_idxs = [dest_idx for dest_idx in routed_dest_idxs if lo_paths[dest_idx][1] == hi_paths[dest_idx][1]]
+        for dest_idx in same_dest_idxs:
+            path_nodes, path_edges, cost = lo_paths[dest_idx]
+            for order_idx in range(lo + 1, hi):
+                weight = weights[nt_order[order_idx]]
+                paths.setdefault(order_idx, {})[dest_idx] = (path_nodes, path_edges, get_path_cost(csr_graph, path_edges, weight=weight, overlay=overlay, costs_version=costs_version))
+        if (len(same_dest_idxs) < len(routed_dest_idxs) and hi - lo > 1):
+            mid = (lo + hi) // 2
+            intervals += [(lo, mid), (mid, hi)]
+    for result, dest_idx in zip(results, dest_idxs):
+        if (dest_idx not in routed_dest_idxs):
+            continue
+        for order_idx, weight_idx in enumerate(nt_order):
+            result[weight_idx] = get_path_dict(csr_graph, paths[order_idx][dest_idx], overlay)
+    return results
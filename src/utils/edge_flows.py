@@ -0,0 +1,35 @@
+import numpy as np
+
+def get_edge_utils_array(edge_count):
+    # utilizations (e.g. sums of path probabilities or counts) of all edges of the graph by edge index
+    return np.zeros(edge_count, dtype=np.float64)
+
+def add_path_utils(edge_utils, paths_edge_ids, path_utils):
+    '''
+    Function for adding utilizations of paths to the edges of the paths (edge_utils, by edge index). Edges of all paths
+    are accumulated at once with bincount (edges of a path used more than once get the utilization more than once).
+    Virtual edges of routing overlays (edge indexes >= edge count) are skipped.
+    Returns
+    -------
+    <numpy array>
+        Utilizations of edges (the edge_utils array, updated in place).
+    '''
+    if (len(paths_edge_ids) == 0):
+        return edge_utils
+    path_lens = [len(edge_ids) for edge_ids in paths_edge_ids]
+    edge_ids = np.concatenate([np.asarray(edge_ids, dtype=np.int64) for edge_ids in paths_edge_ids])
+    utils = np.repeat(np.asarray(path_utils, dtype=np.float64), path_lens)
+    graph_edges = edge_ids < len(edge_utils)
+    edge_utils += np.bincount(edge_ids[graph_edges], weights=utils[graph_edges], minlength=len(edge_utils))
+    return edge_utils
+
+def get_sparse_edge_utils(edge_utils):
+    # utilized edges only (edge indexes & utilizations), e.g. for passing partial results of a worker to the main process
+    edge_idxs = np.nonzero(edge_utils)[0]
+    return edge_idxs, edge_utils[edge_idxs]
+
+def add_sparse_edge_utils(edge_utils, sparse_edge_utils):
+    # merge partial utilizations (see get_sparse_edge_utils) to the utilizations of all edges (in place)
+    edge_idxs, utils = sparse_edge_utils
+    np.add.at(edge_utils, edge_idxs, utils)
+    return edge_utils
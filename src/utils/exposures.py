@@ -51,38 +51,13 @@ def get_exposure_times(d: 'dict of db: length', speed: 'float: m/s', minutes: bo
     return exp_t_d
 
 def get_th_exposures(noise_dict, ths):
-    th_count = len(ths)
-    th_lens = [0] * len(ths)
-    for th in noise_dict.keys():
-        th_len = noise_dict[th]
-        for idx in range(th_count):
-            if (th >= ths[idx]):
-                th_lens[idx] = th_lens[idx] + th_len
-    th_noise_dict = {}
-    for idx in range(th_count):
-        th_noise_dict[ths[idx]] = round(th_lens[idx],3)
-    return th_noise_dict
+    th_lens = get_th_exposure_matrix(get_noise_vector(noise_dict), ths)
+    return { th: round(th_len, 3) for th, th_len in zip(ths, th_lens.tolist()) }
 
 def get_noise_pcts(noise_dict, total_length):
-    noise_dists = {}
-    db_40_len = round(total_length - get_total_noises_len(noise_dict),1)
-    if db_40_len > 0:
-        noise_dists[40] = db_40_len
-    for noise in noise_dict.keys():
-        noise_dist = noise_dict[noise]
-        if noise == 45:
-            if 40 in noise_dists.keys(): noise_dists[40] += noise_dist
-            else: noise_dists[40] = noise_dist
-        elif noise >= 70:
-            if 70 in noise_dists.keys(): noise_dists[70] += noise_dist
-            else: noise_dists[70] = noise_dist
-        else:
-            noise_dists[noise] = noise_dist
-    noise_pcts = {}
-    for noise in noise_dists.keys():
-        noise_dist = noise_dists[noise]
-        noise_pcts[noise] = round(noise_dist*100/total_length, 1)
-    return noise_pcts
+    pct_dists = get_noise_pct_dists(get_noise_vector(noise_dict), total_length)
+    noise_pcts = np.round(pct_dists * 100 / total_length, 1)
+    return { db: pct for db, pct, dist in zip(get_noise_pct_dbs(), noise_pcts.tolist(), pct_dists.tolist()) if dist > 0 }
 
 def get_noise_attrs_to_split_lines(gdf, noise_polys):
     gdf['split_line_index'] = gdf.index
@@ -109,68 +84,167 @@ def aggregate_line_noises(split_line_noises, uniq_id):
         row_accumulator.append(row_d)
     return pd.DataFrame(row_accumulator)
 
+def get_line_noise_array(line_geoms, noise_polys, dbs=None):
+    '''
+    Function for extracting contaminated distances of many lines at once. All lines are joined to the intersecting
+    noise polygons in one bulk spatial join and the lengths of the line-polygon intersections are summed by db_lo.
+    Parts of a line within many polygons (e.g. along the shared boundary of adjacent noise zones) are counted only
+    for the polygon with the highest db_lo, so that the noise lengths of a line do not exceed its length.
+    Returns
+    -------
+    <numpy array>
+        Lengths (m) of the lines (rows) within the noise ranges of dbs (columns).
+    '''
+    dbs = get_noise_dbs() if dbs is None else dbs
+    lines = gpd.GeoDataFrame(geometry=list(line_geoms), crs=noise_polys.crs).reset_index(drop=True)
+    noise_array = np.zeros((len(lines.index), len(dbs)), dtype=np.float64)
+    line_polys = gpd.sjoin(lines, noise_polys[['geometry', 'db_lo']], how='inner', op='intersects')
+    if (line_polys.empty):
+        return noise_array
+    line_idxs = line_polys.index.values
+    # intersections of the line-polygon pairs (vectorized by geopandas as far as the geometry backend allows)
+    pair_lines = gpd.GeoSeries(lines.geometry.values[line_idxs])
+    pair_polys = gpd.GeoSeries(noise_polys.geometry.loc[line_polys['index_right'].values].values)
+    pair_lens = np.array(pair_lines.intersection(pair_polys).length.values, dtype=np.float64)
+    # lines joined to many polygons are intersected again in descending order by db_lo, leaving out the parts of
+    # the line that were already assigned to a polygon of higher db_lo
+    db_los = line_polys['db_lo'].values
+    multi_pairs = np.nonzero(np.bincount(line_idxs, minlength=len(lines.index))[line_idxs] > 1)[0]
+    line_rests = {}
+    for pair in multi_pairs[np.lexsort((-db_los[multi_pairs], line_idxs[multi_pairs]))]:
+        line_idx = line_idxs[pair]
+        line_rest = line_rests.get(line_idx, lines.geometry.iloc[line_idx])
+        pair_poly = pair_polys.iloc[pair]
+        pair_lens[pair] = line_rest.intersection(pair_poly).length
+        line_rests[line_idx] = line_rest.difference(pair_poly)
+    # sum intersection lengths to noise ranges of the lines
+    db_idxs = np.searchsorted(dbs, line_polys['db_lo'].values)
+    valid = (db_idxs < len(dbs)) & (np.array(dbs)[np.minimum(db_idxs, len(dbs)-1)] == db_los)
+    np.add.at(noise_array, (line_idxs[valid], db_idxs[valid]), pair_lens[valid])
+    return noise_array.round(3)
+
+def get_noise_dicts_from_array(noise_array, dbs=None):
+    dbs = get_noise_dbs() if dbs is None else dbs
+    return [{ db: db_len for db, db_len in zip(dbs, row) if db_len > 0 } for row in noise_array.tolist()]
+
+def get_line_noises_df(line_gdf, uniq_id, noise_polys):
+    # noises of all lines in the same format as aggregate_line_noises (a row with noises dict for each line)
+    noise_array = get_line_noise_array(line_gdf['geometry'], noise_polys)
+    return pd.DataFrame({ uniq_id: list(line_gdf[uniq_id]), 'noises': get_noise_dicts_from_array(noise_array) })
+
+def get_changed_noise_polygons(old_noise_polys, new_noise_polys):
+    # noise polygons that exist only in the old or only in the new noise data (i.e. removed, added or modified zones)
+    old_keys = list(zip(old_noise_polys['db_lo'], [geom.wkb for geom in old_noise_polys['geometry']]))
+    new_keys = list(zip(new_noise_polys['db_lo'], [geom.wkb for geom in new_noise_polys['geometry']]))
+    old_key_set = set(old_keys)
+    new_key_set = set(new_keys)
+    removed = [key not in new_key_set for key in old_keys]
+    added = [key not in old_key_set for key in new_keys]
+    changed_polys = pd.concat([old_noise_polys[removed], new_noise_polys[added]], ignore_index=True)
+    return gpd.GeoDataFrame(changed_polys, geometry='geometry', crs=new_noise_polys.crs)
+
 def add_noise_exposures_to_gdf(line_gdf, uniq_id, noise_polys):
-    # add noises to lines as list
-    line_gdf['split_lines'] = [geom_utils.get_split_lines_list(line_geom, noise_polys) for line_geom in line_gdf['geometry']]
-    # explode new rows from split lines column
-    split_lines = geom_utils.explode_lines_to_split_lines(line_gdf, uniq_id)
-    # join noises to split lines
-    split_line_noises = get_noise_attrs_to_split_lines(split_lines, noise_polys)
-    # aggregate noises back to segments
-    line_noises = aggregate_line_noises(split_line_noises, uniq_id)
-    line_gdf = line_gdf.drop(['split_lines'], axis=1)
+    line_noises = get_line_noises_df(line_gdf, uniq_id, noise_polys)
     return pd.merge(line_gdf, line_noises, how='inner', on=uniq_id)
 
 def aggregate_exposures(exp_list):
-    exps = {}
-    for exp_d_value in exp_list:
-        exp_d = ast.literal_eval(exp_d_value) if type(exp_d_value) == str else exp_d_value
-        for db in exp_d.keys():
-            if db in exps.keys():
-                exps[db] += exp_d[db]
-            else:
-                exps[db] = exp_d[db]
-    for db in exps.keys():
-        exps[db] = round(exps[db], 2)
-    return exps
+    exps = get_noise_matrix(exp_list).sum(axis=0)
+    return get_noise_dict_from_vector(exps, round_n=2)
+
+def get_noise_dbs():
+    # lower limits of the 5 dB noise ranges (40 = less than the lowest noise range of the noise data)
+    return [40, 45, 50, 55, 60, 65, 70, 75]
+
+def get_noise_vector(noises, dbs=None):
+    '''
+    Function for converting noises (dict of db: length, or its string representation) to a dense exposure vector
+    over the noise ranges of dbs (40-75 dB by default). Vectors are returned as such.
+    Returns
+    -------
+    <numpy array>
+        Lengths (m) of the noise ranges.
+    '''
+    if (isinstance(noises, np.ndarray)):
+        return noises.astype(np.float64)
+    dbs = get_noise_dbs() if dbs is None else dbs
+    noises = ast.literal_eval(noises) if type(noises) == str else noises
+    noises = { int(db): db_len for db, db_len in noises.items() }
+    return np.array([noises.get(db, 0) for db in dbs], dtype=np.float64)
+
+def get_noise_matrix(noises_list, dbs=None):
+    # exposure vectors of many edges or paths as a matrix (n x noise ranges)
+    dbs = get_noise_dbs() if dbs is None else dbs
+    vectors = [get_noise_vector(noises, dbs=dbs) for noises in noises_list]
+    return np.vstack(vectors) if len(vectors) > 0 else np.zeros((0, len(dbs)), dtype=np.float64)
+
+def get_noise_dict_from_vector(noise_vector, dbs=None, round_n=3):
+    # noises as dict of db: length (only non-zero noise ranges), e.g. for API responses
+    dbs = get_noise_dbs() if dbs is None else dbs
+    return { db: round(db_len, round_n) for db, db_len in zip(dbs, np.asarray(noise_vector).tolist()) if db_len > 0 }
+
+def get_th_exposure_matrix(noise_matrix, ths, dbs=None):
+    # lengths of noise levels higher than the thresholds (the last axis is noise ranges / thresholds)
+    dbs = get_noise_dbs() if dbs is None else dbs
+    th_mask = np.array(dbs)[:, None] >= np.array(ths)[None, :]
+    return np.asarray(noise_matrix, dtype=np.float64) @ th_mask
+
+def get_noise_pct_dbs():
+    # noise ranges of noise percentages: 40 = less than 50 dB and 70 = more than 70 dB
+    return [40, 50, 55, 60, 65, 70]
+
+def get_noise_pct_dists(noise_matrix, total_lengths, dbs=None):
+    # lengths of the noise ranges of noise percentages (lengths not covered by noise data are counted to the lowest range)
+    dbs = np.array(get_noise_dbs() if dbs is None else dbs)
+    noise_matrix = np.asarray(noise_matrix, dtype=np.float64)
+    db_40_lens = np.round(np.asarray(total_lengths, dtype=np.float64) - np.round(noise_matrix.sum(axis=-1), 3), 1)
+    return np.stack([
+        np.where(db_40_lens > 0, db_40_lens, 0) + noise_matrix[..., (dbs == 40) | (dbs == 45)].sum(axis=-1),
+        *[noise_matrix[..., dbs == db].sum(axis=-1) for db in [50, 55, 60, 65]],
+        noise_matrix[..., dbs >= 70].sum(axis=-1)
+        ], axis=-1)
+
+def get_noise_pct_matrix(noise_matrix, total_lengths, dbs=None):
+    '''
+    Function for calculating the percentages of the lengths of noise ranges (get_noise_pct_dbs) of total lengths
+    for an exposure vector or for a matrix of them (n x noise ranges).
+    Returns
+    -------
+    <numpy array>
+        Percentages of noise ranges (the last axis).
+    '''
+    pct_dists = get_noise_pct_dists(noise_matrix, total_lengths, dbs=dbs)
+    return np.round(pct_dists * 100 / np.asarray(total_lengths, dtype=np.float64)[..., None], 1)
+
+def get_mean_noise_levels(noise_matrix, lengths, dbs=None):
+    # mean dB of a 5 dB range is estimated to be min dB + 2.5 dB, lengths not covered by noise data are 40-45 dB (42.5 dB)
+    dbs = np.array(get_noise_dbs() if dbs is None else dbs, dtype=np.float64)
+    noise_matrix = np.asarray(noise_matrix, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    sum_db = noise_matrix @ (dbs + 2.5) + 42.5 * (lengths - np.round(noise_matrix.sum(axis=-1), 3))
+    return np.round(sum_db / lengths, 2)
+
+def get_noise_costs(noise_matrix, db_costs={}, nt=1, dbs=None, round_n=2):
+    # noise costs of exposure vector(s) (dot product with the dB costs of the noise ranges), unrounded if round_n is None
+    dbs = get_noise_dbs() if dbs is None else dbs
+    db_cost_vector = np.array([db_costs.get(db, 0) for db in dbs], dtype=np.float64)
+    noise_costs = (np.asarray(noise_matrix, dtype=np.float64) @ db_cost_vector) * nt
+    return np.round(noise_costs, round_n) if round_n is not None else noise_costs
 
 def get_noises_diff(s_noises, q_noises, full_db_range=True):
-    dbs = [40, 45, 50, 55, 60, 65, 70, 75]
-    diff_dict = {}
-    for db in dbs:
-        if (full_db_range == False):
-            if((db not in s_noises.keys()) and (db not in q_noises.keys())):
-                continue
-        s_noise = s_noises[db] if db in s_noises.keys() else 0
-        q_noise = q_noises[db] if db in q_noises.keys() else 0
-        noise_diff = q_noise - s_noise
-        diff_dict[db] = round(noise_diff, 2)
-    return diff_dict
+    dbs = get_noise_dbs()
+    diffs = np.round(get_noise_vector(q_noises) - get_noise_vector(s_noises), 2).tolist()
+    if (full_db_range == True):
+        return dict(zip(dbs, diffs))
+    return { db: diff for db, diff in zip(dbs, diffs) if (db in s_noises.keys() or db in q_noises.keys()) }
 
 def get_total_noises_len(noises):
-    totlen = 0
-    for key in noises.keys():
-        totlen += noises[key]
-    return round(totlen, 3)
+    return round(float(get_noise_vector(noises).sum()), 3)
 
 def get_mean_noise_level(noises: dict, length: float):
-    sum_db = 0
-    # estimate mean dB of 5 dB range to be min dB + 2.5 dB
-    for db in noises.keys():
-        sum_db += (int(db)+2.5) * noises[db]
-    # extrapolate noise level range 40-45dB (42.5dB) for all noises less than lowest noise range in the noise data 45-50dB
-    sum_noise_len = get_total_noises_len(noises)
-    db425len = length - sum_noise_len
-    sum_db += 42.5 * db425len
-    mean_db = sum_db/length
-    return round(mean_db, 2)
+    return float(get_mean_noise_levels(get_noise_vector(noises), length))
 
 def get_noise_cost(noises={}, db_costs={}, nt=1):
-    noise_cost = 0
-    for db in noises:
-        if (db in db_costs):
-            noise_cost += noises[db] * db_costs[db] * nt
-    return round(noise_cost, 2)
+    return float(get_noise_costs(get_noise_vector(noises), db_costs=db_costs, nt=nt))
 
 def compare_lens_noises_lens(edge_gdf):
     gdf = edge_gdf.copy()
@@ -1,17 +1,23 @@
 import os
 import ast
+import json
+import hashlib
+import time
+import numpy as np
 import geopandas as gpd
 import osmnx as ox
 import networkx as nx
 from shapely import wkt
 from shapely.geometry import box
 import utils.geometry as geom_utils
+import utils.networks as nw
+import utils.csr_graph as csr
 
 bboxes = gpd.read_file('data/extents_grids.gpkg', layer='bboxes')
 hel = gpd.read_file('data/extents_grids.gpkg', layer='hel')
 
-def get_noise_polygons():
-    noise_data = gpd.read_file('data/data.gpkg', layer='2017_alue_01_tieliikenne_L_Aeq_paiva')
+def get_noise_polygons(filepath='data/data.gpkg', layer='2017_alue_01_tieliikenne_L_Aeq_paiva'):
+    noise_data = gpd.read_file(filepath, layer=layer)
     noise_polys = geom_utils.explode_multipolygons_to_polygons(noise_data)
     return noise_polys
 
@@ -69,6 +75,92 @@ def get_network_full_noise(version=3):
     if (version == 3):
         return load_graphml('hel-v3_u_g_n2_f_s.graphml', folder='graphs', directed=False)
 
+def get_network_kumpula_noise_snapshot(version=3):
+    if (version == 3):
+        return load_graph_snapshot('kumpula-v3_u_g_n2_f_s_snapshot', folder='graphs')
+    return None
+
+def get_network_full_noise_snapshot(version=3):
+    if (version == 3):
+        return load_graph_snapshot('hel-v3_u_g_n2_f_s_snapshot', folder='graphs')
+    return None
+
+def export_graph_snapshot(graph, dirname, folder='graphs', noises=True):
+    # write nodes & edges of the graph as typed arrays (.npy) to a snapshot directory
+    graph_arrays = nw.get_graph_arrays(graph, noises=noises)
+    return export_graph_arrays_snapshot(graph_arrays, dirname, folder=folder)
+
+def export_graph_arrays_snapshot(graph_arrays, dirname, folder='graphs'):
+    path = os.path.join(folder, dirname)
+    if (not os.path.exists(path)):
+        os.makedirs(path)
+    graph_arrays = dict(graph_arrays)
+    # add CSR adjacency arrays so that routing processes can memory-map them instead of building them
+    graph_arrays.update(csr.get_csr_arrays(graph_arrays))
+    meta = dict(graph_arrays.pop('meta'))
+    meta.pop('noise_patch', None)
+    for name, array in graph_arrays.items():
+        np.save(os.path.join(path, name +'.npy'), array)
+    meta['arrays'] = list(graph_arrays.keys())
+    meta['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    write_snapshot_meta(path, meta)
+    return path
+
+def get_snapshot_version(graph_arrays):
+    # version of the graph snapshot changes when the snapshot is exported again or patched (e.g. for invalidating caches)
+    meta_str = json.dumps(graph_arrays['meta'], sort_keys=True)
+    return hashlib.md5(meta_str.encode('utf-8')).hexdigest()[:12]
+
+def write_snapshot_meta(path, meta):
+    # meta.json is replaced at once so that a snapshot is never read with a partially written meta
+    tmp_filepath = os.path.join(path, 'meta.json.tmp')
+    with open(tmp_filepath, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(tmp_filepath, os.path.join(path, 'meta.json'))
+
+def export_graph_snapshot_noise_patch(dirname, edge_ids, edge_noises, folder='graphs'):
+    '''
+    Function for writing updated noises of a subset of edges as a patch to an existing graph snapshot (the full
+    edge_noises array of the snapshot is left as is). A previous patch of the snapshot is merged to the new one.
+    Returns
+    -------
+    <dictionary>
+        Noise patch info as written to the meta of the snapshot.
+    '''
+    path = os.path.join(folder, dirname)
+    with open(os.path.join(path, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    edge_ids = np.asarray(edge_ids, dtype=np.int64)
+    edge_noises = np.asarray(edge_noises, dtype=np.float64).reshape(-1, len(meta['dbs']))
+    if ('noise_patch' in meta):
+        # rows of the previous patch are kept for edges that are not in the new patch
+        old_edge_ids = np.load(os.path.join(path, 'patch_edge_ids.npy'))
+        old_edge_noises = np.load(os.path.join(path, 'patch_edge_noises.npy'))
+        keep = ~np.isin(old_edge_ids, edge_ids)
+        edge_ids = np.concatenate([old_edge_ids[keep], edge_ids])
+        edge_noises = np.vstack([old_edge_noises[keep], edge_noises])
+    order = np.argsort(edge_ids)
+    np.save(os.path.join(path, 'patch_edge_ids.npy'), edge_ids[order])
+    np.save(os.path.join(path, 'patch_edge_noises.npy'), edge_noises[order])
+    meta['noise_patch'] = { 'edge_count': len(edge_ids), 'updated': time.strftime('%Y-%m-%dT%H:%M:%S') }
+    write_snapshot_meta(path, meta)
+    return meta['noise_patch']
+
+def load_graph_snapshot(dirname, folder='graphs', mmap=True, patch=True):
+    # read graph snapshot arrays from disk (memory-mapped by default, from the folder of export_graph_snapshot by default)
+    path = os.path.join(folder, dirname)
+    with open(os.path.join(path, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    graph_arrays = { 'meta': meta }
+    for name in meta['arrays']:
+        graph_arrays[name] = np.load(os.path.join(path, name +'.npy'), mmap_mode='r' if mmap else None)
+    if (patch == True and 'noise_patch' in meta and 'edge_noises' in graph_arrays):
+        # patched edge noises are held in memory (the other arrays stay memory-mapped)
+        edge_noises = np.array(graph_arrays['edge_noises'])
+        edge_noises[np.load(os.path.join(path, 'patch_edge_ids.npy'))] = np.load(os.path.join(path, 'patch_edge_noises.npy'))
+        graph_arrays['edge_noises'] = edge_noises
+    return graph_arrays
+
 def load_graphml(filename, folder=None, node_type=int, directed=None, noises=True):
     # read the graph from disk
     path = os.path.join(folder, filename)
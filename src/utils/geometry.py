@@ -1,10 +1,11 @@
 import pandas as pd
 import geopandas as gpd
+import numpy as np
 import pyproj
 import shapely
 from shapely.geometry import mapping, Point, LineString, MultiPolygon, MultiLineString, MultiPoint
 from shapely.ops import split, snap, transform
-from functools import partial
+from functools import lru_cache
 from fiona.crs import from_epsg
 
 def get_etrs_crs():
@@ -31,31 +32,56 @@ def get_coords_from_xy(xy):
 def get_point_from_xy(xy):
     return Point(get_coords_from_xy(xy))
 
+@lru_cache(maxsize=None)
+def get_transformer(epsg_from, epsg_to):
+    # transformers are created once per CRS pair (always x, y = lon, lat order as with the former pyproj.Proj(init=...))
+    return pyproj.Transformer.from_crs('epsg:'+ str(epsg_from), 'epsg:'+ str(epsg_to), always_xy=True)
+
+def project_xy_arrays(xs, ys, epsg_from=4326, epsg_to=3879):
+    '''
+    Function for reprojecting arrays of x and y coordinates in one call.
+    Returns
+    -------
+    <tuple>
+        Arrays of projected x and y coordinates.
+    '''
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    return get_transformer(epsg_from, epsg_to).transform(xs, ys)
+
+def project_geom(geom, epsg_from=4326, epsg_to=3879):
+    # all coordinates of the geometry (part) are projected at once
+    return transform(get_transformer(epsg_from, epsg_to).transform, geom)
+
+def project_points(points, epsg_from=4326, epsg_to=3879):
+    points = list(points)
+    if (len(points) == 0):
+        return []
+    xs, ys = project_xy_arrays([point.x for point in points], [point.y for point in points], epsg_from=epsg_from, epsg_to=epsg_to)
+    return [Point(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+
 def project_to_etrs(geom, epsg=3879):
-    to_epsg = 'epsg:'+ str(epsg)
-    project = partial(
-        pyproj.transform,
-        pyproj.Proj(init='epsg:4326'), # source coordinate system
-        pyproj.Proj(init=to_epsg)) # destination coordinate system
-    geom_proj = transform(project, geom)
-    return geom_proj
+    return project_geom(geom, epsg_from=4326, epsg_to=epsg)
 
 def project_to_wgs(geom, epsg=3879):
-    from_epsg = 'epsg:'+ str(epsg)
-    project = partial(
-        pyproj.transform,
-        pyproj.Proj(init=from_epsg), # source coordinate system
-        pyproj.Proj(init='epsg:4326')) # destination coordinate system
-    geom_proj = transform(project, geom)
-    return geom_proj
+    return project_geom(geom, epsg_from=epsg, epsg_to=4326)
 
 def get_xy_from_geom(geom):
     return { 'x': geom.x, 'y': geom.y }
 
 def get_xy_from_lat_lon(latLon):
-    point = get_point_from_lat_lon(latLon)
-    point_proj = project_to_etrs(point)
-    return get_xy_from_geom(point_proj)
+    return get_xys_from_lat_lons([latLon])[0]
+
+def get_xys_from_lat_lons(latLons):
+    # project WGS84 locations to ETRS-GK25 (x, y) in one call
+    if (len(latLons) == 0):
+        return []
+    xs, ys = project_xy_arrays([latLon['lon'] for latLon in latLons], [latLon['lat'] for latLon in latLons])
+    return [{ 'x': x, 'y': y } for x, y in zip(xs.tolist(), ys.tolist())]
+
+def get_lat_lons_from_points(points, epsg=3879):
+    # WGS84 locations of projected points (rounded as in get_lat_lon_from_geom)
+    return [get_lat_lon_from_geom(point) for point in project_points(points, epsg_from=epsg, epsg_to=4326)]
 
 def clip_polygons_with_polygon(clippee, clipper):
     poly = clipper
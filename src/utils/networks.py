@@ -2,11 +2,13 @@ import pandas as pd
 import geopandas as gpd
 import osmnx as ox
 import networkx as nx
+import numpy as np
 import json
 import ast
 from fiona.crs import from_epsg
 from shapely.geometry import Point, LineString, MultiLineString, box
 import utils.exposures as exps
+import utils.csr_graph as csr
 import utils.geometry as geom_utils
 import utils.utils as utils
 
@@ -106,23 +108,6 @@ def get_edge_geom_from_node_pair(graph, node_1, node_2):
     edge_line = LineString([node_1_geom, node_2_geom])
     return edge_line
 
-def get_new_node_id(graph):
-    graph_nodes = graph.nodes
-    return  max(graph_nodes)+1
-
-def get_new_node_attrs(graph, point):
-    new_node_id = get_new_node_id(graph)
-    wgs_point = geom_utils.project_to_wgs(point)
-    geom_attrs = {**geom_utils.get_xy_from_geom(point), **geom_utils.get_lat_lon_from_geom(wgs_point)}
-    return { 'id': new_node_id, **geom_attrs }
-
-def add_new_node_to_graph(graph, point, logging=True):
-    attrs = get_new_node_attrs(graph, point)
-    if (logging == True):
-        print('add new node:', attrs['id'])
-    graph.add_node(attrs['id'], ref='', x=attrs['x'], y=attrs['y'], lon=attrs['lon'], lat=attrs['lat'])
-    return attrs['id']
-
 def interpolate_link_noises(link_geom, edge_geom, edge_noises):
     link_noises = {}
     link_len_ratio = link_geom.length / edge_geom.length
@@ -143,14 +128,16 @@ def get_edge_noise_cost_attrs(nts, db_costs, edge_d, link_geom):
         print('link length unmatch:', noises_sum_len, link_geom.length)
     return cost_attrs
 
-def add_linking_edges_for_new_node(graph, new_node, split_point, edge, nts, db_costs, logging=False):
+def get_linking_edges_for_new_node(new_node, split_point, edge, nts, db_costs, node_points, logging=False):
+    # linking edges are returned as dicts (overlay) and not added to the (shared) graph
+    # node_points: points of the end nodes of the edge (the edge may be a linking edge of another new node)
     edge_geom = edge['geometry']
     # split edge at new node to two line geometries
     split_lines = geom_utils.split_line_at_point(edge_geom, split_point)
     node_from = edge['uvkey'][0]
     node_to = edge['uvkey'][1]
-    node_from_p = get_node_geom(graph, node_from)
-    node_to_p = get_node_geom(graph, node_to)
+    node_from_p = node_points[node_from]
+    node_to_p = node_points[node_to]
     edge_first_p = Point(edge_geom.coords[0])
     if(edge_first_p.distance(node_from_p) < edge_first_p.distance(node_to_p)):
         link1 = split_lines[0]
@@ -159,40 +146,16 @@ def add_linking_edges_for_new_node(graph, new_node, split_point, edge, nts, db_c
         link1 = split_lines[1]
         link2 = split_lines[0]
     if (logging == True):
-        print('add linking edges between:', node_from, new_node, node_to)
+        print('linking edges between:', node_from, new_node, node_to)
     # interpolate noise cost attributes for new linking edges so that they work in quiet path routing
     link1_noise_costs = get_edge_noise_cost_attrs(nts, db_costs, edge, link1)
     link2_noise_costs = get_edge_noise_cost_attrs(nts, db_costs, edge, link2)
-    # combine link attributes to prepare adding them as new edges
+    # combine link attributes of the linking edges
     link1_attrs = { 'geometry': link1, 'length' : round(link1.length, 3), **link1_noise_costs }
     link2_attrs = { 'geometry': link2, 'length' : round(link2.length, 3), **link2_noise_costs }
-    # add linking edges with noice cost attributes to graph
-    graph.add_edges_from([ (node_from, new_node, { 'uvkey': (node_from, new_node), **link1_attrs }) ])
-    graph.add_edges_from([ (new_node, node_from, { 'uvkey': (new_node, node_from), **link1_attrs }) ])
-    graph.add_edges_from([ (node_to, new_node, { 'uvkey': (node_to, new_node), **link2_attrs }) ])
-    graph.add_edges_from([ (new_node, node_to, { 'uvkey': (new_node, node_to), **link2_attrs }) ])
     link1_d = { 'uvkey': (new_node, node_from), **link1_attrs }
     link2_d = { 'uvkey': (node_to, new_node), **link2_attrs }
-    return { 'node_from': node_from, 'new_node': new_node, 'node_to': node_to, 'link1': link1_d, 'link2': link2_d }
-
-def remove_new_node_and_link_edges(graph, new_node_d):
-    if ('link_edges' in new_node_d.keys()):
-        link_edges = new_node_d['link_edges']
-        edges = [
-            (link_edges['node_from'], link_edges['new_node']),
-            (link_edges['new_node'], link_edges['node_from']),
-            (link_edges['new_node'], link_edges['node_to']),
-            (link_edges['node_to'], link_edges['new_node'])
-            ]
-        for edge in edges:
-            try:
-                graph.remove_edge(*edge)
-            except Exception:
-                continue
-        try:
-            graph.remove_node(link_edges['new_node'])
-        except Exception:
-            pass
+    return { 'node_from': node_from, 'new_node': new_node, 'new_node_xy': (split_point.x, split_point.y), 'node_to': node_to, 'link1': link1_d, 'link2': link2_d }
 
 def get_shortest_edge(edges, weight):
     if (len(edges) == 1):
@@ -214,7 +177,25 @@ def get_edge_line_coords(graph, node_from, edge_d):
         return edge_coords[::-1]
     return edge_coords
 
-def aggregate_path_geoms_attrs(graph, path, weight='length', geom=True, noises=False):
+def aggregate_csr_path_geoms_attrs(csr_graph, path, overlay=None, geom=True, noises=False):
+    # path is a dict of node indexes and edge ids as returned by csr_graph.get_shortest_path (assembled with array ops)
+    result = {}
+    if geom:
+        result['geometry'] = LineString(csr.get_path_coords(csr_graph, path['node_idxs'], path['edge_ids'], overlay=overlay))
+        # edge ids & lengths are kept for comparing the paths by their edges (e.g. in removing duplicate paths)
+        edge_lengths = csr.get_path_edge_lengths(csr_graph, path['edge_ids'], overlay=overlay)
+        result['edge_lengths'] = dict(zip(np.asarray(path['edge_ids']).tolist(), edge_lengths.tolist()))
+        result['total_length'] = round(float(edge_lengths.sum()), 2)
+    if noises:
+        # exposure vector is kept for further (vectorized) processing and converted to dict for output
+        result['noise_vector'] = csr.get_path_noises(csr_graph, path['edge_ids'], overlay=overlay)
+        result['noises'] = exps.get_noise_dict_from_vector(result['noise_vector'], dbs=csr_graph['dbs'], round_n=2)
+    return result
+
+def aggregate_path_geoms_attrs(graph, path, weight='length', geom=True, noises=False, overlay=None):
+    if (isinstance(graph, dict)):
+        # path over CSR graph
+        return aggregate_csr_path_geoms_attrs(graph, path, overlay=overlay, geom=geom, noises=noises)
     result = {}
     edge_lengths = []
     path_coords = []
@@ -312,8 +293,157 @@ def update_edge_costs_to_graph(edge_gdf, graph, nt):
         nx.set_edge_attributes(graph, { getattr(edge, 'uvkey'): { cost_attr: getattr(edge, 'tot_cost')}}) 
 
 def set_graph_noise_costs(graph, edge_gdf, db_costs=None, nts=None):
-    edge_nc_gdf = edge_gdf.copy()
+    # base noise costs (nt = 1) are calculated once (unrounded) and scaled by noise tolerances before rounding
+    uvkeys = list(edge_gdf['uvkey'])
+    lengths = np.array(edge_gdf['length'], dtype=np.float64)
+    noise_costs = exps.get_noise_costs(exps.get_noise_matrix(edge_gdf['noises']), db_costs=db_costs, round_n=None)
     for nt in nts:
-        edge_nc_gdf['noise_cost'] = [exps.get_noise_cost(noises=noises, db_costs=db_costs, nt=nt) for noises in edge_nc_gdf['noises']]
-        edge_nc_gdf['tot_cost'] = edge_nc_gdf.apply(lambda row: round(row['length'] + row['noise_cost'], 2), axis=1)
-        update_edge_costs_to_graph(edge_nc_gdf, graph, nt)
+        tot_costs = np.round(lengths + np.round(noise_costs * nt, 2), 2).tolist()
+        nx.set_edge_attributes(graph, { uvkey: tot_cost for uvkey, tot_cost in zip(uvkeys, tot_costs) }, name='nc_'+str(nt))
+
+def get_graph_arrays(graph, noises=True):
+    # collect nodes & edges of the graph to typed arrays (to be exported as graph snapshot)
+    node_ids = np.array(sorted(graph.nodes), dtype=np.int64)
+    node_xy = np.array([[graph.nodes[node]['x'], graph.nodes[node]['y']] for node in node_ids.tolist()], dtype=np.float64)
+    dbs = exps.get_noise_dbs()
+    db_idxs = { db: idx for idx, db in enumerate(dbs) }
+    edge_nodes = []
+    edge_lengths = []
+    edge_noises = []
+    geom_offsets = [0]
+    geom_coords = []
+    for u, v, data in graph.edges(data=True):
+        edge_nodes.append((u, v))
+        edge_lengths.append(data['length'])
+        if ('geometry' in data):
+            geom_coords += list(data['geometry'].coords)
+        else:
+            geom_coords += list(get_edge_geom_from_node_pair(graph, u, v).coords)
+        geom_offsets.append(len(geom_coords))
+        if (noises == True):
+            noise_row = [0.0] * len(dbs)
+            for db, db_len in data['noises'].items():
+                noise_row[db_idxs[int(db)]] = db_len
+            edge_noises.append(noise_row)
+    # edge end nodes as indexes of the (sorted) node_ids array
+    edge_uv = np.searchsorted(node_ids, np.array(edge_nodes, dtype=np.int64).reshape(-1, 2)).astype(np.int32)
+    graph_arrays = {
+        'node_ids': node_ids,
+        'node_xy': node_xy,
+        'edge_uv': edge_uv,
+        'edge_length': np.array(edge_lengths, dtype=np.float64),
+        'geom_offsets': np.array(geom_offsets, dtype=np.int64),
+        'geom_coords': np.array(geom_coords, dtype=np.float64)[:, :2]
+        }
+    if (noises == True):
+        graph_arrays['edge_noises'] = np.array(edge_noises, dtype=np.float64).reshape(-1, len(dbs))
+    graph_attrs = { key: value for key, value in graph.graph.items() if isinstance(value, (str, int, float, dict, list)) }
+    meta = { 'graph_attrs': graph_attrs, 'dbs': dbs, 'node_count': len(node_ids), 'edge_count': len(edge_lengths) }
+    return { 'meta': meta, **graph_arrays }
+
+def get_edge_geom_from_arrays(graph_arrays, edge_id):
+    offsets = graph_arrays['geom_offsets']
+    return LineString(graph_arrays['geom_coords'][offsets[edge_id]:offsets[edge_id+1]])
+
+def get_edge_noise_attrs(graph_arrays, db_costs, ths=[55, 60, 65, 70]):
+    '''
+    Function for calculating noise attributes of all edges of the graph (snapshot arrays or CSR graph) at once as arrays
+    by edge index, so that they need not be recalculated from noise dictionaries of edges in analyses.
+    Returns
+    -------
+    <dictionary>
+        Arrays of mean dB (mdB), noise exposure index (nei), normalized nei (nei_norm) and lengths of noise levels
+        higher than the thresholds (th_lens, edges x ths) by edge index.
+    '''
+    dbs = graph_arrays['dbs'] if 'dbs' in graph_arrays else graph_arrays['meta']['dbs']
+    edge_noises = np.asarray(graph_arrays['edge_noises'], dtype=np.float64)
+    lengths = np.asarray(graph_arrays['edge_length'], dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mdB = exps.get_mean_noise_levels(edge_noises, lengths, dbs=dbs)
+        nei = exps.get_noise_costs(edge_noises, db_costs=db_costs, dbs=dbs, round_n=1)
+        nei_norm = np.round(nei / (lengths * db_costs[75]), 4)
+    th_lens = exps.get_th_exposure_matrix(edge_noises, ths, dbs=dbs)
+    return { 'ths': ths, 'mdB': mdB, 'nei': nei, 'nei_norm': nei_norm, 'th_lens': th_lens }
+
+def get_edge_bounds(graph_arrays):
+    # bounding boxes (minx, miny, maxx, maxy) of all edge geometries from the coordinate arrays
+    coords = np.asarray(graph_arrays['geom_coords'])
+    starts = np.asarray(graph_arrays['geom_offsets'])[:-1]
+    mins = np.minimum.reduceat(coords, starts, axis=0)
+    maxs = np.maximum.reduceat(coords, starts, axis=0)
+    return np.hstack([mins, maxs])
+
+def get_edge_ids_intersecting(graph_arrays, polys):
+    # edges within the bounding region of the polygons are found from the edge bounds and tested exactly with a spatial join
+    if (polys.empty):
+        return np.array([], dtype=np.int64)
+    minx, miny, maxx, maxy = polys.total_bounds
+    bounds = get_edge_bounds(graph_arrays)
+    edge_ids = np.nonzero((bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) & (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny))[0]
+    if (len(edge_ids) == 0):
+        return edge_ids
+    edge_geoms = [get_edge_geom_from_arrays(graph_arrays, edge_id) for edge_id in edge_ids.tolist()]
+    edge_gdf = gpd.GeoDataFrame({ 'edge_id': edge_ids }, geometry=edge_geoms, crs=polys.crs)
+    edge_polys = gpd.sjoin(edge_gdf, polys[['geometry']], how='inner', op='intersects')
+    return np.unique(edge_polys['edge_id'].values)
+
+def get_edge_keys(graph_arrays):
+    # edges identified by their end node ids and geometry (in the order of the node ids, as edges are undirected)
+    node_ids = graph_arrays['node_ids']
+    offsets = graph_arrays['geom_offsets']
+    edge_keys = []
+    for edge_id, (u, v) in enumerate(graph_arrays['edge_uv'].tolist()):
+        u_id, v_id = int(node_ids[u]), int(node_ids[v])
+        coords = np.round(graph_arrays['geom_coords'][offsets[edge_id]:offsets[edge_id+1]], 2)
+        if (u_id > v_id):
+            u_id, v_id, coords = v_id, u_id, coords[::-1]
+        edge_keys.append((u_id, v_id, coords.tobytes()))
+    return edge_keys
+
+def get_matching_edge_ids(graph_arrays, old_graph_arrays):
+    # ids of the same (unchanged) edges in the old graph arrays (-1 for new and changed edges)
+    old_edge_ids = { edge_key: edge_id for edge_id, edge_key in enumerate(get_edge_keys(old_graph_arrays)) }
+    return np.array([old_edge_ids.get(edge_key, -1) for edge_key in get_edge_keys(graph_arrays)], dtype=np.int64)
+
+def get_updated_edge_noises(graph_arrays, noise_polys, changed_noise_polys=None, old_graph_arrays=None):
+    '''
+    Function for recomputing noises of only the edges affected by an update of the noise data or the network. Noises are
+    extracted for edges that intersect changed noise polygons and for edges that are new or changed compared to
+    old_graph_arrays. Noises of other edges are kept (or copied from old_graph_arrays).
+    Returns
+    -------
+    <tuple>
+        Edge noise array of all edges and the ids of the re-noised edges.
+    '''
+    edge_count = len(graph_arrays['edge_length'])
+    dbs = exps.get_noise_dbs()
+    if (old_graph_arrays is not None):
+        old_edge_ids = get_matching_edge_ids(graph_arrays, old_graph_arrays)
+        matched = old_edge_ids >= 0
+        edge_noises = np.zeros((edge_count, len(dbs)), dtype=np.float64)
+        edge_noises[matched] = np.asarray(old_graph_arrays['edge_noises'])[old_edge_ids[matched]]
+        renoise = ~matched
+    else:
+        edge_noises = np.array(graph_arrays['edge_noises'], dtype=np.float64)
+        renoise = np.zeros(edge_count, dtype=bool)
+    if (changed_noise_polys is not None):
+        renoise[get_edge_ids_intersecting(graph_arrays, changed_noise_polys)] = True
+    renoise_ids = np.nonzero(renoise)[0]
+    if (len(renoise_ids) > 0):
+        edge_geoms = [get_edge_geom_from_arrays(graph_arrays, edge_id) for edge_id in renoise_ids.tolist()]
+        edge_noises[renoise_ids] = exps.get_line_noise_array(edge_geoms, noise_polys, dbs=dbs)
+    return edge_noises, renoise_ids
+
+def get_graph_from_arrays(graph_arrays):
+    # build undirected graph from graph snapshot arrays (without parsing WKT geometries or noise dict strings)
+    graph = nx.MultiGraph(**graph_arrays['meta']['graph_attrs'])
+    node_ids = graph_arrays['node_ids'].tolist()
+    graph.add_nodes_from([(node, { 'x': xy[0], 'y': xy[1] }) for node, xy in zip(node_ids, graph_arrays['node_xy'].tolist())])
+    dbs = graph_arrays['meta']['dbs']
+    edge_noises = graph_arrays['edge_noises'].tolist() if 'edge_noises' in graph_arrays else None
+    for edge_id, (u, v) in enumerate(graph_arrays['edge_uv'].tolist()):
+        edge_attrs = { 'length': float(graph_arrays['edge_length'][edge_id]), 'geometry': get_edge_geom_from_arrays(graph_arrays, edge_id) }
+        if (edge_noises is not None):
+            edge_attrs['noises'] = { db: db_len for db, db_len in zip(dbs, edge_noises[edge_id]) if db_len > 0 }
+        graph.add_edge(node_ids[u], node_ids[v], **edge_attrs)
+    return graph
@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+def get_path_cache(max_entries=2000, max_bytes=200*1024**2, ttl=3600, version=None):
+    '''
+    Function for creating an LRU cache (with time to live) of serialized path responses. The cache is bounded by
+    the number of entries and by the total size of the stored responses (bytes) and it is safe to use from threads.
+    Returns
+    -------
+    <dictionary>
+        Cache entries (ordered from least to most recently used), bounds, version and hit/miss counters.
+    '''
+    return {
+        'entries': OrderedDict(),
+        'lock': Lock(),
+        'max_entries': max_entries,
+        'max_bytes': max_bytes,
+        'ttl': ttl,
+        'bytes': 0,
+        'version': version,
+        'hits': 0,
+        'misses': 0,
+        'evictions': 0,
+        'expirations': 0,
+        'invalidations': 0
+        }
+
+def clear_entries(cache, version=None):
+    # the lock of the cache must be held by the caller
+    cache['entries'].clear()
+    cache['bytes'] = 0
+    cache['version'] = version
+    cache['invalidations'] += 1
+
+def clear_cache(cache, version=None):
+    with cache['lock']:
+        clear_entries(cache, version=version)
+
+def check_version(cache, version):
+    # version identifies the data (e.g. graph snapshot) the cached values were computed from: all values are dropped if it changes
+    # (checked under the same lock as the lookup or insert, so that values of different versions are never mixed)
+    if (version is not None and version != cache['version']):
+        clear_entries(cache, version=version)
+
+def get_cached_value(cache, key, version=None):
+    with cache['lock']:
+        check_version(cache, version)
+        entry = cache['entries'].get(key)
+        if (entry is None):
+            cache['misses'] += 1
+            return None
+        value, added = entry
+        if (cache['ttl'] is not None and time.time() - added > cache['ttl']):
+            del cache['entries'][key]
+            cache['bytes'] -= len(value)
+            cache['expirations'] += 1
+            cache['misses'] += 1
+            return None
+        cache['entries'].move_to_end(key)
+        cache['hits'] += 1
+        return value
+
+def set_cached_value(cache, key, value, version=None):
+    # value is a serialized response (bytes / str), least recently used values are evicted to keep the cache in its bounds
+    with cache['lock']:
+        check_version(cache, version)
+        if (len(value) > cache['max_bytes']):
+            return
+        if (key in cache['entries']):
+            cache['bytes'] -= len(cache['entries'].pop(key)[0])
+        cache['entries'][key] = (value, time.time())
+        cache['bytes'] += len(value)
+        while (len(cache['entries']) > cache['max_entries'] or cache['bytes'] > cache['max_bytes']):
+            _, (old_value, _) = cache['entries'].popitem(last=False)
+            cache['bytes'] -= len(old_value)
+            cache['evictions'] += 1
+
+def get_cache_stats(cache):
+    with cache['lock']:
+        requests = cache['hits'] + cache['misses']
+        return {
+            'entries': len(cache['entries']),
+            'bytes': cache['bytes'],
+            'hits': cache['hits'],
+            'misses': cache['misses'],
+            'hit_ratio': round(cache['hits'] / requests, 3) if requests > 0 else 0,
+            'evictions': cache['evictions'],
+            'expirations': cache['expirations'],
+            'invalidations': cache['invalidations'],
+            'version': cache['version']
+            }
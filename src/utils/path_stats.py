@@ -4,6 +4,8 @@ import numpy as np
 import statistics as stats
 import utils.files as files
 import utils.geometry as geom_utils
+import utils.weighted_stats as wstats
+import utils.pipeline as pipeline
 
 def add_bool_within_hel_poly(gdf):
     # read city extent (polygon of Helsinki)
@@ -27,35 +29,31 @@ def fix_dt_len_diff(df):
 
 def map_pt_path_props_to_null(df):
     paths = df.copy()
-    print('PT_path_walk_paths', len(paths.query("to_pt_mode == 'WALK'")))
-    paths['length'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['length'], axis=1)
-    paths['mdB'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['mdB'], axis=1)
-    paths['nei'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['nei'], axis=1)
-    paths['nei_norm'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['nei_norm'], axis=1)
-    paths['DT_len'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['DT_len'], axis=1)
-    paths['DT_len_diff'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['DT_len_diff'], axis=1)
-    paths['DT_len_diff_rat'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['DT_len_diff_rat'], axis=1)
-    paths['noises'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['noises'], axis=1)
-    paths['th_noises'] = paths.apply(lambda row: -9999 if row['to_pt_mode'] == 'WALK' else row['th_noises'], axis=1)
+    is_walk = paths['to_pt_mode'] == 'WALK'
+    print('PT_path_walk_paths', is_walk.sum())
+    # noise exposures are either dictionaries or columns by dB (n_<dB>, th_<dB>, see pipeline.flatten_dict_columns)
+    null_cols = ['length', 'mdB', 'nei', 'nei_norm', 'DT_len', 'DT_len_diff', 'DT_len_diff_rat', 'noises', 'th_noises']
+    null_cols = [col for col in null_cols if col in paths.columns] + pipeline.get_dict_key_columns(paths, 'n') + pipeline.get_dict_key_columns(paths, 'th')
+    for col in null_cols:
+        paths.loc[is_walk, col] = -9999
     print('mapped', len(paths.query("length == -9999")), 'lengths to -9999')
     return paths
 
 def extract_th_db_cols(paths_gdf, ths=[60, 65], valueignore=-9999, add_ratios=True):
     gdf = paths_gdf.copy()
-    def get_db_len_ratio(row, th_len_col):
-        if (row['length'] == valueignore):
-            return valueignore
-        return round((row[th_len_col]/row['length'])*100,2)
-    
     for th in ths:
-        th_key = str(th)
         th_col = str(th)+'dBl'
-        gdf[th_col] = [th_noises[th_key] if type(th_noises) == dict else valueignore for th_noises in gdf['th_noises']]
+        if ('th_'+ str(th) in gdf.columns):
+            gdf[th_col] = gdf['th_'+ str(th)].fillna(valueignore)
+        else:
+            gdf[th_col] = [th_noises.get(th, th_noises.get(str(th))) if type(th_noises) == dict else valueignore for th_noises in gdf['th_noises']]
     if (add_ratios == True):
         for th in ths:
             th_len_col = str(th)+'dBl'
             th_rat_col = str(th)+'dBr'
-            gdf[th_rat_col] = gdf.apply(lambda row: get_db_len_ratio(row, th_len_col), axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                th_rats = np.round((gdf[th_len_col].values / gdf['length'].values)*100, 2)
+            gdf[th_rat_col] = np.where(gdf['length'].values == valueignore, valueignore, th_rats)
     print('mapped', len(gdf[gdf['60dBl'] == valueignore]), 'db stats to -9999')
     return gdf
 
@@ -67,16 +65,6 @@ def add_dt_length_diff_cols(paths_gdf, valueignore=-9999):
     print('mapped', len(gdf[gdf['DT_len_diff_rat'] == valueignore]), 'length stats to -9999')
     return gdf
 
-def explode_array_by_weights(df, var_col, weight_col):
-    orig_array = df[var_col]
-    weights = df[weight_col]
-    if (len(orig_array) != len(weights)):
-        print('length of weights does not match the length of values')
-    expl_array = []
-    for val, weight in zip(orig_array, weights):
-        expl_array += [val] * int(round(weight*10))
-    return expl_array
-
 def filter_by_min_value(data_df, var_col, min_value):
     df = data_df.copy()
     count_before = len(df)
@@ -128,58 +116,90 @@ def calc_basic_stats(data_gdf, var_col, valuemap=None, valueignore=None, axyinds
     n = len(gdf.index)
     if (printing == True): print('n=', n)
     
-    var_array = []
-    if (weight is not None):
-        if (printing == True): print('Weighted stats:')
-        var_array = explode_array_by_weights(gdf, var_col, weight)
-    else:
-        if (printing == True): print('Basic stats:')
-        var_array = gdf[var_col]
-
+    if (printing == True): print('Weighted stats:' if weight is not None else 'Basic stats:')
+    var_array = gdf[var_col].values
     if (valuemap is not None):
-        var_array = [value if value != valuemap[0] else valuemap[1] for value in var_array]
-
-    mean = round(np.mean(var_array), 3)
-    std = round(np.std(var_array), 3)
-    median = round(np.median(var_array), 3)
+        var_array = np.where(var_array == valuemap[0], valuemap[1], var_array)
+    weights = gdf[weight].values if weight is not None else None
+    var_stats = wstats.get_weighted_stats(var_array, weights=weights, percs=percs, minmax=minmax)
 
     col_name = col_prefix +'_' if (col_prefix is not '' and add_varname != True) else ''
     d = { 'name': col_prefix if col_prefix != '' else var_col } if (add_varname == True) else {}
     if (add_n == True): d['n'] = n
-    d = { **d, col_name+'mean': mean, col_name+'median': median, col_name+'std': std }
+    d = { **d, col_name+'mean': round(var_stats['mean'], 3), col_name+'median': round(var_stats['median'], 3), col_name+'std': round(var_stats['std'], 3) }
 
     if (percs is not None):
         for per in percs:
-            d['p'+str(per)] = np.percentile(var_array, per)
+            d['p'+str(per)] = var_stats['p'+str(per)]
 
     if (minmax == True):
-        d['min'] = round(np.min(var_array), 3)
-        d['max'] = round(np.max(var_array), 3)
+        d['min'] = round(var_stats['min'], 3)
+        d['max'] = round(var_stats['max'], 3)
 
     if (printing == True): print('STATS:', d)
 
     return d
 
-def get_best_quiet_paths_of_max_len_diffs(od_id=None, df=None, sp=None, max_len_diffs=None):
-    # od_qp_stats = {'od_id': od_id, 'length': sp['length'], 'nei_norm': sp['nei_norm'], 'util': sp['util'] }
-    qp_stats = {}
+def get_perc_classes(values, perc_values):
+    '''
+    Function for classifying values by the highest percentile value (of perc_values, in ascending order) that they exceed.
+    The values are classified at once by searching them from the percentile values (see get_perc_class_names).
+    Returns
+    -------
+    <numpy array>
+        Indexes of the percentile classes (0 if no percentile value is exceeded, i if perc_values[i-1] is).
+    '''
+    return np.searchsorted(np.asarray(perc_values, dtype=np.float64), np.asarray(values, dtype=np.float64), side='left')
+
+def get_perc_class_names(class_idxs, percs, default='p0'):
+    return np.array([default] + list(percs), dtype=object)[class_idxs]
+
+def add_quiet_path_diff_cols(qps, sps):
+    '''
+    Function for adding differences in noise exposures to the shortest path of the OD (sps, one per od_id) as columns
+    to quiet paths (qps). Quiet paths of ODs without shortest path are left out.
+    Returns
+    -------
+    <DataFrame>
+        Quiet paths with columns mdB_diff, 60dB_diff, 65dB_diff, 60dB_diff_r & 65dB_diff_r.
+    '''
+    sp_cols = sps[['od_id', 'mdB', '60dBl', '65dBl']].rename(columns={ 'mdB': 'sp_mdB', '60dBl': 'sp_60dBl', '65dBl': 'sp_65dBl' })
+    qps = qps.merge(sp_cols, how='inner', on='od_id')
+    qps['mdB_diff'] = qps['mdB'] - qps['sp_mdB']
+    for th in ['60', '65']:
+        sp_dblen = qps['sp_'+ th +'dBl'].values
+        qps[th +'dB_diff'] = np.round(qps[th +'dBl'].values - sp_dblen, 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            qps[th +'dB_diff_r'] = np.where(sp_dblen != 0, np.round((qps[th +'dB_diff'].values / sp_dblen) * 100), 0)
+    return qps.drop(columns=['sp_mdB', 'sp_60dBl', 'sp_65dBl'])
+
+def get_od_quiet_path_stats(paths_df, max_len_diffs=[100, 200, 300]):
+    '''
+    Function for comparing quiet paths to the shortest paths of all ODs (od_id) at once. For each max_len_diff, the quiet
+    path with the greatest length difference below it is selected as the best quiet path of the OD (by one sort of all
+    quiet paths). Stats of ODs without (best) quiet path are -9999 (NaN values of the best quiet paths are left as NaN).
+    Returns
+    -------
+    <DataFrame>
+        Stats of shortest paths and the best quiet paths (<stat>_qp<max_len_diff>) by OD.
+    '''
+    sps = paths_df[paths_df['path_id'] == 'short_p'].drop_duplicates('od_id')
+    qps = add_quiet_path_diff_cols(paths_df[paths_df['path_id'] != 'short_p'], sps)
+    od_stats = sps[['od_id', 'length', 'mdB', 'nei', 'nei_norm', 'util', '60dBl', '65dBl', '60dBr', '65dBr']].sort_values('od_id')
+    od_stats = od_stats.set_index('od_id')
+    # quiet paths of each OD in descending order by length difference: the first one below max_len_diff is the best
+    qps = qps.sort_values(['od_id', 'len_diff'], ascending=[True, False], kind='mergesort')
+    qp_cols = ['len_diff', 'len_diff_r', 'nei', 'nei_diff', 'nei_diff_r', 'mdB_diff', '60dB_diff', '65dB_diff', '60dB_diff_r', '65dB_diff_r']
     for max_len in max_len_diffs:
-        qps = df.query(f'''len_diff < {max_len}''')
-        found_qps = len(qps) > 0
-        qps = qps.sort_values('len_diff', ascending=False) if found_qps == True else None
-        qp = qps.to_dict(orient='records')[0] if found_qps == True else {}
-        qp_stats['count_qp'+str(max_len)] = len(qps) if found_qps == True else 0
-        qp_stats['len_diff_qp'+str(max_len)] = qp['len_diff'] if found_qps == True else -9999
-        qp_stats['len_diff_r_qp'+str(max_len)] = qp['len_diff_r'] if found_qps == True else -9999
-        qp_stats['nei_qp'+str(max_len)] = qp['nei'] if found_qps == True else -9999
-        qp_stats['nei_diff_qp'+str(max_len)] = qp['nei_diff'] if found_qps == True else -9999
-        qp_stats['nei_diff_r_qp'+str(max_len)] = qp['nei_diff_r'] if found_qps == True else -9999
-        qp_stats['mdB_diff_qp'+str(max_len)] = qp['mdB_diff'] if found_qps == True else -9999
-        qp_stats['60dB_diff_qp'+str(max_len)] = qp['60dB_diff'] if found_qps == True else -9999
-        qp_stats['65dB_diff_qp'+str(max_len)] = qp['65dB_diff'] if found_qps == True else -9999
-        qp_stats['60dB_diff_r_qp'+str(max_len)] = qp['60dB_diff_r'] if found_qps == True else -9999
-        qp_stats['65dB_diff_r_qp'+str(max_len)] = qp['65dB_diff_r'] if found_qps == True else -9999
-    return qp_stats
+        max_len_qps = qps[qps['len_diff'].values < max_len]
+        best_qps = max_len_qps.drop_duplicates('od_id').set_index('od_id')
+        od_stats['count_qp'+ str(max_len)] = max_len_qps.groupby('od_id').size().reindex(od_stats.index, fill_value=0)
+        # only ODs without best quiet path get -9999, missing (NaN) values of the best quiet paths are kept
+        no_qp = ~od_stats.index.isin(best_qps.index)
+        for col in qp_cols:
+            od_stats[col +'_qp'+ str(max_len)] = np.where(no_qp, -9999, best_qps[col].reindex(od_stats.index).values)
+    od_stats['count_qp'] = qps.groupby('od_id').size().reindex(od_stats.index, fill_value=0)
+    return od_stats.reset_index()
 
 def filter_out_paths_outside_hel(paths):
     gdf = paths.copy()
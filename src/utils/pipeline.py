@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import queue
+from itertools import islice
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+def get_manifest_filepath(dirname):
+    return os.path.join(dirname, 'manifest.json')
+
+def get_partition_filepath(dirname, chunk_id):
+    return os.path.join(dirname, 'part_'+ str(chunk_id).zfill(5) +'.parquet')
+
+def write_manifest(dirname, manifest):
+    # manifest is replaced atomically, so an interrupted write never corrupts it
+    filepath = get_manifest_filepath(dirname)
+    with open(filepath +'.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(filepath +'.tmp', filepath)
+
+def load_manifest(dirname):
+    with open(get_manifest_filepath(dirname)) as f:
+        return json.load(f)
+
+def get_manifest(dirname, work_ids, chunk_size=10):
+    '''
+    Function for loading (or creating) the work manifest of a pipeline: work ids (e.g. axyinds) split into chunks that are
+    processed and checkpointed one at a time. Work ids missing from an existing manifest are added as new chunks and
+    failed work ids of partial chunks are requeued (see requeue_failed_work_ids).
+    Returns
+    -------
+    <dictionary>
+        Manifest with chunks (chunk_id, work_ids, status, rows, errors).
+    '''
+    os.makedirs(dirname, exist_ok=True)
+    if (os.path.exists(get_manifest_filepath(dirname))):
+        manifest = requeue_failed_work_ids(load_manifest(dirname))
+    else:
+        manifest = { 'created': time.time(), 'int_key_columns': [], 'flat_dict_columns': {}, 'chunks': [] }
+    known_ids = set([work_id for chunk in manifest['chunks'] for work_id in chunk['work_ids']])
+    # numpy scalars (e.g. ids from a DataFrame) are converted to python types for json
+    new_ids = [work_id.item() if hasattr(work_id, 'item') else work_id for work_id in work_ids]
+    new_ids = [work_id for work_id in new_ids if work_id not in known_ids]
+    for idx in range(0, len(new_ids), chunk_size):
+        manifest['chunks'].append({ 'chunk_id': len(manifest['chunks']), 'work_ids': new_ids[idx:idx + chunk_size], 'status': 'pending' })
+    write_manifest(dirname, manifest)
+    return manifest
+
+def requeue_failed_work_ids(manifest):
+    # failed work ids of partial chunks are moved to new pending chunks, the other work ids of the chunks (and their
+    # results in the partitions of the chunks) stay done
+    for chunk in [chunk for chunk in manifest['chunks'] if chunk['status'] == 'partial']:
+        failed_ids = set(chunk.get('errors', []))
+        manifest['chunks'].append({ 'chunk_id': len(manifest['chunks']), 'work_ids': [work_id for work_id in chunk['work_ids'] if work_id in failed_ids], 'status': 'pending' })
+        chunk.update({ 'work_ids': [work_id for work_id in chunk['work_ids'] if work_id not in failed_ids], 'status': 'done', 'errors': [] })
+    return manifest
+
+def get_pending_chunks(manifest):
+    return [chunk for chunk in manifest['chunks'] if chunk['status'] in ['pending', 'failed']]
+
+def get_done_work_ids(manifest):
+    # work ids of partial chunks are done except for their errors
+    return [work_id for chunk in manifest['chunks'] if chunk['status'] in ['done', 'partial'] for work_id in chunk['work_ids'] if work_id not in chunk.get('errors', [])]
+
+def get_failed_work_ids(manifest):
+    return [work_id for chunk in manifest['chunks'] if chunk['status'] in ['partial', 'failed'] for work_id in chunk.get('errors', [])]
+
+def reset_work_ids(dirname, work_ids):
+    # chunks of the work ids are processed again (and their partitions rewritten) in the next run
+    manifest = load_manifest(dirname)
+    work_ids = set(work_ids)
+    for chunk in manifest['chunks']:
+        if (len(work_ids.intersection(chunk['work_ids'])) > 0):
+            chunk['status'] = 'pending'
+    write_manifest(dirname, manifest)
+    return manifest
+
+def get_int_key_dict_columns(df):
+    # columns of dictionaries with non string keys (e.g. noises by dB) that need to be converted for Parquet structs
+    columns = []
+    for col in df.columns:
+        if (df[col].dtype != object):
+            continue
+        values = df[col].dropna()
+        if (len(values) > 0 and isinstance(values.iloc[0], dict) and any(not isinstance(key, str) for value in values for key in value)):
+            columns.append(col)
+    return columns
+
+def write_partition(dirname, chunk_id, df, int_key_columns=[]):
+    '''
+    Function for writing the results of a chunk as a Parquet (or GeoParquet) partition. Columns of dictionaries are
+    stored as native struct columns (keys of int_key_columns are converted to strings).
+    Returns
+    -------
+    <string>
+        Filepath of the partition.
+    '''
+    df = df.copy()
+    for col in int_key_columns:
+        df[col] = [{ str(key): value for key, value in d.items() } if isinstance(d, dict) else d for d in df[col]]
+    filepath = get_partition_filepath(dirname, chunk_id)
+    # partition is written to a temp file first, so that only complete partitions exist
+    df.to_parquet(filepath +'.tmp', index=False)
+    os.replace(filepath +'.tmp', filepath)
+    return filepath
+
+def flatten_dict_columns(df, flat_dict_columns):
+    '''
+    Function for converting columns of dictionaries (e.g. noises by dB) to numeric columns by key, named <prefix>_<key>
+    (e.g. n_45 & n_50 for flat_dict_columns={ 'noises': 'n' }). Keys missing from a dictionary are NaN.
+    Returns
+    -------
+    <DataFrame>
+        Data with dictionary columns replaced by the columns of their keys.
+    '''
+    for col, prefix in flat_dict_columns.items():
+        if (col not in df.columns):
+            continue
+        keys_df = pd.DataFrame.from_records([d if isinstance(d, dict) else {} for d in df[col]], index=df.index)
+        keys_df = keys_df[sorted(keys_df.columns)].astype(np.float64)
+        keys_df.columns = [prefix +'_'+ str(key) for key in keys_df.columns]
+        df = pd.concat([df.drop(columns=[col]), keys_df], axis=1)
+    return df
+
+def get_dict_key_columns(df, prefix):
+    # flattened dictionary columns of the prefix (e.g. n_45 but not n_diff_45 for prefix n)
+    return [col for col in df.columns if col.startswith(prefix +'_') and col[len(prefix)+1:].lstrip('-').isdigit()]
+
+def get_dict_column(df, prefix):
+    '''
+    Function for reconstructing dictionaries (with int keys, e.g. noises by dB) from flattened columns (see
+    flatten_dict_columns) when they are needed, e.g. for functions of utils.exposures. NaN keys are left out.
+    Returns
+    -------
+    <list>
+        Dictionaries of the rows.
+    '''
+    key_cols = get_dict_key_columns(df, prefix)
+    keys = [int(col[len(prefix)+1:]) for col in key_cols]
+    return [{ key: value for key, value in zip(keys, values) if value == value } for values in df[key_cols].values.tolist()]
+
+def imap_bounded(pool, func, items, max_pending=8, get_failure=None):
+    '''
+    Function for mapping func over items in the pool (e.g. multiprocessing.Pool) and yielding the results as soon as they
+    are ready (in the order of completion). At most max_pending items are submitted to the pool at a time and new items
+    are submitted only as results are consumed, so results never pile up in the parent process if the consumer
+    (e.g. a writer or an aggregator) is slower than the workers. Without pool, items are processed one by one.
+    If get_failure(item, error) is given, the result of an item that raised an error is replaced by its return value
+    (a failure marker) and the other items keep going, otherwise the first error is raised.
+    Returns
+    -------
+    <generator>
+        Results of func (or failure markers).
+    '''
+    if (pool is None):
+        for item in items:
+            try:
+                result = func(item)
+            except Exception as e:
+                if (get_failure is None):
+                    raise
+                result = get_failure(item, e)
+            yield result
+        return
+    results = queue.Queue()
+    items = iter(items)
+    def submit(item):
+        pool.apply_async(func, (item,), callback=lambda result: results.put((True, result)), error_callback=lambda error: results.put((False, get_failure(item, error) if get_failure is not None else error)))
+    pending = 0
+    for item in islice(items, max_pending):
+        submit(item)
+        pending += 1
+    while (pending > 0):
+        ok, result = results.get()
+        pending -= 1
+        if (not ok and get_failure is None):
+            raise result
+        for item in islice(items, 1):
+            submit(item)
+            pending += 1
+        yield result
+
+def run_chunk(args):
+    process_chunk, chunk = args
+    start_time = time.time()
+    result_df, errors = process_chunk(chunk['work_ids'])
+    return chunk, result_df, errors, time.time() - start_time, None
+
+def get_failed_chunk_result(args, error):
+    # failure marker of a chunk whose processing raised an error (all work ids of the chunk failed)
+    process_chunk, chunk = args
+    print('Error in processing chunk', chunk['chunk_id'], ':', repr(error))
+    return chunk, None, list(chunk['work_ids']), 0.0, repr(error)
+
+def run_pipeline(dirname, work_ids, process_chunk, chunk_size=10, pool=None, max_pending=8, flat_dict_columns=None, logging=True):
+    '''
+    Function for processing work ids in checkpointed chunks. Each chunk is processed with process_chunk(work_ids), which
+    returns a DataFrame (or GeoDataFrame) of results and a list of failed work ids. Results of each chunk are written
+    as a Parquet partition and the chunk is marked done (or partial if some work ids failed) in the manifest right away,
+    so the pipeline can be stopped and resumed at any point (done chunks are skipped and failed work ids of partial
+    chunks are processed again as new chunks). Chunks whose processing raises an error are marked failed (without
+    stopping the other chunks) and processed again in the next run. Chunks are processed in the pool (e.g. multiprocessing.Pool) if given,
+    with at most max_pending chunks in process or waiting to be written at a time (see imap_bounded). Dictionary columns
+    of flat_dict_columns (column: prefix) are written as numeric columns by key (see flatten_dict_columns).
+    Returns
+    -------
+    <dictionary>
+        Manifest of the pipeline.
+    '''
+    manifest = get_manifest(dirname, work_ids, chunk_size=chunk_size)
+    if (flat_dict_columns is not None):
+        manifest['flat_dict_columns'] = { **manifest.get('flat_dict_columns', {}), **flat_dict_columns }
+    pending_chunks = get_pending_chunks(manifest)
+    if (logging == True):
+        print('Chunks done:', len(manifest['chunks']) - len(pending_chunks), '- to process:', len(pending_chunks))
+    chunk_args = [(process_chunk, chunk) for chunk in pending_chunks]
+    results = imap_bounded(pool, run_chunk, chunk_args, max_pending=max_pending, get_failure=get_failed_chunk_result)
+    for idx, (chunk, result_df, errors, duration, error) in enumerate(results):
+        rows = 0
+        if (result_df is not None and len(result_df.index) > 0):
+            if (flat_dict_columns is not None):
+                result_df = flatten_dict_columns(result_df, flat_dict_columns)
+            int_key_columns = get_int_key_dict_columns(result_df)
+            manifest['int_key_columns'] = sorted(set(manifest['int_key_columns'] + int_key_columns))
+            write_partition(dirname, chunk['chunk_id'], result_df, int_key_columns=int_key_columns)
+            rows = len(result_df.index)
+        manifest_chunk = manifest['chunks'][chunk['chunk_id']]
+        status = 'failed' if error is not None else 'partial' if len(errors) > 0 else 'done'
+        manifest_chunk.update({ 'status': status, 'rows': rows, 'errors': errors, 'error': error, 'duration': round(duration, 1), 'finished': time.time() })
+        write_manifest(dirname, manifest)
+        if (logging == True):
+            print('Chunk', chunk['chunk_id'], status, '('+ str(idx + 1) +'/'+ str(len(pending_chunks)) +'):', rows, 'rows,', len(errors), 'errors in', round(duration, 1), 's')
+    return manifest
+
+def read_partitions(dirname, geo=False, columns=None, dict_columns=[]):
+    '''
+    Function for reading the results of a pipeline (all partitions of done & partial chunks) to one DataFrame (or GeoDataFrame).
+    Flattened dictionary columns are read as numeric columns by key, unless they are listed in dict_columns (then
+    they are converted back to dictionaries, see get_dict_column).
+    Returns
+    -------
+    <DataFrame / GeoDataFrame>
+        Results of the pipeline.
+    '''
+    manifest = load_manifest(dirname)
+    filepaths = [get_partition_filepath(dirname, chunk['chunk_id']) for chunk in manifest['chunks'] if chunk['status'] in ['done', 'partial'] and chunk.get('rows', 0) > 0]
+    read_parquet = gpd.read_parquet if geo else pd.read_parquet
+    dfs = [read_parquet(filepath, columns=columns) for filepath in filepaths]
+    if (len(dfs) == 0):
+        return None
+    df = pd.concat(dfs, ignore_index=True, sort=False)
+    if (geo == True):
+        df = gpd.GeoDataFrame(df, crs=dfs[0].crs)
+    # struct columns of int keyed dictionaries back to dictionaries (fields missing from a row are null in structs)
+    for col in [col for col in manifest['int_key_columns'] if col in df.columns]:
+        df[col] = [{ int(key): value for key, value in d.items() if value is not None } if isinstance(d, dict) else d for d in df[col]]
+    flat_dict_columns = manifest.get('flat_dict_columns', {})
+    for col in dict_columns:
+        key_cols = get_dict_key_columns(df, flat_dict_columns[col])
+        df[col] = get_dict_column(df, flat_dict_columns[col])
+        df = df.drop(columns=key_cols)
+    return df
@@ -1,5 +1,8 @@
+import numpy as np
+from scipy.spatial import cKDTree
 import utils.geometry as geom_utils
 import utils.exposures as exps
+import utils.snapping as snapping
 
 def get_noise_tolerances():
     return [ 0.1, 0.15, 0.25, 0.35, 0.5, 1, 1.5, 2, 4, 6, 10, 20, 40 ]
@@ -49,6 +52,43 @@ def get_overlapping_paths(by_path, compare_paths: list, buffer_m: int = None) ->
             overlapping_paths.append(compare_path)
     return overlapping_paths
 
+def get_edge_overlap_ratio(path_a, path_b) -> float:
+    """Returns length weighted Jaccard similarity of the edge sets of [path_a] and [path_b] (shared length / union length).
+    """
+    edges_a = path_a['properties']['edge_lengths']
+    edges_b = path_b['properties']['edge_lengths']
+    shared_len = sum([length for edge_id, length in edges_a.items() if edge_id in edges_b])
+    union_len = sum(edges_a.values()) + sum(edges_b.values()) - shared_len
+    return shared_len / union_len if union_len > 0 else 1.0
+
+def is_line_near_line(vertex_tree, line_geom, max_distance: float, vertex_spacing: float = 5.0) -> bool:
+    """Returns True if all (densified) vertices of [line_geom] are within [max_distance] of the vertices in [vertex_tree]
+    (densified vertices of the other line, see snapping.get_line_vertices), i.e. if the line is (approximately) within
+    the buffer of the other line without buffering. The distance is relaxed by half of the vertex spacing.
+    """
+    vertices = snapping.get_line_vertices(line_geom, vertex_spacing=vertex_spacing)
+    distances, _ = vertex_tree.query(vertices)
+    return bool(np.all(distances <= max_distance + vertex_spacing / 2))
+
+def get_overlapping_edge_paths(by_path, compare_paths: list, min_overlap: float = 0.9, buffer_m: int = None, vertex_spacing: float = 5.0) -> list:
+    """Returns [compare_paths] whose edges overlap with the edges of [by_path] at least by [min_overlap] (weighted Jaccard).
+    Paths with lower edge overlap are still overlapping if all their vertices are within [buffer_m] (m) of the vertices
+    of [by_path] (e.g. paths along parallel sidewalks and roads that share hardly any edges). The distances are queried
+    from a KD-tree of the densified vertices of [by_path] instead of buffering its geometry.
+    """
+    overlapping_paths = [by_path]
+    vertex_tree = None
+    for compare_path in [compare_path for compare_path in compare_paths if compare_path['properties']['id'] != by_path['properties']['id']]:
+        if (get_edge_overlap_ratio(by_path, compare_path) >= min_overlap):
+            overlapping_paths.append(compare_path)
+        elif (buffer_m is not None and by_path['properties'].get('geometry') is not None and compare_path['properties'].get('geometry') is not None):
+            # build the vertex tree only if some candidate needs the geometric comparison
+            if (vertex_tree is None):
+                vertex_tree = cKDTree(snapping.get_line_vertices(by_path['properties']['geometry'], vertex_spacing=vertex_spacing))
+            if (is_line_near_line(vertex_tree, compare_path['properties']['geometry'], buffer_m, vertex_spacing=vertex_spacing) == True):
+                overlapping_paths.append(compare_path)
+    return overlapping_paths
+
 def get_least_cost_path(paths, cost_attr):
     ordered = paths.copy()
     def get_score(path):
@@ -92,6 +132,43 @@ def remove_duplicate_geom_paths(paths, tolerance=None, remove_geom_prop=True, lo
         print('found', len(paths), 'of which returned', len(filtered_paths), 'unique paths.')
     return filtered_paths
 
+def remove_duplicate_edge_paths(paths, tolerance=None, min_overlap=0.9, remove_geom_prop=True, logging=True):
+    """Groups paths as in remove_duplicate_geom_paths but compares the edges of the paths (edge ids & lengths from routing)
+    first. Paths are overlapping if their lengths differ less than [tolerance] (m) and their edges overlap at least by
+    [min_overlap] (length weighted Jaccard) or, failing that, the vertices of the path are within [tolerance] (m) of the
+    vertices of the other (KD-tree query without buffers, if the paths have geometries). The path with the lowest nei of
+    each group is kept.
+    """
+    filtered_paths = []
+    filtered_paths_names = set()
+    paths_already_overlapped = set()
+
+    for path in paths:
+        path_name = path['properties']['id']
+        if (path_name not in filtered_paths_names and path_name not in paths_already_overlapped):
+            overlay_candidates = get_path_overlay_candidates_by_len(path, paths, len_diff=tolerance)
+            overlapping_paths = get_overlapping_edge_paths(path, overlay_candidates, min_overlap=min_overlap, buffer_m=tolerance)
+            best_overlapping_path = get_least_cost_path(overlapping_paths, cost_attr='nei')
+            if (best_overlapping_path['properties']['id'] not in filtered_paths_names):
+                filtered_paths_names.add(best_overlapping_path['properties']['id'])
+                filtered_paths.append(best_overlapping_path)
+            paths_already_overlapped.update([path['properties']['id'] for path in overlapping_paths])
+
+    filtered_paths.sort(key=get_path_length)
+
+    if ('short_p' not in filtered_paths_names):
+        filtered_paths[0]['properties']['id'] = 'short_p'
+        filtered_paths[0]['properties']['type'] = 'short'
+
+    # delete edges (and shapely geometries) from path dicts
+    for path in filtered_paths:
+        del path['properties']['edge_lengths']
+        if (remove_geom_prop == True):
+            del path['properties']['geometry']
+    if logging == True: 
+        print('found', len(paths), 'of which returned', len(filtered_paths), 'unique paths.')
+    return filtered_paths
+
 def get_geojson_from_q_path_gdf(gdf):
     features = []
     for path in gdf.itertuples():
@@ -106,5 +183,7 @@ def get_geojson_from_q_path_gdf(gdf):
         feature_d['properties']['nei'] = getattr(path, 'nei')
         feature_d['properties']['nei_norm'] = getattr(path, 'nei_norm')
         feature_d['properties']['geometry'] = getattr(path, 'geometry')
+        if ('edge_lengths' in gdf.columns):
+            feature_d['properties']['edge_lengths'] = getattr(path, 'edge_lengths')
         features.append(feature_d)
     return features
@@ -3,78 +3,86 @@ import geopandas as gpd
 import osmnx as ox
 import networkx as nx
 import time
+import numpy as np
 from fiona.crs import from_epsg
 from shapely.geometry import Point, LineString, MultiLineString, box
-from shapely.ops import nearest_points
 import utils.networks as nw
 import utils.geometry as geom_utils
 import utils.exposures as exps
 import utils.utils as utils
 import utils.quiet_paths as qp
+import utils.csr_graph as csr
+import utils.snapping as snapping
 
-def find_nearest_edge(xy, edge_gdf):
-    # start_time = time.time()
-    edges_sind = edge_gdf.sindex
-    point_geom = geom_utils.get_point_from_xy(xy)
-    for radius in [80, 150, 250, 350, 650]:
-        possible_matches_index = list(edges_sind.intersection(point_geom.buffer(radius).bounds))
-        if (len(possible_matches_index) > 0):
-            possible_matches = edge_gdf.iloc[possible_matches_index].copy()
-            possible_matches['distance'] = [geom.distance(point_geom) for geom in possible_matches['geometry']]
-            shortest_dist = possible_matches['distance'].min()
-            if (shortest_dist < (radius - 50) or len(possible_matches_index) > 20):
-                break
-    if (len(possible_matches_index) == 0):
-        print('no near edges found')
-        return None
-    nearest = possible_matches['distance'] == shortest_dist
-    nearest_edges =  possible_matches.loc[nearest]
-    nearest_edge = nearest_edges.iloc[0]
-    nearest_edge_dict = nearest_edge.to_dict()
-    # utils.print_duration(start_time, 'found nearest edge')
-    return nearest_edge_dict
-
-def find_nearest_node(xy, node_gdf):
-    # start_time = time.time()
-    nodes_sind = node_gdf.sindex
-    point_geom = geom_utils.get_point_from_xy(xy)
-    possible_matches_index = list(nodes_sind.intersection(point_geom.buffer(700).bounds))
-    possible_matches = node_gdf.iloc[possible_matches_index]
-    points_union = possible_matches.geometry.unary_union
-    nearest_geom = nearest_points(point_geom, points_union)[1]
-    nearest = possible_matches.geometry.geom_equals(nearest_geom)
-    nearest_point =  possible_matches.loc[nearest]
-    nearest_node = nearest_point.index.tolist()[0]
-    # utils.print_duration(start_time, 'found nearest node')
-    return nearest_node
+def get_virtual_node_id(orig_node=None):
+    # ids of new (virtual) origin & destination nodes do not overlap with the (positive) node ids of the graph
+    if (orig_node is not None and 'link_edges' in orig_node):
+        return orig_node['node'] - 1
+    return -1
 
-def get_nearest_node(graph, xy, edge_gdf, node_gdf, nts=[], db_costs={}, orig_node=None, logging=False):
-    coords = geom_utils.get_coords_from_xy(xy)
-    point = Point(coords)
-    nearest_edge = find_nearest_edge(xy, edge_gdf)
+def get_nearest_node(snap_index, xy, nts=[], db_costs={}, orig_node=None, logging=False, snapped=None, new_node=None):
+    '''
+    Function for finding the nearest node to a point or creating a new (virtual) node on the nearest edge.
+    Nearest node & edge are queried from snapping index (see snapping.get_snap_index) and the graph is not modified:
+    the new node and its linking edges are returned in the node dict and can be passed to routing as an overlay
+    (see csr_graph.get_link_edge_overlay). Nearest edge & node can be given as snapped (if queried in batch)
+    and the id of the new node as new_node (if many new nodes are routed with the same overlay).
+    '''
+    csr_graph = snap_index['csr_graph']
+    point = Point(geom_utils.get_coords_from_xy(xy))
+    if (snapped is None):
+        snapped = (snapping.get_nearest_edge(snap_index, xy), snapping.get_nearest_node(snap_index, xy))
+    nearest_edge, nearest_node = snapped
     if (nearest_edge is None):
         return None
-    nearest_node = find_nearest_node(xy, node_gdf)
-    # parse node geom from node attributes
-    nearest_node_geom = geom_utils.get_point_from_xy(graph.nodes[nearest_node])
     # get the nearest point on the nearest edge
-    nearest_edge_point = geom_utils.get_closest_point_on_line(nearest_edge['geometry'], point)
+    nearest_edge_point = Point(nearest_edge['point'])
     # return the nearest node if it is as near (or nearer) as the nearest edge
-    if (nearest_edge_point.distance(nearest_node_geom) < 1 or nearest_node_geom.distance(point) < nearest_edge['geometry'].distance(point)):
-        return { 'node': nearest_node, 'offset': round(nearest_node_geom.distance(point), 1) }
+    if (is_snapped_to_node(csr_graph, snapped)):
+        nearest_node_geom = Point(csr_graph['node_xy'][nearest_node['node_idx']])
+        node_id = int(csr_graph['node_ids'][nearest_node['node_idx']])
+        return { 'node': node_id, 'node_xy': (nearest_node_geom.x, nearest_node_geom.y), 'offset': round(nearest_node['distance'], 1) }
+    nearest_edge = snapping.get_edge_dict(snap_index, nearest_edge['edge_id'])
+    node_points = { node: Point(csr_graph['node_xy'][csr.get_node_index(csr_graph, node)]) for node in nearest_edge['uvkey'][:2] }
     # check if the nearest edge of the destination is one of the linking edges created for origin 
     if (orig_node is not None and 'link_edges' in orig_node):
+        node_points[orig_node['node']] = Point(orig_node['node_xy'])
         if (nearest_edge_point.distance(orig_node['link_edges']['link1']['geometry']) < 0.2):
             nearest_edge = orig_node['link_edges']['link1']
         if (nearest_edge_point.distance(orig_node['link_edges']['link2']['geometry']) < 0.2):
             nearest_edge = orig_node['link_edges']['link2']
-    # create a new node on the nearest edge
-    new_node = nw.add_new_node_to_graph(graph, nearest_edge_point, logging=logging)
-    # link added node to the origin and destination nodes of the nearest edge (by adding two linking edges)
-    link_edges = nw.add_linking_edges_for_new_node(graph, new_node, nearest_edge_point, nearest_edge, nts, db_costs, logging=logging)
-    return { 'node': new_node, 'link_edges': link_edges, 'offset': round(nearest_edge_point.distance(point), 1) }
+    # create a new (virtual) node on the nearest edge
+    if (new_node is None):
+        new_node = get_virtual_node_id(orig_node)
+    # link the new node to the origin and destination nodes of the nearest edge (by two linking edges)
+    link_edges = nw.get_linking_edges_for_new_node(new_node, nearest_edge_point, nearest_edge, nts, db_costs, node_points, logging=logging)
+    return { 'node': new_node, 'node_xy': (nearest_edge_point.x, nearest_edge_point.y), 'link_edges': link_edges, 'offset': round(nearest_edge_point.distance(point), 1) }
+
+def is_snapped_to_node(csr_graph, snapped):
+    # location is snapped to the nearest node (instead of a new node on the nearest edge) if the node is as near as the edge
+    nearest_edge, nearest_node = snapped
+    if (nearest_edge is None or nearest_node is None):
+        return False
+    node_xy = csr_graph['node_xy'][nearest_node['node_idx']]
+    edge_point_node_dist = ((nearest_edge['point'][0] - node_xy[0])**2 + (nearest_edge['point'][1] - node_xy[1])**2)**0.5
+    return edge_point_node_dist < 1 or nearest_node['distance'] < nearest_edge['distance']
+
+def get_snap_key(snap_index, snapped, bucket=5):
+    # key of a snapped location (for caching paths): the nearest node or the nearest edge & (bucketed) nearest point on it
+    nearest_edge, nearest_node = snapped
+    if (nearest_edge is None):
+        return None
+    if (is_snapped_to_node(snap_index['csr_graph'], snapped)):
+        return ('node', nearest_node['node_idx'])
+    return ('edge', nearest_edge['edge_id'], int(nearest_edge['point'][0] // bucket), int(nearest_edge['point'][1] // bucket))
 
-def get_shortest_path(graph, orig_node, dest_node, weight='length'):
+def get_shortest_path(graph, orig_node, dest_node, weight='length', overlay=None, costs_version=None):
+    if (isinstance(graph, dict)):
+        # route over CSR graph (see csr_graph.get_csr_graph)
+        s_path = csr.get_shortest_path(graph, orig_node, dest_node, weight=weight, overlay=overlay, costs_version=costs_version)
+        if (s_path is None):
+            print('Could not find paths')
+        return s_path
     if (orig_node != dest_node):
         try:
             s_path = nx.shortest_path(G=graph, source=orig_node, target=dest_node, weight=weight)
@@ -127,55 +135,160 @@ def get_short_quiet_paths_comparison_for_dicts(paths):
         path['properties']['path_score'] = round((path['properties']['nei_diff'] / path['properties']['len_diff']) * -1, 1) if path['properties']['len_diff'] > 0 else 0
     return comp_paths
 
-def get_short_quiet_paths(graph, from_latLon, to_latLon, edge_gdf, node_gdf, nts=[], db_costs={}, remove_geom_prop=False, only_short=False, logging=True):
-    # get origin & destination nodes
-    from_xy = geom_utils.get_xy_from_lat_lon(from_latLon)
-    to_xy = geom_utils.get_xy_from_lat_lon(to_latLon)
-    # find/create origin and destination nodes
-    orig_node = get_nearest_node(graph, from_xy, edge_gdf, node_gdf, nts=nts, db_costs=db_costs)
-    dest_node = get_nearest_node(graph, to_xy, edge_gdf, node_gdf, nts=nts, db_costs=db_costs, orig_node=orig_node)
-    if (orig_node is None):
-        print('could not find origin node at', from_latLon)
-        return None
-    if (dest_node is None):
-        print('could not find destination node at', to_latLon)
+def get_short_quiet_path_list(graph, orig_node, dest_node, nts=[], overlay=None, costs_version=None):
+    # route shortest path & quiet paths of all noise tolerances and collect them to list (of path geometries & noises)
+    weights = ['length'] + ['nc_'+str(nt) for nt in nts]
+    if (isinstance(graph, dict)):
+        # one call for all noise tolerances (over CSR graph the searches are shared between tolerances)
+        paths = csr.get_least_cost_paths_for_nts(graph, orig_node, dest_node, nts=nts, overlay=overlay, costs_version=costs_version)
+    else:
+        paths = [get_shortest_path(graph, orig_node, dest_node, weight=weight) for weight in weights]
+    return get_path_list_for_paths(graph, paths, nts=nts, overlay=overlay)
+
+def get_path_list_for_paths(graph, paths, nts=[], overlay=None):
+    # collect geometries & noises of the shortest path & quiet paths (in the order of [0] + nts) to list
+    if (paths[0] is None):
         return None
-    # get shortest path
+    weights = ['length'] + ['nc_'+str(nt) for nt in nts]
+    path_attrs = [{'id': 'short_p','type': 'short', 'nt': 0}] + [{'id': 'q_'+str(nt), 'type': 'quiet', 'nt': nt} for nt in nts]
     path_list = []
-    shortest_path = get_shortest_path(graph, orig_node['node'], dest_node['node'], weight='length')
-    if (shortest_path is None):
-        print('could not find shortest path')
-        return None
-    if (only_short == True):
-        return shortest_path
-    path_geom_noises = nw.aggregate_path_geoms_attrs(graph, shortest_path, weight='length', noises=True)
-    path_list.append({**path_geom_noises, **{'id': 'short_p','type': 'short', 'nt': 0}})
-    # get quiet paths to list
-    for nt in nts:
-        noise_cost_attr = 'nc_'+str(nt)
-        quiet_path = get_shortest_path(graph, orig_node['node'], dest_node['node'], weight=noise_cost_attr)
-        path_geom_noises = nw.aggregate_path_geoms_attrs(graph, quiet_path, weight=noise_cost_attr, noises=True)
-        path_list.append({**path_geom_noises, **{'id': 'q_'+str(nt), 'type': 'quiet', 'nt': nt}})
-    # remove linking edges of the origin / destination nodes
-    nw.remove_new_node_and_link_edges(graph, orig_node)
-    nw.remove_new_node_and_link_edges(graph, dest_node)
+    quiet_path_keys = []
+    for path, weight, attrs in zip(paths, weights, path_attrs):
+        if (isinstance(path, dict)):
+            # skip quiet paths identical to quiet paths of lower noise tolerances (duplicates would be dropped anyway)
+            path_key = tuple(path['edge_ids'])
+            if (attrs['type'] == 'quiet' and path_key in quiet_path_keys):
+                continue
+            if (attrs['type'] == 'quiet'):
+                quiet_path_keys.append(path_key)
+        path_geom_noises = nw.aggregate_path_geoms_attrs(graph, path, weight=weight, noises=True, overlay=overlay)
+        path_list.append({**path_geom_noises, **attrs})
+    return path_list
+
+def get_short_quiet_path_features(path_list, db_costs={}, remove_geom_prop=True):
     # collect quiet paths to gdf
     paths_gdf = gpd.GeoDataFrame(path_list, crs=from_epsg(3879))
     paths_gdf = paths_gdf.drop_duplicates(subset=['type', 'total_length']).sort_values(by=['type', 'total_length'], ascending=[False, True])
+    # exposure vectors of all paths as a matrix (paths x noise ranges)
+    noise_matrix = exps.get_noise_matrix(paths_gdf['noise_vector'] if 'noise_vector' in paths_gdf.columns else paths_gdf['noises'])
+    total_lengths = paths_gdf['total_length'].values
     # add exposures to noise levels higher than specified threshods (dBs)
-    paths_gdf['th_noises'] = [exps.get_th_exposures(noises, [55, 60, 65, 70]) for noises in paths_gdf['noises']]
+    ths = [55, 60, 65, 70]
+    paths_gdf['th_noises'] = [{ th: round(th_len, 3) for th, th_len in zip(ths, th_lens) } for th_lens in exps.get_th_exposure_matrix(noise_matrix, ths).tolist()]
     # add percentages of cumulative distances of different noise levels
-    paths_gdf['noise_pcts'] = paths_gdf.apply(lambda row: exps.get_noise_pcts(row['noises'], row['total_length']), axis=1)
+    pct_dists = exps.get_noise_pct_dists(noise_matrix, total_lengths)
+    noise_pcts = exps.get_noise_pct_matrix(noise_matrix, total_lengths)
+    paths_gdf['noise_pcts'] = [{ db: pct for db, pct, dist in zip(exps.get_noise_pct_dbs(), pcts, dists) if dist > 0 } for pcts, dists in zip(noise_pcts.tolist(), pct_dists.tolist())]
     # calculate mean noise level
-    paths_gdf['mdB'] = paths_gdf.apply(lambda row: exps.get_mean_noise_level(row['noises'], row['total_length']), axis=1)
+    paths_gdf['mdB'] = exps.get_mean_noise_levels(noise_matrix, total_lengths)
     # calculate noise exposure index (same as noise cost but without noise tolerance coefficient)
-    paths_gdf['nei'] = [round(exps.get_noise_cost(noises=noises, db_costs=db_costs), 1) for noises in paths_gdf['noises']]
+    paths_gdf['nei'] = exps.get_noise_costs(noise_matrix, db_costs=db_costs, round_n=1)
     paths_gdf['nei_norm'] = paths_gdf.apply(lambda row: exps.get_nei_norm(row.nei, row.total_length, db_costs), axis=1)
     # gdf to dicts
     path_dicts = qp.get_geojson_from_q_path_gdf(paths_gdf)
-    # group paths with nearly identical geometries
-    unique_paths = qp.remove_duplicate_geom_paths(path_dicts, tolerance=30, remove_geom_prop=remove_geom_prop, logging=False)
+    # group nearly identical paths (by edges of the paths if routed over CSR graph, otherwise by geometries)
+    if ('edge_lengths' in paths_gdf.columns):
+        unique_paths = qp.remove_duplicate_edge_paths(path_dicts, tolerance=30, remove_geom_prop=remove_geom_prop, logging=False)
+    else:
+        unique_paths = qp.remove_duplicate_geom_paths(path_dicts, tolerance=30, remove_geom_prop=remove_geom_prop, logging=False)
     # calculate exposure differences to shortest path
-    path_comps = get_short_quiet_paths_comparison_for_dicts(unique_paths)
+    return get_short_quiet_paths_comparison_for_dicts(unique_paths)
+
+def get_orig_dest_nodes(snap_index, from_latLon, to_latLon, nts=[], db_costs={}):
+    # find/create origin and destination nodes (None if either of them is not found)
+    from_xy, to_xy = geom_utils.get_xys_from_lat_lons([from_latLon, to_latLon])
+    orig_node = get_nearest_node(snap_index, from_xy, nts=nts, db_costs=db_costs)
+    dest_node = get_nearest_node(snap_index, to_xy, nts=nts, db_costs=db_costs, orig_node=orig_node)
+    if (orig_node is None):
+        print('could not find origin node at', from_latLon)
+        return None
+    if (dest_node is None):
+        print('could not find destination node at', to_latLon)
+        return None
+    return orig_node, dest_node
+
+def get_shortest_path_dict(csr_graph, from_latLon, to_latLon, snap_index, nts=[], db_costs={}):
+    '''
+    Function for routing the shortest path between two points over the CSR graph (with the origin & destination nodes
+    as overlay), e.g. for aggregating paths to edges by the edge ids of the paths.
+    Returns
+    -------
+    <dictionary>
+        Path (nodes, edge_ids, ...) as returned by csr_graph.get_shortest_path, or None if no path was found.
+    '''
+    od_nodes = get_orig_dest_nodes(snap_index, from_latLon, to_latLon, nts=nts, db_costs=db_costs)
+    if (od_nodes is None):
+        return None
+    orig_node, dest_node = od_nodes
+    overlay = csr.get_link_edge_overlay(csr_graph, [orig_node, dest_node])
+    shortest_path = get_shortest_path(csr_graph, orig_node['node'], dest_node['node'], weight='length', overlay=overlay)
+    if (shortest_path is None):
+        print('could not find shortest path')
+    return shortest_path
+
+def get_short_quiet_paths(csr_graph, from_latLon, to_latLon, snap_index, nts=[], db_costs={}, remove_geom_prop=False, only_short=False, logging=True):
+    # routing is done over the CSR graph with the origin & destination nodes as overlay (the graph is not modified)
+    # shortest paths are returned as lists of nodes (only_short & shortest_path), see get_shortest_path_dict for edges
+    if (only_short == True):
+        shortest_path = get_shortest_path_dict(csr_graph, from_latLon, to_latLon, snap_index, nts=nts, db_costs=db_costs)
+        return shortest_path['nodes'] if shortest_path is not None else None
+    od_nodes = get_orig_dest_nodes(snap_index, from_latLon, to_latLon, nts=nts, db_costs=db_costs)
+    if (od_nodes is None):
+        return None
+    orig_node, dest_node = od_nodes
+    overlay = csr.get_link_edge_overlay(csr_graph, [orig_node, dest_node])
+    # get shortest path & quiet paths
+    paths = csr.get_least_cost_paths_for_nts(csr_graph, orig_node['node'], dest_node['node'], nts=nts, overlay=overlay)
+    path_list = get_path_list_for_paths(csr_graph, paths, nts=nts, overlay=overlay)
+    if (path_list is None):
+        print('could not find shortest path')
+        return None
+    path_comps = get_short_quiet_path_features(path_list, db_costs=db_costs, remove_geom_prop=remove_geom_prop)
     # return paths as GeoJSON (FeatureCollection)...
-    return { 'paths': path_comps, 'shortest_path': shortest_path, 'orig_offset': orig_node['offset'], 'dest_offset': dest_node['offset'] }
+    return { 'paths': path_comps, 'shortest_path': paths[0]['nodes'], 'orig_offset': orig_node['offset'], 'dest_offset': dest_node['offset'] }
+
+def get_short_quiet_paths_for_ods(csr_graph, od_latLons, snap_index, nts=[], db_costs={}, remove_geom_prop=False, logging=False):
+    '''
+    Function for routing the shortest & quiet paths for many OD pairs at once. All origins & destinations are snapped
+    in one batch and OD pairs are grouped by origin so that the paths to all destinations of an origin are found with
+    shared one-to-many searches.
+    Returns
+    -------
+    <list of dictionaries>
+        Path comparisons (paths) and offsets of the OD pairs (or None) in the order of od_latLons ([(from_latLon, to_latLon), ...]).
+    '''
+    # snap unique locations in one batch
+    latLon_keys = list(set([(latLon['lat'], latLon['lon']) for od in od_latLons for latLon in od]))
+    xys = geom_utils.get_xys_from_lat_lons([{'lat': lat, 'lon': lon} for lat, lon in latLon_keys])
+    snaps = dict(zip(latLon_keys, zip(snapping.get_nearest_edges(snap_index, xys), snapping.get_nearest_nodes(snap_index, xys))))
+    key_xys = dict(zip(latLon_keys, xys))
+    # group OD pairs by origin
+    od_groups = {}
+    for od_idx, (from_latLon, to_latLon) in enumerate(od_latLons):
+        od_groups.setdefault((from_latLon['lat'], from_latLon['lon']), []).append((od_idx, (to_latLon['lat'], to_latLon['lon'])))
+    results = [None] * len(od_latLons)
+    for orig_key, dest_ods in od_groups.items():
+        orig_node = get_nearest_node(snap_index, key_xys[orig_key], nts=nts, db_costs=db_costs, snapped=snaps[orig_key], logging=logging)
+        if (orig_node is None):
+            print('could not find origin node at', orig_key)
+            continue
+        # create destination nodes (new nodes of different destinations get different ids in the shared overlay)
+        dest_keys = list(set([dest_key for od_idx, dest_key in dest_ods if dest_key != orig_key]))
+        dest_nodes = {}
+        for dest_key in dest_keys:
+            new_node = get_virtual_node_id(orig_node) - len(dest_nodes)
+            dest_nodes[dest_key] = get_nearest_node(snap_index, key_xys[dest_key], nts=nts, db_costs=db_costs, orig_node=orig_node, snapped=snaps[dest_key], new_node=new_node, logging=logging)
+        routed_dest_keys = [dest_key for dest_key in dest_keys if dest_nodes[dest_key] is not None]
+        overlay = csr.get_link_edge_overlay(csr_graph, [orig_node] + [dest_nodes[dest_key] for dest_key in routed_dest_keys])
+        dest_paths = csr.get_least_cost_paths_for_nts_to_many(csr_graph, orig_node['node'], [dest_nodes[dest_key]['node'] for dest_key in routed_dest_keys], nts=nts, overlay=overlay)
+        dest_path_comps = {}
+        for dest_key, paths in zip(routed_dest_keys, dest_paths):
+            path_list = get_path_list_for_paths(csr_graph, paths, nts=nts, overlay=overlay)
+            if (path_list is None):
+                print('could not find shortest path from', orig_key, 'to', dest_key)
+                continue
+            path_comps = get_short_quiet_path_features(path_list, db_costs=db_costs, remove_geom_prop=remove_geom_prop)
+            dest_path_comps[dest_key] = { 'paths': path_comps, 'orig_offset': orig_node['offset'], 'dest_offset': dest_nodes[dest_key]['offset'] }
+        for od_idx, dest_key in dest_ods:
+            results[od_idx] = dest_path_comps.get(dest_key)
+    return results
@@ -0,0 +1,114 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from shapely.geometry import LineString
+
+def get_snap_index(csr_graph, vertex_spacing=5.0):
+    '''
+    Function for building a point snapping index for the CSR graph: a KD-tree of nodes and a KD-tree of vertices
+    densified along all edge segments (at most vertex_spacing apart). Candidate segments of the nearest edge are
+    found from the vertex tree and the exact nearest point is projected to them.
+    Returns
+    -------
+    <dictionary>
+        KD-trees, segment arrays and the CSR graph the index was built for.
+    '''
+    geom_coords = np.asarray(csr_graph['geom_coords'], dtype=np.float64)
+    geom_offsets = np.asarray(csr_graph['geom_offsets'])
+    # segments are formed between consecutive coordinates of the same edge (last coordinates of edges start no segment)
+    is_seg_start = np.ones(len(geom_coords), dtype=bool)
+    is_seg_start[geom_offsets[1:] - 1] = False
+    seg_start_idxs = np.nonzero(is_seg_start)[0]
+    seg_start = geom_coords[seg_start_idxs]
+    seg_end = geom_coords[seg_start_idxs + 1]
+    seg_edge_ids = np.searchsorted(geom_offsets, seg_start_idxs, side='right') - 1
+    vertex_xy, vertex_seg_ids = get_densified_vertices(seg_start, seg_end, vertex_spacing=vertex_spacing)
+    return {
+        'csr_graph': csr_graph,
+        'node_tree': cKDTree(np.asarray(csr_graph['node_xy'])),
+        'vertex_tree': cKDTree(vertex_xy),
+        'vertex_seg_ids': vertex_seg_ids,
+        'vertex_spacing': vertex_spacing,
+        'seg_start': seg_start,
+        'seg_end': seg_end,
+        'seg_edge_ids': seg_edge_ids
+        }
+
+def get_densified_vertices(seg_start, seg_end, vertex_spacing=5.0):
+    # vertices along segments (at most vertex_spacing apart, ends of the segments included) and their segment indexes
+    seg_lengths = np.hypot(*(seg_end - seg_start).T)
+    seg_vertex_counts = np.maximum(np.ceil(seg_lengths / vertex_spacing).astype(np.int64), 1) + 1
+    vertex_seg_ids = np.repeat(np.arange(len(seg_start)), seg_vertex_counts)
+    vertex_firsts = np.repeat(np.cumsum(seg_vertex_counts) - seg_vertex_counts, seg_vertex_counts)
+    vertex_ts = (np.arange(len(vertex_seg_ids)) - vertex_firsts) / (seg_vertex_counts[vertex_seg_ids] - 1)
+    vertex_xy = seg_start[vertex_seg_ids] + vertex_ts[:, None] * (seg_end - seg_start)[vertex_seg_ids]
+    return vertex_xy, vertex_seg_ids
+
+def get_line_vertices(line_geom, vertex_spacing=5.0):
+    # vertices of a line densified to at most vertex_spacing apart
+    coords = np.asarray(line_geom.coords, dtype=np.float64)[:, :2]
+    if (len(coords) < 2):
+        return coords
+    return get_densified_vertices(coords[:-1], coords[1:], vertex_spacing=vertex_spacing)[0]
+
+def get_nearest_node(snap_index, xy, max_distance=700):
+    return get_nearest_nodes(snap_index, [xy], max_distance=max_distance)[0]
+
+def get_nearest_nodes(snap_index, xys, max_distance=700):
+    # nearest nodes of all points in one (vectorized) KD-tree query
+    points = np.array([[xy['x'], xy['y']] for xy in xys], dtype=np.float64).reshape(-1, 2)
+    distances, node_idxs = snap_index['node_tree'].query(points, distance_upper_bound=max_distance)
+    return [{ 'node_idx': int(node_idx), 'distance': float(distance) } if not np.isinf(distance) else None for distance, node_idx in zip(distances, node_idxs)]
+
+def get_nearest_edge(snap_index, xy, max_distance=650):
+    '''
+    Function for finding the nearest edge to a point and the nearest point on the edge.
+    Returns
+    -------
+    <dictionary>
+        Edge id (index), the projected point (x, y) and the distance from the point to the edge (or None if no edge was found).
+    '''
+    return get_nearest_edges(snap_index, [xy], max_distance=max_distance)[0]
+
+def get_nearest_edges(snap_index, xys, max_distance=650):
+    # nearest vertices of all points are queried at once and the exact nearest points are projected for each point
+    points = np.array([[xy['x'], xy['y']] for xy in xys], dtype=np.float64).reshape(-1, 2)
+    vertex_dists, _ = snap_index['vertex_tree'].query(points, distance_upper_bound=max_distance + snap_index['vertex_spacing'])
+    nearest_edges = []
+    for point, vertex_dist in zip(points, vertex_dists):
+        if (np.isinf(vertex_dist)):
+            nearest_edges.append(None)
+            continue
+        # the nearest segment has a vertex within half of the vertex spacing from its nearest point
+        vertex_idxs = snap_index['vertex_tree'].query_ball_point(point, vertex_dist + snap_index['vertex_spacing'])
+        seg_ids = np.unique(snap_index['vertex_seg_ids'][vertex_idxs])
+        seg_start = snap_index['seg_start'][seg_ids]
+        seg_vectors = snap_index['seg_end'][seg_ids] - seg_start
+        seg_sq_lengths = np.maximum((seg_vectors * seg_vectors).sum(axis=1), 1e-12)
+        seg_ts = np.clip(((point - seg_start) * seg_vectors).sum(axis=1) / seg_sq_lengths, 0, 1)
+        proj_points = seg_start + seg_ts[:, None] * seg_vectors
+        proj_dists = np.hypot(*(proj_points - point).T)
+        nearest = int(np.argmin(proj_dists))
+        if (proj_dists[nearest] > max_distance):
+            nearest_edges.append(None)
+            continue
+        nearest_edges.append({
+            'edge_id': int(snap_index['seg_edge_ids'][seg_ids[nearest]]),
+            'point': tuple(proj_points[nearest].tolist()),
+            'distance': float(proj_dists[nearest])
+            })
+    return nearest_edges
+
+def get_edge_dict(snap_index, edge_id):
+    # edge attributes in the same format as the rows of networks.get_edge_gdf (for splitting the edge to linking edges)
+    csr_graph = snap_index['csr_graph']
+    u, v = csr_graph['edge_uv'][edge_id].tolist()
+    offsets = csr_graph['geom_offsets']
+    edge_d = {
+        'uvkey': (int(csr_graph['node_ids'][u]), int(csr_graph['node_ids'][v]), 0),
+        'geometry': LineString(csr_graph['geom_coords'][offsets[edge_id]:offsets[edge_id+1]]),
+        'length': float(csr_graph['edge_length'][edge_id]),
+        'noises': {}
+        }
+    if ('edge_noises' in csr_graph):
+        edge_d['noises'] = { db: db_len for db, db_len in zip(csr_graph['dbs'], csr_graph['edge_noises'][edge_id].tolist()) if db_len > 0 }
+    return edge_d
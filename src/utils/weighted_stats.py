@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+def get_sorted_groups(values, group_idxs, group_count, weights=None):
+    # values sorted by group & value, with the first & last (+1) index of each group in the sorted values
+    order = np.lexsort((values, group_idxs))
+    group_idxs = group_idxs[order]
+    group_starts = np.searchsorted(group_idxs, np.arange(group_count), side='left')
+    group_ends = np.searchsorted(group_idxs, np.arange(group_count), side='right')
+    return values[order], group_idxs, weights[order] if weights is not None else None, group_starts, group_ends
+
+def get_group_quantiles(values, group_idxs, group_starts, group_ends, qs, weights=None):
+    '''
+    Function for calculating quantiles of sorted values of many groups at once (see get_sorted_groups). Without weights,
+    quantiles are interpolated linearly between ranks (as in np.percentile). With weights, each value is positioned at
+    the cumulative weight of the smaller values of the group relative to the total weight of the group without its last
+    value, so that the quantiles do not depend on the scale of the weights and equal weights give the same quantiles
+    as no weights (i / (n - 1)). Values must have positive weights (see get_stats_for_groups).
+    Returns
+    -------
+    <numpy array>
+        Quantiles (groups x qs), NaN for groups without values.
+    '''
+    group_count = len(group_starts)
+    quantiles = np.full((group_count, len(qs)), np.nan)
+    if (len(values) == 0):
+        return quantiles
+    if (weights is None):
+        ranks = np.arange(len(values)) - group_starts[group_idxs]
+        positions = ranks / np.maximum(group_ends - group_starts - 1, 1)[group_idxs]
+    else:
+        cum_weights = np.cumsum(weights)
+        group_offsets = np.concatenate([[0], cum_weights])[group_starts]
+        group_totals = np.bincount(group_idxs, weights=weights, minlength=group_count)
+        # the total weight without the last value is zero only for groups of one value
+        position_totals = (group_totals - weights[np.maximum(group_ends - 1, 0)])[group_idxs]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            positions = np.where(position_totals > 0, (cum_weights - weights - group_offsets[group_idxs]) / position_totals, 0)
+    # positions are within [0, 1] and increase within groups, so the keys are sorted over all groups
+    keys = 2 * group_idxs + positions
+    last_idxs = np.maximum(group_ends - 1, group_starts)
+    has_values = group_ends > group_starts
+    for q_idx, q in enumerate(qs):
+        target_keys = 2 * np.arange(group_count) + q
+        # quantiles below the first or above the last position of the group are the first or last value of the group
+        upper = np.clip(np.searchsorted(keys, target_keys, side='left'), group_starts, last_idxs)
+        lower = np.maximum(upper - 1, group_starts)
+        upper, lower = np.minimum(upper, len(values) - 1), np.minimum(lower, len(values) - 1)
+        span = keys[upper] - keys[lower]
+        ratio = np.clip((target_keys - keys[lower]) / np.where(span > 0, span, 1), 0, 1)
+        group_quantiles = np.where(span > 0, values[lower] + ratio * (values[upper] - values[lower]), values[upper])
+        quantiles[has_values, q_idx] = group_quantiles[has_values]
+    return quantiles
+
+def get_stats_for_groups(values, group_idxs, group_count, weights=None, percs=None, minmax=False):
+    '''
+    Function for calculating (weighted) mean, median, standard deviation and percentiles of values of many groups at once
+    directly from the values and weights (group_idxs are the groups of the values in range(group_count)).
+    Returns
+    -------
+    <dictionary>
+        Stats of the groups as arrays by stat (mean, median, std, p<perc>, min, max).
+    '''
+    if (weights is not None):
+        # values without weight do not affect the stats (groups without any weight get NaN stats)
+        positive = weights > 0
+        values, group_idxs, weights = values[positive], group_idxs[positive], weights[positive]
+    group_weights = np.bincount(group_idxs, weights=weights, minlength=group_count).astype(np.float64)
+    sums = np.bincount(group_idxs, weights=values * weights if weights is not None else values, minlength=group_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(group_weights > 0, sums / group_weights, np.nan)
+        sq_devs = (values - means[group_idxs])**2
+        sq_dev_sums = np.bincount(group_idxs, weights=sq_devs * weights if weights is not None else sq_devs, minlength=group_count)
+        stds = np.sqrt(sq_dev_sums / group_weights)
+    values, group_idxs, weights, group_starts, group_ends = get_sorted_groups(values, group_idxs, group_count, weights=weights)
+    percs = percs if percs is not None else []
+    quantiles = get_group_quantiles(values, group_idxs, group_starts, group_ends, [0.5] + [perc / 100 for perc in percs], weights=weights)
+    stats = { 'mean': means, 'median': quantiles[:, 0], 'std': stds }
+    for idx, perc in enumerate(percs):
+        stats['p'+ str(perc)] = quantiles[:, idx + 1]
+    if (minmax == True):
+        has_values = group_ends > group_starts
+        stats['min'] = np.where(has_values, values[np.minimum(group_starts, len(values) - 1)] if len(values) > 0 else np.nan, np.nan)
+        stats['max'] = np.where(has_values, values[np.maximum(group_ends - 1, 0)] if len(values) > 0 else np.nan, np.nan)
+    return stats
+
+def get_weighted_stats(values, weights=None, percs=None, minmax=False):
+    '''
+    Function for calculating (weighted) mean, median, standard deviation and percentiles of values (without repeating
+    the values by the weights). Standard deviation is the population standard deviation.
+    Returns
+    -------
+    <dictionary>
+        Stats of the values (mean, median, std, p<perc>, min, max).
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64) if weights is not None else None
+    stats = get_stats_for_groups(values, np.zeros(len(values), dtype=np.int64), 1, weights=weights, percs=percs, minmax=minmax)
+    return { stat: stat_values[0] for stat, stat_values in stats.items() }
+
+def get_grouped_weighted_stats(df, var_cols, group_col=None, weight_col=None, percs=None, minmax=False, col_prefixes=None, round_n=3):
+    '''
+    Function for calculating (weighted) stats of many columns of many groups (e.g. paths by origin) in one pass. NaN
+    values are left out of the stats of the column (e.g. ignored values can be mapped to NaN before).
+    Returns
+    -------
+    <DataFrame>
+        Stats of the groups (rows) in columns <prefix>_<stat> and the number of rows in the group (n).
+    '''
+    if (group_col is not None):
+        group_keys, group_idxs = np.unique(df[group_col].values, return_inverse=True)
+    else:
+        group_keys, group_idxs = [None], np.zeros(len(df.index), dtype=np.int64)
+    group_idxs = group_idxs.astype(np.int64)
+    weights = df[weight_col].values.astype(np.float64) if weight_col is not None else None
+    col_prefixes = col_prefixes if col_prefixes is not None else var_cols
+    stats_d = { 'n': np.bincount(group_idxs, minlength=len(group_keys)) }
+    for var_col, col_prefix in zip(var_cols, col_prefixes):
+        values = df[var_col].values.astype(np.float64)
+        valid = ~np.isnan(values)
+        var_stats = get_stats_for_groups(values[valid], group_idxs[valid], len(group_keys), weights=weights[valid] if weights is not None else None, percs=percs, minmax=minmax)
+        for stat, stat_values in var_stats.items():
+            stats_d[col_prefix +'_'+ stat] = np.round(stat_values, round_n) if round_n is not None else stat_values
+    stats_df = pd.DataFrame(stats_d)
+    if (group_col is not None):
+        stats_df.insert(0, group_col, group_keys)
+    return stats_df